@@ -1,18 +1,16 @@
 import os
 import json
 import pickle
-import pandas as pd
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.responses import JSONResponse
-from sklearn.preprocessing import LabelEncoder, StandardScaler
 import xgboost as xgb
 import uvicorn
 import os
 import json
 from datetime import datetime
 from typing import Dict, Any, List
-from fastapi import FastAPI, UploadFile, File, HTTPException, Body
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Request, Header
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from dotenv import load_dotenv
 from dataclasses import dataclass
 from typing import Dict, Any, Tuple, Optional
@@ -20,7 +18,7 @@ import numpy as np
 import torch
 import torch.nn as nn
 # Neo4j and LangChain imports
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, AsyncGraphDatabase
 from langchain_neo4j import GraphCypherQAChain, Neo4jGraph
 from langchain_openai import ChatOpenAI
 
@@ -29,6 +27,19 @@ load_dotenv()
 import json
 import re
 import math
+import random
+import tempfile
+import time
+import functools
+import hashlib
+import types
+import itertools
+import threading
+import collections
+import asyncio
+import concurrent.futures
+import multiprocessing
+from abc import ABC, abstractmethod
 from datetime import datetime
 from typing import Dict, Any, List
 from fastapi import UploadFile, File, HTTPException
@@ -48,46 +59,1224 @@ try:
     DEFAULT_GNN_HOPS = int(os.getenv("RGCN_HOPS", "5"))
 except Exception:
     DEFAULT_GNN_HOPS = 5
-    
+
+# ----------------- Triage batch defaults -----------------
+try:
+    TRIAGE_BATCH_CHUNK = int(os.getenv("TRIAGE_BATCH_CHUNK", "256"))
+except Exception:
+    TRIAGE_BATCH_CHUNK = 256
+
+# ----------------- Triage execution defaults -----------------
+# inline: score in the API process; process: score in a pool of pre-warmed worker processes
+TRIAGE_EXECUTOR = os.getenv("TRIAGE_EXECUTOR", "inline").strip().lower()
+try:
+    TRIAGE_WORKERS = int(os.getenv("TRIAGE_WORKERS", str(os.cpu_count() or 1)))
+except Exception:
+    TRIAGE_WORKERS = os.cpu_count() or 1
+# Alerts per pool task when a batch is spread over the workers
+try:
+    TRIAGE_POOL_CHUNK = int(os.getenv("TRIAGE_POOL_CHUNK", "32"))
+except Exception:
+    TRIAGE_POOL_CHUNK = 32
+# Pool workers start fresh (spawn or forkserver) and import this module themselves; forking the
+# API process (model, Neo4j driver threads, event loop) can deadlock the children
+TRIAGE_POOL_START = os.getenv("TRIAGE_POOL_START", "spawn").strip().lower()
+
+# ----------------- Execution lane defaults -----------------
+# Blocking work runs on bounded thread pools ("lanes"); a lane admits at most
+# WORKERS + QUEUE jobs and answers 503 + Retry-After beyond that.
+try:
+    EXEC_TRIAGE_WORKERS = int(os.getenv("EXEC_TRIAGE_WORKERS", str(os.cpu_count() or 1)))
+except Exception:
+    EXEC_TRIAGE_WORKERS = os.cpu_count() or 1
+try:
+    EXEC_TRIAGE_QUEUE = int(os.getenv("EXEC_TRIAGE_QUEUE", "256"))
+except Exception:
+    EXEC_TRIAGE_QUEUE = 256
+try:
+    EXEC_CPU_WORKERS = int(os.getenv("EXEC_CPU_WORKERS", str(os.cpu_count() or 1)))
+except Exception:
+    EXEC_CPU_WORKERS = os.cpu_count() or 1
+try:
+    EXEC_CPU_QUEUE = int(os.getenv("EXEC_CPU_QUEUE", "64"))
+except Exception:
+    EXEC_CPU_QUEUE = 64
+try:
+    EXEC_IO_WORKERS = int(os.getenv("EXEC_IO_WORKERS", "32"))
+except Exception:
+    EXEC_IO_WORKERS = 32
+try:
+    EXEC_IO_QUEUE = int(os.getenv("EXEC_IO_QUEUE", "256"))
+except Exception:
+    EXEC_IO_QUEUE = 256
+try:
+    EXEC_RETRY_AFTER = int(os.getenv("EXEC_RETRY_AFTER", "1"))
+except Exception:
+    EXEC_RETRY_AFTER = 1
+# Streaming endpoints wait EXEC_RETRY_AFTER between attempts while a lane is full, this many attempts per chunk
+try:
+    EXEC_RETRY_ATTEMPTS = int(os.getenv("EXEC_RETRY_ATTEMPTS", "30"))
+except Exception:
+    EXEC_RETRY_ATTEMPTS = 30
+
+# ----------------- Predict micro-batching defaults -----------------
+# Coalesce concurrent single-alert /predict calls into one model call (up to MAX rows, waiting at most WAIT_MS)
+PREDICT_MICROBATCH = os.getenv("PREDICT_MICROBATCH", "1").strip().lower() not in ("0", "false", "no")
+try:
+    PREDICT_BATCH_MAX = int(os.getenv("PREDICT_BATCH_MAX", "64"))
+except Exception:
+    PREDICT_BATCH_MAX = 64
+try:
+    PREDICT_BATCH_WAIT_MS = float(os.getenv("PREDICT_BATCH_WAIT_MS", "2"))
+except Exception:
+    PREDICT_BATCH_WAIT_MS = 2.0
+
+# ----------------- Classifier model defaults -----------------
+# Load the classifier at startup instead of on the first prediction
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "0").strip().lower() not in ("0", "false", "no", "")
+# After a failed load, answer 503 for this many seconds before trying the artifacts again
+try:
+    CLASSIFIER_RETRY_SECONDS = float(os.getenv("CLASSIFIER_RETRY_SECONDS", "30"))
+except Exception:
+    CLASSIFIER_RETRY_SECONDS = 30.0
+# Fold scaler.pkl into the booster's split thresholds at load (verified on probe rows, falls back if they differ)
+CLASSIFIER_FOLD_SCALER = os.getenv("CLASSIFIER_FOLD_SCALER", "1").strip().lower() not in ("0", "false", "no")
+try:
+    CLASSIFIER_FOLD_PROBES = int(os.getenv("CLASSIFIER_FOLD_PROBES", "20000"))
+except Exception:
+    CLASSIFIER_FOLD_PROBES = 20000
+# Inference backend: xgboost | treelite (tl2cgen shared library) | onnx (ONNX Runtime). Optional packages;
+# checked against XGBoost on the probe rows at load and falls back to xgboost when missing or different
+CLASSIFIER_BACKEND = os.getenv("CLASSIFIER_BACKEND", "xgboost").strip().lower()
+CLASSIFIER_BACKEND_CACHE = os.getenv("CLASSIFIER_BACKEND_CACHE", os.path.join(tempfile.gettempdir(), "alert-classifier"))
+try:
+    CLASSIFIER_BACKEND_TOLERANCE = float(os.getenv("CLASSIFIER_BACKEND_TOLERANCE", "1e-5"))
+except Exception:
+    CLASSIFIER_BACKEND_TOLERANCE = 1e-5
+# Per-model-version LRU of class probabilities keyed by the encoded feature row (0 disables; TTL 0 = no expiry)
+try:
+    CLASSIFIER_CACHE_SIZE = int(os.getenv("CLASSIFIER_CACHE_SIZE", "8192"))
+except Exception:
+    CLASSIFIER_CACHE_SIZE = 8192
+try:
+    CLASSIFIER_CACHE_TTL = float(os.getenv("CLASSIFIER_CACHE_TTL", "0"))
+except Exception:
+    CLASSIFIER_CACHE_TTL = 0.0
+
+# ----------------- Model registry defaults -----------------
+# Percentage of classifier/GNN calls also scored on a loaded candidate model (0 = no shadow scoring)
+try:
+    MODEL_SHADOW_PERCENT = float(os.getenv("MODEL_SHADOW_PERCENT", "0"))
+except Exception:
+    MODEL_SHADOW_PERCENT = 0.0
+# Sources passed to /models/{kind}/load must live under one of these folders (os.pathsep-separated;
+# default: the shipped models-50 and models folders next to this file). Loading unpickles / torch.loads the source.
+MODEL_REGISTRY_ROOT = os.getenv("MODEL_REGISTRY_ROOT", os.pathsep.join(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), name) for name in ("models-50", "models")))
+# The /models/{kind} load, promote, rollback, shadow and candidate endpoints answer 403 unless enabled
+MODEL_REGISTRY_ADMIN = os.getenv("MODEL_REGISTRY_ADMIN", "0").strip().lower() not in ("0", "false", "no", "")
+
+# ----------------- Predict streaming defaults -----------------
+# /predict/batch scores NDJSON uploads PREDICT_STREAM_CHUNK rows at a time; longer lines than MAX_LINE bytes are rejected
+try:
+    PREDICT_STREAM_CHUNK = int(os.getenv("PREDICT_STREAM_CHUNK", "256"))
+except Exception:
+    PREDICT_STREAM_CHUNK = 256
+try:
+    PREDICT_STREAM_MAX_LINE = int(os.getenv("PREDICT_STREAM_MAX_LINE", str(8 * 1024 * 1024)))
+except Exception:
+    PREDICT_STREAM_MAX_LINE = 8 * 1024 * 1024
+
+# ----------------- Response profile defaults -----------------
+# Shape of /triage and /predict responses when the request does not pass ?profile=
+#   full - everything (previous behaviour); standard - without the per-feature and duplicated
+#   attribute blocks; minimal - verdict and score only
+RESPONSE_PROFILE = os.getenv("RESPONSE_PROFILE", "full").strip().lower()
+
+# ----------------- Graph ingestion defaults -----------------
+# unwind: each alert (or list of alerts) is written by one UNWIND statement in one explicit transaction;
+# statements: the previous one auto-commit statement per node / relationship
+GRAPH_INGEST_MODE = os.getenv("GRAPH_INGEST_MODE", "unwind").strip().lower()
+# Ensure graph constraints / lookup indexes at startup (recorded as a SchemaVersion node; skipped when current)
+GRAPH_SCHEMA_BOOTSTRAP = os.getenv("GRAPH_SCHEMA_BOOTSTRAP", "1").strip().lower() not in ("0", "false", "no")
+# A failed startup bootstrap is retried on ingest, at most once per this many seconds
+try:
+    GRAPH_SCHEMA_RETRY_SECONDS = float(os.getenv("GRAPH_SCHEMA_RETRY_SECONDS", "30"))
+except Exception:
+    GRAPH_SCHEMA_RETRY_SECONDS = 30.0
+# Shared entities (host, user, site, group, engine, OS) recently written by this process with the same
+# properties are not re-SET on ingest (0 disables; TTL bounds how long writes from elsewhere can be masked)
+try:
+    GRAPH_ENTITY_CACHE_SIZE = int(os.getenv("GRAPH_ENTITY_CACHE_SIZE", "10000"))
+except Exception:
+    GRAPH_ENTITY_CACHE_SIZE = 10000
+try:
+    GRAPH_ENTITY_CACHE_TTL = float(os.getenv("GRAPH_ENTITY_CACHE_TTL", "300"))
+except Exception:
+    GRAPH_ENTITY_CACHE_TTL = 300.0
+# Alerts per write transaction for /create-graph/batch
+try:
+    GRAPH_BATCH_CHUNK = int(os.getenv("GRAPH_BATCH_CHUNK", "500"))
+except Exception:
+    GRAPH_BATCH_CHUNK = 500
+
+# ----------------- Neo4j async driver defaults -----------------
+# Graph ingestion and GNN k-hop reads use an AsyncGraphDatabase driver (awaited on the event loop
+# instead of holding an io-lane thread per query); 0 keeps them on the synchronous driver
+NEO4J_ASYNC = os.getenv("NEO4J_ASYNC", "1").strip().lower() not in ("0", "false", "no")
+try:
+    NEO4J_POOL_SIZE = int(os.getenv("NEO4J_POOL_SIZE", "50"))
+except Exception:
+    NEO4J_POOL_SIZE = 50
+# Seconds to wait for a free pooled connection before failing the query
+try:
+    NEO4J_POOL_ACQUIRE_TIMEOUT = float(os.getenv("NEO4J_POOL_ACQUIRE_TIMEOUT", "10"))
+except Exception:
+    NEO4J_POOL_ACQUIRE_TIMEOUT = 10.0
+# Recycle pooled connections after this many seconds (below typical load balancer idle cut-offs)
+try:
+    NEO4J_CONNECTION_LIFETIME = float(os.getenv("NEO4J_CONNECTION_LIFETIME", "1800"))
+except Exception:
+    NEO4J_CONNECTION_LIFETIME = 1800.0
+
+# ----------------- Cascade defaults -----------------
+# Triage scores strictly inside (LOW, HIGH) are uncertain and go on to the classifier;
+# classifier confidence below CASCADE_XGB_CONFIDENCE goes on to the GNN.
+try:
+    CASCADE_BAND_LOW = float(os.getenv("CASCADE_BAND_LOW", "0"))
+except Exception:
+    CASCADE_BAND_LOW = 0.0
+try:
+    CASCADE_BAND_HIGH = float(os.getenv("CASCADE_BAND_HIGH", "100"))
+except Exception:
+    CASCADE_BAND_HIGH = 100.0
+try:
+    CASCADE_XGB_CONFIDENCE = float(os.getenv("CASCADE_XGB_CONFIDENCE", "0.8"))
+except Exception:
+    CASCADE_XGB_CONFIDENCE = 0.8
+
+# ----------------- Triage tracing defaults -----------------
+# Trace 1 in N triage requests (0 = only when the X-Triage-Trace header asks for it)
+try:
+    TRIAGE_TRACE_SAMPLE = int(os.getenv("TRIAGE_TRACE_SAMPLE", "0"))
+except Exception:
+    TRIAGE_TRACE_SAMPLE = 0
+try:
+    TRIAGE_TRACE_BUFFER = int(os.getenv("TRIAGE_TRACE_BUFFER", "200"))
+except Exception:
+    TRIAGE_TRACE_BUFFER = 200
+
+class ExecutorOverloaded(HTTPException):
+    """An execution lane is full; FastAPI turns this into 503 with a Retry-After header"""
+
+    def __init__(self, lane: str, retry_after: int = 1):
+        super().__init__(status_code=503, detail=f"Server busy: the '{lane}' queue is full, retry later.",
+                         headers={"Retry-After": str(retry_after)})
+        self.lane = lane
+
+class BoundedExecutor:
+    """
+    Thread pool with admission control: at most workers + queue_size jobs are admitted
+    (running or waiting) and further submissions fail fast with ExecutorOverloaded.
+    A slot is released when the job finishes, even if the awaiting request went away.
+    """
+
+    def __init__(self, name: str, workers: int, queue_size: int, retry_after: int = 1):
+        self.name = name
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.retry_after = retry_after
+        self._pool = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix=f"{name}-lane")
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, fn, *args, executor: Optional[concurrent.futures.Executor] = None, **kwargs) -> concurrent.futures.Future:
+        """Admit and submit fn to this lane's pool (or `executor`, e.g. a process pool)"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise ExecutorOverloaded(self.name, self.retry_after)
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = (executor or self._pool).submit(fn, *args, **kwargs)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _future):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+        self._slots.release()
+
+    async def run(self, fn, *args, executor: Optional[concurrent.futures.Executor] = None, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, executor=executor, **kwargs))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"workers": self.workers, "queue_size": self.queue_size, "in_flight": self.in_flight,
+                    "completed": self.completed, "rejected": self.rejected}
+
+# triage: rule-based scoring; cpu: classifier/torch inference; io: Neo4j, LLM and HTTP calls
+EXECUTION_LANES = {
+    "triage": BoundedExecutor("triage", EXEC_TRIAGE_WORKERS, EXEC_TRIAGE_QUEUE, EXEC_RETRY_AFTER),
+    "cpu": BoundedExecutor("cpu", EXEC_CPU_WORKERS, EXEC_CPU_QUEUE, EXEC_RETRY_AFTER),
+    "io": BoundedExecutor("io", EXEC_IO_WORKERS, EXEC_IO_QUEUE, EXEC_RETRY_AFTER),
+}
+
+async def offload(lane: str, fn, *args, **kwargs):
+    """Run a blocking call on an execution lane without blocking the event loop"""
+    return await EXECUTION_LANES[lane].run(fn, *args, **kwargs)
+
+async def retry_overloaded(fn, *args):
+    """
+    Await fn(*args) from a response that has already started streaming: while a lane is full, wait
+    EXEC_RETRY_AFTER and try again, at most EXEC_RETRY_ATTEMPTS times, then re-raise ExecutorOverloaded.
+    """
+    attempts = max(1, EXEC_RETRY_ATTEMPTS)
+    for attempt in range(1, attempts + 1):
+        try:
+            return await fn(*args)
+        except ExecutorOverloaded:
+            if attempt == attempts:
+                raise
+            await asyncio.sleep(EXEC_RETRY_AFTER)
+
+class TriageTrace:
+    """Structured events for one sampled triage request (values are kept raw, formatted on read)"""
+    __slots__ = ("trace_id", "reason", "started_at", "_t0", "events")
+
+    def __init__(self, trace_id: str, reason: str):
+        self.trace_id = trace_id
+        self.reason = reason
+        self.started_at = datetime.utcnow().isoformat()
+        self._t0 = time.perf_counter()
+        self.events: List[tuple] = []
+
+    def record(self, event: str, **fields):
+        self.events.append((time.perf_counter() - self._t0, event, fields))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "reason": self.reason,
+            "started_at": self.started_at,
+            "events": [
+                {"event": event, "elapsed_ms": round(elapsed * 1000, 3), **fields}
+                for elapsed, event, fields in self.events
+            ],
+        }
+
+class TriageTracer:
+    """Per-request sampling into a bounded in-memory ring buffer"""
+
+    def __init__(self, sample_every: int = 0, capacity: int = 200):
+        self.sample_every = sample_every
+        self._seq = itertools.count(1)
+        self._buffer = collections.deque(maxlen=max(1, capacity))
+        self._lock = threading.Lock()
+        self.traced = 0
+
+    def start(self, force: bool = False) -> Optional[TriageTrace]:
+        """Return a trace for this request, or None when it is not sampled"""
+        seq = next(self._seq)
+        if force:
+            reason = "requested"
+        elif self.sample_every > 0 and seq % self.sample_every == 0:
+            reason = "sampled"
+        else:
+            return None
+        return TriageTrace(f"tr-{seq}", reason)
+
+    def finish(self, trace: Optional[TriageTrace]):
+        if trace is None:
+            return
+        trace.record("done")
+        with self._lock:
+            self._buffer.append(trace)
+            self.traced += 1
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent traces first"""
+        with self._lock:
+            traces = list(self._buffer)[-limit:] if limit > 0 else []
+        return [t.to_dict() for t in reversed(traces)]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            traced, buffered = self.traced, len(self._buffer)
+        return {"sample_every": self.sample_every, "capacity": self._buffer.maxlen,
+                "traced": traced, "buffered": buffered}
+
+triage_tracer = TriageTracer(TRIAGE_TRACE_SAMPLE, TRIAGE_TRACE_BUFFER)
+
+# ----------------- Triage result cache defaults -----------------
+# Max cached triage results (0 disables the cache) and their lifetime in seconds (0 = no expiry)
+try:
+    TRIAGE_CACHE_SIZE = int(os.getenv("TRIAGE_CACHE_SIZE", "4096"))
+except Exception:
+    TRIAGE_CACHE_SIZE = 4096
+try:
+    TRIAGE_CACHE_TTL = float(os.getenv("TRIAGE_CACHE_TTL", "300"))
+except Exception:
+    TRIAGE_CACHE_TTL = 300.0
+
+class LRUTTLCache:
+    """Thread-safe bounded LRU cache with a per-entry TTL and hit/miss counters"""
+
+    def __init__(self, maxsize: int, ttl: float = 0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "collections.OrderedDict[Any, Tuple[float, Any]]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (self.ttl > 0 and now - entry[0] > self.ttl):
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Any, value: Any, replace_if=None):
+        """Store value; with `replace_if(current_value)`, a live entry is only replaced when it returns True"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if replace_if is not None:
+                entry = self._data.get(key)
+                if entry is not None and not (self.ttl > 0 and now - entry[0] > self.ttl) and not replace_if(entry[1]):
+                    return
+            self._data[key] = (now, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key: Any):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"size": len(self._data), "maxsize": self.maxsize, "ttl_seconds": self.ttl,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
+
+# Per-file-hash cache of computed VirusTotal (Agent2) blocks (0 disables) and its TTL (0 = until a fresher scan)
+try:
+    TRIAGE_VT_CACHE_SIZE = int(os.getenv("TRIAGE_VT_CACHE_SIZE", "8192"))
+except Exception:
+    TRIAGE_VT_CACHE_SIZE = 8192
+try:
+    TRIAGE_VT_CACHE_TTL = float(os.getenv("TRIAGE_VT_CACHE_TTL", "0"))
+except Exception:
+    TRIAGE_VT_CACHE_TTL = 0.0
+
+def canonical_digest(obj: Any) -> str:
+    """sha256 of the canonical JSON form of obj (sorted keys, compact separators)"""
+    payload = json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
 class BaseAgent:
     def __init__(self, role: str, tools: List[str]):
         self.role = role
         self.tools = tools
         self.context = {}
         
+_INDEX_RE = re.compile(r'\[\d+\]')
+
+@functools.lru_cache(maxsize=64)
+def _compile_flatten_paths(paths: frozenset) -> Tuple[frozenset, frozenset]:
+    """Split requested paths into leaves (taken with their whole subtree) and the prefixes leading to them"""
+    prefixes = set()
+    for path in paths:
+        for i, ch in enumerate(path):
+            if i > 0 and ch in ".[":
+                prefixes.add(path[:i])
+    return frozenset(paths), frozenset(prefixes)
+
+def _match_flatten_path(pattern: str, leaves: frozenset, prefixes: frozenset) -> Optional[bool]:
+    """True: take the whole subtree, False: descend, None: skip"""
+    if pattern in leaves:
+        return True
+    if pattern in prefixes:
+        return False
+    # Already-flattened input may carry compound keys such as "enrichments[0].data.positives"
+    for i, ch in enumerate(pattern):
+        if i > 0 and ch in ".[" and pattern[:i] in leaves:
+            return True
+    return None
+
+def flatten_projected(obj: Any, parent_key: str = "", paths=None, max_list: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Iteratively flattens dicts/lists into dotted keys and list indices (same keys and
+    order as the recursive flatteners, without per-level dict copies).
+    `paths` restricts the walk to the given keys and everything beneath them; list
+    indices are written as [*], e.g. {"severity_id", "enrichments[*].data"}.
+    `max_list` caps how many items of each list are visited.
+    """
+    flat: Dict[str, Any] = {}
+    if paths is not None:
+        leaves, prefixes = _compile_flatten_paths(frozenset(paths))
+    # Stack entries: (key, [*]-pattern or None once the whole subtree is wanted, value)
+    stack = [(parent_key, None if paths is None else parent_key, obj)]
+    while stack:
+        key, pattern, value = stack.pop()
+        if isinstance(value, dict):
+            children = []
+            for k, v in value.items():
+                nk = f"{key}.{k}" if key else k
+                if pattern is None:
+                    children.append((nk, None, v))
+                    continue
+                if "[" in k:
+                    k = _INDEX_RE.sub("[*]", k)
+                child = f"{pattern}.{k}" if pattern else k
+                match = _match_flatten_path(child, leaves, prefixes)
+                if match is not None:
+                    children.append((nk, None if match else child, v))
+            stack.extend(reversed(children))
+        elif isinstance(value, list):
+            items = value if max_list is None else value[:max_list]
+            if pattern is None:
+                stack.extend((f"{key}[{i}]", None, v) for i, v in reversed(list(enumerate(items))))
+                continue
+            child = f"{pattern}[*]"
+            match = _match_flatten_path(child, leaves, prefixes)
+            if match is not None:
+                stack.extend((f"{key}[{i}]", None if match else child, v) for i, v in reversed(list(enumerate(items))))
+        else:
+            flat[key] = value
+    return flat
+
+def alert_has_fields(raw: Any) -> bool:
+    """Whether the full (unprojected) flatten_alert of raw is non-empty; stops at the first leaf"""
+    if not isinstance(raw, (dict, list)):
+        return False
+    stack = [raw]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+        else:
+            return True
+    return False
+
+
+class TriageRule(ABC):
+    """Base class for one compiled entry of ScoringTool.RULES"""
+
+    # Rules whose result depends on the wall clock are never served from the VT score cache
+    time_dependent = False
+
+    def __init__(self, spec: Dict[str, Any], tool: type):
+        self.name = spec["name"]
+        self.agent = spec["agent"]
+        self.field = spec.get("field")
+        self.description = spec.get("description", "")
+
+    def reads(self) -> List[str]:
+        """Flattened alert paths (Agent1) or vt_values fields (Agent2) this rule reads"""
+        return [self.field] if self.field else []
+
+    @abstractmethod
+    def evaluate(self, ctx: Dict[str, Any]) -> Optional[dict]:
+        """Attribute dict for one alert context, or None when the rule does not apply"""
+
+    def evaluate_column(self, ctxs: List[Dict[str, Any]]) -> List[Optional[dict]]:
+        """Evaluate the rule for every row of a batch; numeric rules override this with NumPy"""
+        return [self.evaluate(ctx) for ctx in ctxs]
+
+    def _attr(self, value: Any, risk: Any, description: Optional[str] = None, **fmt) -> dict:
+        return {
+            "value": value,
+            "risk_score": risk,
+            "description": (description or self.description).format(value=value, **fmt)
+        }
+
+
+class ScaleRule(TriageRule):
+    """risk = int(field) * factor, always reported"""
+
+    def __init__(self, spec, tool):
+        super().__init__(spec, tool)
+        self.factor = spec["factor"]
+        self.default = spec.get("default", 0)
+
+    def evaluate(self, ctx):
+        value = int(ctx.get(self.field, self.default))
+        return self._attr(value, value * self.factor)
+
+
+class SigningRule(TriageRule):
+    """Verification type + certificate validity matched against an ordered case list"""
+
+    def __init__(self, spec, tool):
+        super().__init__(spec, tool)
+        self.cert_field = spec["cert_field"]
+        self.cases = spec["cases"]
+
+    def reads(self):
+        return [self.field, self.cert_field]
+
+    def evaluate(self, ctx):
+        fv = (ctx.get(self.field) or "").lower()
+        vc = bool(ctx.get(self.cert_field, False))
+        for case in self.cases:
+            if fv != case["type"]:
+                continue
+            if "certificate_valid" in case and case["certificate_valid"] != vc:
+                continue
+            return self._attr(case.get("value") or fv, case["risk"], case["description"])
+        return None
+
+
+class RegexRule(TriageRule):
+    """Fixed risk when one of the ScoringTool regexes matches the field"""
+
+    def __init__(self, spec, tool):
+        super().__init__(spec, tool)
+        self.pattern = getattr(tool, spec["regex"])
+        self.risk = spec["risk"]
+
+    def evaluate(self, ctx):
+        text = ctx.get(self.field) or ""
+        if self.pattern.search(str(text)):
+            return self._attr(text, self.risk)
+        return None
+
+
+class ContainsAnyRule(TriageRule):
+    """Fixed risk when the lowercased field contains any token of a ScoringTool set"""
+
+    def __init__(self, spec, tool):
+        super().__init__(spec, tool)
+        self.tokens = tuple(sorted(getattr(tool, spec["table"])))
+        self.risk = spec["risk"]
+
+    def evaluate(self, ctx):
+        text = str(ctx.get(self.field) or "").lower()
+        if any(token in text for token in self.tokens):
+            return self._attr(text, self.risk)
+        return None
+
+
+class LookupRule(TriageRule):
+    """Lowercased field looked up in a ScoringTool weight table, always reported"""
+
+    def __init__(self, spec, tool):
+        super().__init__(spec, tool)
+        self.table = dict(getattr(tool, spec["table"]))
+        self.default = spec.get("default", 0)
+
+    def evaluate(self, ctx):
+        value = str(ctx.get(self.field) or "").lower()
+        return self._attr(value, self.table.get(value, self.default))
+
+
+class EngineRule(TriageRule):
+    """Detection engine title weighted case-insensitively, always reported"""
+
+    def __init__(self, spec, tool):
+        super().__init__(spec, tool)
+        self.weights: Dict[str, int] = {}
+        for key, w in getattr(tool, spec["table"]).items():
+            self.weights.setdefault(key.lower(), w)
+
+    def evaluate(self, ctx):
+        engs = ctx.get(self.field) or []
+        e_name = "unknown"
+        if engs and isinstance(engs, list) and isinstance(engs[0], dict) and "title" in engs[0]:
+            e_name = engs[0]["title"]
+        weight = self.weights.get(e_name.strip().lower(), 0) if e_name else 0
+        return self._attr(e_name, weight)
+
+
+class MembershipRule(TriageRule):
+    """Risk when the field is one of `members`; other non-empty values get `otherwise_risk`"""
+
+    def __init__(self, spec, tool):
+        super().__init__(spec, tool)
+        self.members = frozenset(spec["members"])
+        self.risk = spec["risk"]
+        self.otherwise_risk = spec["otherwise_risk"]
+        self.otherwise_description = spec["otherwise_description"]
+
+    def evaluate(self, ctx):
+        value = ctx.get(self.field) or ""
+        if str(value).lower() in self.members:
+            return self._attr(value, self.risk)
+        if value:
+            return self._attr(value, self.otherwise_risk, self.otherwise_description)
+        return None
+
+
+class VtLog2Rule(TriageRule):
+    """risk = sign * min(factor * log2(count + 1), cap) when count > 0"""
+
+    def __init__(self, spec, tool):
+        super().__init__(spec, tool)
+        self.factor = spec["factor"]
+        self.cap = spec["cap"]
+        self.sign = spec.get("sign", 1)
+
+    def evaluate(self, ctx):
+        value = ctx.get(self.field, 0)
+        if value > 0:
+            risk = min(self.factor * math.log2(value + 1), self.cap)
+            return self._attr(value, risk if self.sign > 0 else -risk)
+        return None
+
+    def evaluate_column(self, ctxs):
+        x = np.array([ctx.get(self.field, 0) for ctx in ctxs], dtype=np.int64)
+        out: List[Optional[dict]] = [None] * len(ctxs)
+        for i in np.flatnonzero(x > 0).tolist():
+            # Same arithmetic as evaluate (math.log2, Python min keeping an int cap), so both paths emit the same JSON
+            value = int(x[i])
+            risk = min(self.factor * math.log2(value + 1), self.cap)
+            out[i] = self._attr(value, risk if self.sign > 0 else -risk)
+        return out
+
+
+class VtRatioRule(TriageRule):
+    """risk = min(factor * positives / total, cap) when both are > 0"""
+
+    def __init__(self, spec, tool):
+        super().__init__(spec, tool)
+        self.total_field = spec["total_field"]
+        self.factor = spec["factor"]
+        self.cap = spec["cap"]
+
+    def reads(self):
+        return [self.field, self.total_field]
+
+    def evaluate(self, ctx):
+        positives = ctx.get(self.field, 0)
+        total = ctx.get(self.total_field, 0)
+        if total > 0 and positives > 0:
+            ratio = positives / total
+            return self._attr(f"{positives}/{total}", min(self.factor * ratio, self.cap), ratio=ratio)
+        return None
+
+    def evaluate_column(self, ctxs):
+        positives = np.array([ctx.get(self.field, 0) for ctx in ctxs], dtype=np.int64)
+        total = np.array([ctx.get(self.total_field, 0) for ctx in ctxs], dtype=np.int64)
+        hit = np.flatnonzero((total > 0) & (positives > 0))
+        ratio = positives[hit] / total[hit]
+        scaled = self.factor * ratio
+        out: List[Optional[dict]] = [None] * len(ctxs)
+        for i, q, s in zip(hit.tolist(), ratio.tolist(), scaled.tolist()):
+            out[i] = self._attr(f"{positives[i]}/{total[i]}", min(s, self.cap), ratio=q)
+        return out
+
+
+class VtAgeRule(TriageRule):
+    """risk = min(days_old / days_per_point, cap) once the VT scan is older than min_days"""
+
+    time_dependent = True
+
+    def __init__(self, spec, tool):
+        super().__init__(spec, tool)
+        self.min_days = spec["min_days"]
+        self.days_per_point = spec["days_per_point"]
+        self.cap = spec["cap"]
+        self.value_template = spec["value"]
+
+    @staticmethod
+    def scan_timestamp(scan_time: Any) -> Optional[int]:
+        """Parse a VT scan_time (ISO-8601 or epoch seconds); None when absent or malformed"""
+        if not scan_time:
+            return None
+        try:
+            if isinstance(scan_time, str):
+                return int(datetime.fromisoformat(scan_time.replace('Z', '+00:00')).timestamp())
+            return int(scan_time)
+        except (ValueError, TypeError):
+            return None
+
+    def _evaluate_at(self, ctx, now: int):
+        scan_timestamp = self.scan_timestamp(ctx.get(self.field))
+        if scan_timestamp is None:
+            return None
+        days_old = (now - scan_timestamp) / (24 * 3600)
+        if days_old > self.min_days:
+            value = self.value_template.format(days=days_old)
+            return self._attr(value, min(days_old / self.days_per_point, self.cap), days=days_old)
+        return None
+
+    def evaluate(self, ctx):
+        return self._evaluate_at(ctx, int(time.time()))
+
+    def evaluate_column(self, ctxs):
+        now = int(time.time())
+        return [self._evaluate_at(ctx, now) for ctx in ctxs]
+
+
+class VtSumRule(TriageRule):
+    """Fixed risk when the sum of several VT counters exceeds a threshold"""
+
+    def __init__(self, spec, tool):
+        super().__init__(spec, tool)
+        self.fields = spec["fields"]
+        self.threshold = spec["threshold"]
+        self.risk = spec["risk"]
+
+    def reads(self):
+        return list(self.fields)
+
+    def evaluate(self, ctx):
+        total = sum(ctx.get(f, 0) for f in self.fields)
+        if total > self.threshold:
+            return self._attr(total, self.risk)
+        return None
+
+    def evaluate_column(self, ctxs):
+        totals = np.array([[ctx.get(f, 0) for f in self.fields] for ctx in ctxs], dtype=np.int64).sum(axis=1)
+        out: List[Optional[dict]] = [None] * len(ctxs)
+        for i in np.flatnonzero(totals > self.threshold).tolist():
+            out[i] = self._attr(int(totals[i]), self.risk)
+        return out
+
+
+RULE_KINDS = {
+    "scale": ScaleRule,
+    "signing": SigningRule,
+    "regex": RegexRule,
+    "contains_any": ContainsAnyRule,
+    "lookup": LookupRule,
+    "engine": EngineRule,
+    "membership": MembershipRule,
+    "vt_log2": VtLog2Rule,
+    "vt_ratio": VtRatioRule,
+    "vt_age": VtAgeRule,
+    "vt_sum": VtSumRule,
+}
+
+
+class CompiledRuleSet:
+    """
+    Single-pass evaluator built from ScoringTool.RULES.
+    One walk over the flattened alert collects every Agent1 field and every
+    enrichments[i].data.* value; all rules then run against those lookups.
+    """
+
+    ENRICHMENT_PREFIX = "enrichments["
+    ENRICHMENT_DATA = "].data."
+
+    def __init__(self, rules: List[TriageRule], vt_key_map: Dict[str, str], vt_count_fields: List[str],
+                 hash_field: Optional[str] = None, vt_cache_size: int = 0, vt_cache_ttl: float = 0):
+        self.agent1 = [r for r in rules if r.agent == 1]
+        self.agent2 = [r for r in rules if r.agent == 2]
+        self.hash_field = hash_field
+        self.fields = frozenset(f for r in self.agent1 for f in r.reads()) | ({hash_field} if hash_field else frozenset())
+        self.vt_keys = frozenset(vt_key_map)
+        # Everything the evaluator reads, for ScoringTool.flatten_alert(paths=...)
+        self.paths = self.fields | {f"enrichments[*].data.{k}" for k in vt_key_map}
+        self.vt_key_map = vt_key_map
+        self.vt_count_fields = vt_count_fields
+        self.scan_key = next((k for k, alias in vt_key_map.items() if alias == "scan_time"), None)
+        # file hash -> (selected bucket's scan timestamp, vt_values, time-independent Agent2 attributes).
+        # Lives on the compiled rule set, so recompiling after a weight change drops it.
+        self.vt_cache = LRUTTLCache(vt_cache_size if hash_field and self.scan_key else 0, vt_cache_ttl)
+
+    def extract(self, flat: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[int, Dict[str, Any]]]:
+        """
+        Collect Agent1 fields and enrichment buckets in one traversal.
+        Only VirusTotal counters (VT_KEY_MAP keys) open a bucket, so the result is the
+        same whether `flat` is a full or a path-projected flattening.
+        """
+        fields: Dict[str, Any] = {}
+        buckets: Dict[int, Dict[str, Any]] = {}
+        wanted = self.fields
+        vt_keys = self.vt_keys
+        prefix = self.ENRICHMENT_PREFIX
+        data = self.ENRICHMENT_DATA
+        for k, v in flat.items():
+            if k in wanted:
+                fields[k] = v
+            elif k.startswith(prefix):
+                close = k.find(data, len(prefix))
+                idx = k[len(prefix):close]
+                subkey = k[close + len(data):]
+                if close < 0 or not idx.isdecimal() or subkey not in vt_keys:
+                    continue
+                buckets.setdefault(int(idx), {})[subkey] = v
+        return fields, buckets
+
+    @staticmethod
+    def select_bucket(buckets: Dict[int, Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """The strongest VirusTotal enrichment bucket (the one vt_values reads), or None without enrichments"""
+        if not buckets:
+            return None
+
+        def _to_int(x):
+            try:
+                return int(x)
+            except Exception:
+                return 0
+
+        def _vt_signal(d: Dict[str, Any]) -> int:
+            return (
+                _to_int(d.get("positives", 0)) +
+                _to_int(d.get("malicious", 0)) +
+                _to_int(d.get("suspicious", 0)) +
+                _to_int(d.get("stats.malicious", 0)) +
+                _to_int(d.get("stats.suspicious", 0))
+            )
+
+        return max(buckets.values(), key=_vt_signal)
+
+    def vt_values(self, buckets: Dict[int, Dict[str, Any]], chosen: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Pick the strongest VirusTotal enrichment bucket and normalize it into vt_values (pass `chosen` if already selected)"""
+        vt_values: Dict[str, Any] = {}
+        if not buckets:
+            # Initialize defaults if no enrichments present
+            for alias in self.vt_count_fields:
+                vt_values[alias] = 0
+            vt_values["scan_time"] = None
+            return vt_values
+
+        if chosen is None:
+            chosen = self.select_bucket(buckets)
+        for key, alias in self.vt_key_map.items():
+            raw_value = chosen.get(key)
+            if raw_value is None:
+                continue
+            if alias == "scan_time":
+                vt_values[alias] = str(raw_value)
+            else:
+                try:
+                    vt_values[alias] = int(raw_value)
+                except (ValueError, TypeError):
+                    vt_values[alias] = 0
+        return vt_values
+
+    @staticmethod
+    def _apply(rules: List[TriageRule], ctx: Dict[str, Any], trace: Optional[TriageTrace] = None) -> Dict[str, dict]:
+        scores = {}
+        for rule in rules:
+            attr = rule.evaluate(ctx)
+            if attr is not None:
+                scores[rule.name] = attr
+            if trace is not None:
+                trace.record("rule", rule=rule.name, agent=rule.agent, fired=attr is not None,
+                             value=attr["value"] if attr is not None else None,
+                             risk_score=attr["risk_score"] if attr is not None else 0)
+        return scores
+
+    def _vt_cache_lookup(self, fields: Dict[str, Any], chosen: Optional[Dict[str, Any]]) -> Tuple[Optional[tuple], Optional[tuple]]:
+        """
+        (cache key, reusable entry). The key is (file hash, scan_time of the selected bucket) and is
+        None when the alert has no hash or that bucket has no parsable scan_time; the entry is
+        returned only when the cached scan is as fresh as the alert's.
+        """
+        if not self.vt_cache.enabled or chosen is None:
+            return None, None
+        file_hash = fields.get(self.hash_field)
+        if not file_hash or not isinstance(file_hash, str):
+            return None, None
+        scanned = VtAgeRule.scan_timestamp(chosen.get(self.scan_key))
+        if scanned is None:
+            return None, None
+        key = (file_hash, scanned)
+        entry = self.vt_cache.get(file_hash)
+        if entry is not None and entry[0] >= key[1]:
+            return key, entry
+        return key, None
+
+    def _vt_cache_store(self, key: tuple, vt_values: Dict[str, Any], scores: Dict[str, dict]):
+        file_hash, scanned = key
+        static = {name: attr for name, attr in scores.items() if name not in self._time_dependent_names}
+        self.vt_cache.put(file_hash, (scanned, vt_values, static), replace_if=lambda cur: scanned > cur[0])
+
+    @functools.cached_property
+    def _time_dependent_names(self) -> frozenset:
+        return frozenset(r.name for r in self.agent2 if r.time_dependent)
+
+    def _vt_from_entry(self, entry: tuple) -> Dict[str, dict]:
+        """Agent2 block from a cached entry; clock-dependent rules are re-evaluated, table order is kept"""
+        _, vt_values, static = entry
+        scores = {}
+        for rule in self.agent2:
+            attr = rule.evaluate(vt_values) if rule.time_dependent else static.get(rule.name)
+            if attr is not None:
+                scores[rule.name] = attr
+        return scores
+
+    def evaluate(self, flat: Dict[str, Any], trace: Optional[TriageTrace] = None) -> Tuple[Dict[str, dict], Dict[str, dict]]:
+        """Agent1 and Agent2 attribute blocks for one flattened alert; rule decisions go to `trace` if given"""
+        fields, buckets = self.extract(flat)
+        agent1_scores = self._apply(self.agent1, fields, trace)
+        chosen = self.select_bucket(buckets)
+        cache_key, entry = self._vt_cache_lookup(fields, chosen)
+        if entry is not None:
+            if trace is not None:
+                trace.record("vt_cache", status="hit", file_hash=cache_key[0], cached_scan=entry[0],
+                             alert_scan=cache_key[1], vt_values=dict(entry[1]))
+            return agent1_scores, self._vt_from_entry(entry)
+        vt_values = self.vt_values(buckets, chosen)
+        if trace is not None:
+            trace.record("extract", fields=len(fields), vt_buckets=len(buckets), vt_values=dict(vt_values))
+        agent2_scores = self._apply(self.agent2, vt_values, trace)
+        if cache_key is not None:
+            self._vt_cache_store(cache_key, vt_values, agent2_scores)
+        return agent1_scores, agent2_scores
+
+    @staticmethod
+    def _apply_columns(rules: List[TriageRule], ctxs: List[Dict[str, Any]]) -> Tuple[List[Dict[str, dict]], np.ndarray]:
+        n = len(ctxs)
+        scores: List[Dict[str, dict]] = [{} for _ in range(n)]
+        risk = np.zeros((len(rules), n), dtype=np.float64)
+        for j, rule in enumerate(rules):
+            for i, attr in enumerate(rule.evaluate_column(ctxs)):
+                if attr is not None:
+                    scores[i][rule.name] = attr
+                    risk[j, i] = attr["risk_score"]
+        return scores, risk.sum(axis=0)
+
+    def evaluate_batch(self, flats: List[Dict[str, Any]]) -> Tuple[List[Dict[str, dict]], List[Dict[str, dict]], np.ndarray, np.ndarray]:
+        """Column-wise evaluation; returns attribute blocks plus raw agent totals as NumPy vectors"""
+        extracted = [self.extract(flat) for flat in flats]
+        agent1_scores, agent1_totals = self._apply_columns(self.agent1, [fields for fields, _ in extracted])
+
+        # Agent2: VT score cache hits first, the remaining rows column-wise
+        agent2_scores: List[Optional[Dict[str, dict]]] = [None] * len(extracted)
+        agent2_totals = np.zeros(len(extracted), dtype=np.float64)
+        misses = []
+        for i, (fields, buckets) in enumerate(extracted):
+            chosen = self.select_bucket(buckets)
+            cache_key, entry = self._vt_cache_lookup(fields, chosen)
+            if entry is not None:
+                agent2_scores[i] = self._vt_from_entry(entry)
+                agent2_totals[i] = sum(attr["risk_score"] for attr in agent2_scores[i].values())
+            else:
+                misses.append((i, cache_key, self.vt_values(buckets, chosen)))
+        if misses:
+            scores, totals = self._apply_columns(self.agent2, [vt_values for _, _, vt_values in misses])
+            for k, (i, cache_key, vt_values) in enumerate(misses):
+                agent2_scores[i] = scores[k]
+                agent2_totals[i] = totals[k]
+                if cache_key is not None:
+                    self._vt_cache_store(cache_key, vt_values, scores[k])
+        return agent1_scores, agent2_scores, agent1_totals, agent2_totals
+
+
+def _read_only(value: Any) -> Any:
+    """Read-only deep copy of a rule/weight table: dicts become mappingproxies, lists tuples, sets frozensets"""
+    if isinstance(value, (dict, types.MappingProxyType)):
+        return types.MappingProxyType({k: _read_only(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_read_only(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    return value
+
+
 class ScoringTool:
     """Tool for scoring alerts based on heuristic rules and VirusTotal data"""
-    
+
     EVIL_PATH_REGEX = re.compile(
         r'(\\AppData\\|\\Downloads\\|\\Users\\Public|\\Windows\\[^\\]+\\|\$Recycle\.Bin)',
         re.I
     )
-    
+
     LOLBINS = {
         "powershell.exe", "pwsh.exe", "cmd.exe", "wmic.exe", "regsvr32.exe",
         "mshta.exe", "python.exe", "wscript.exe", "cscript.exe", "rundll32.exe",
         "curl.exe", "wget.exe"
     }
-    
+
     SUSP_ARGS_RE = re.compile(r'(-enc\b|FromBase64String|Invoke-Expression|curl\s+http)', re.I)
-    
+
     ENGINE_WEIGHTS = {
         "SentinelOne Cloud": 25,
         "on-write static ai": 15,
         "user": 10,
         "behavioral": 5
     }
-    
+
     ASSET_WEIGHTS = {
         "server": 15,
         "laptop": 5
     }
-    
+
     CONF_WEIGHTS = {
         "malicious": 10,
         "suspicious": 5
     }
 
+    # Enrichment sub-keys -> vt_values aliases expected by downstream scoring
+    VT_KEY_MAP = {
+        "positives": "positives",
+        "total": "total",
+        "malicious": "malicious",
+        "suspicious": "suspicious",
+        "stats.malicious": "stats_malicious",
+        "stats.suspicious": "stats_suspicious",
+        "stats.undetected": "stats_undetected",
+        "stats.harmless": "stats_harmless",
+        "stats.unsupported": "stats_unsupported",
+        "stats.timeout": "stats_timeout",
+        "stats.confirmed-timeout": "stats_confirmed_timeout",
+        "stats.failure": "stats_failure",
+        "scan_time": "scan_time",
+    }
+
+    # Alert field identifying the scanned file; Agent2 blocks are cached per value (see CompiledRuleSet)
+    VT_HASH_FIELD = "file.hashes.sha256"
+
+    VT_COUNT_FIELDS = [
+        "positives", "total", "malicious", "suspicious",
+        "stats_malicious", "stats_suspicious", "stats_undetected",
+        "stats_harmless", "stats_unsupported", "stats_timeout",
+        "stats_confirmed_timeout", "stats_failure"
+    ]
+
+    # Declarative scoring rules, compiled once by compile_rules().
+    # Agent1 rules read flattened alert paths; Agent2 rules read the vt_values of
+    # the strongest VirusTotal enrichment. Attributes are reported in table order.
+    RULES = [
+        # ---------------- Agent1: heuristics ----------------
+        {"name": "severity", "agent": 1, "kind": "scale", "field": "severity_id", "factor": 10,
+         "description": "Severity level {value}"},
+        {"name": "file_signing", "agent": 1, "kind": "signing", "field": "file.verification.type",
+         "cert_field": "file.signature.certificate.status",
+         "cases": [
+             {"type": "notsigned", "risk": 25, "description": "File is not signed"},
+             {"type": "signed", "certificate_valid": False, "value": "signed/invalid", "risk": 15,
+              "description": "File signed but certificate is invalid"},
+             {"type": "signed", "certificate_valid": True, "value": "signed/valid", "risk": -10,
+              "description": "File properly signed with valid certificate"},
+         ]},
+        {"name": "file_path", "agent": 1, "kind": "regex", "field": "file.path", "regex": "EVIL_PATH_REGEX",
+         "risk": 15, "description": "File located in suspicious directory"},
+        {"name": "parent_process", "agent": 1, "kind": "contains_any", "field": "process.name", "table": "LOLBINS",
+         "risk": 20, "description": "Parent process is a known LOLBin"},
+        {"name": "command_line", "agent": 1, "kind": "regex", "field": "process.cmd.args", "regex": "SUSP_ARGS_RE",
+         "risk": 15, "description": "Contains suspicious command line patterns"},
+        {"name": "confidence_level", "agent": 1, "kind": "lookup", "field": "threat.confidence",
+         "table": "CONF_WEIGHTS", "default": -20, "description": "Vendor confidence: {value}"},
+        {"name": "detection_engine", "agent": 1, "kind": "engine", "field": "metadata.product.feature.name",
+         "table": "ENGINE_WEIGHTS", "description": "Detected by: {value}"},
+        {"name": "asset_type", "agent": 1, "kind": "lookup", "field": "device.type",
+         "table": "ASSET_WEIGHTS", "default": 0, "description": "Asset type: {value}"},
+        {"name": "process_user", "agent": 1, "kind": "membership", "field": "actor.process.user.name",
+         "members": ["system", "administrator", "root"], "risk": 10,
+         "description": "Process running with elevated privileges",
+         "otherwise_risk": 0, "otherwise_description": "Process running with normal user privileges"},
+        # ---------------- Agent2: VirusTotal enrichment ----------------
+        {"name": "vt_positives", "agent": 2, "kind": "vt_log2", "field": "positives", "factor": 10, "cap": 40,
+         "description": "VirusTotal positive detections: {value}"},
+        {"name": "vt_detection_ratio", "agent": 2, "kind": "vt_ratio", "field": "positives", "total_field": "total",
+         "factor": 50, "cap": 50, "description": "VirusTotal detection ratio: {value} ({ratio:.2%})"},
+        {"name": "vt_malicious", "agent": 2, "kind": "vt_log2", "field": "malicious", "factor": 15, "cap": 45,
+         "description": "VirusTotal malicious verdicts: {value}"},
+        {"name": "vt_suspicious", "agent": 2, "kind": "vt_log2", "field": "suspicious", "factor": 8, "cap": 25,
+         "description": "VirusTotal suspicious verdicts: {value}"},
+        {"name": "vt_stats_malicious", "agent": 2, "kind": "vt_log2", "field": "stats_malicious", "factor": 12, "cap": 35,
+         "description": "VirusTotal analysis stats - malicious: {value}"},
+        {"name": "vt_stats_suspicious", "agent": 2, "kind": "vt_log2", "field": "stats_suspicious", "factor": 6, "cap": 20,
+         "description": "VirusTotal analysis stats - suspicious: {value}"},
+        {"name": "vt_stats_harmless", "agent": 2, "kind": "vt_log2", "field": "stats_harmless", "factor": 2, "cap": 10,
+         "sign": -1, "description": "VirusTotal analysis stats - harmless: {value}"},
+        {"name": "vt_stats_timeout", "agent": 2, "kind": "vt_log2", "field": "stats_timeout", "factor": 5, "cap": 15,
+         "description": "VirusTotal analysis stats - timeout: {value}"},
+        {"name": "vt_stats_confirmed_timeout", "agent": 2, "kind": "vt_log2", "field": "stats_confirmed_timeout",
+         "factor": 8, "cap": 20, "description": "VirusTotal analysis stats - confirmed timeout: {value}"},
+        {"name": "vt_stats_failure", "agent": 2, "kind": "vt_log2", "field": "stats_failure", "factor": 4, "cap": 12,
+         "description": "VirusTotal analysis stats - failure: {value}"},
+        {"name": "vt_scan_age", "agent": 2, "kind": "vt_age", "field": "scan_time", "min_days": 90,
+         "days_per_point": 30, "cap": 10, "value": "{days:.0f} days old",
+         "description": "VirusTotal scan is {days:.0f} days old"},
+        {"name": "vt_high_detection_count", "agent": 2, "kind": "vt_sum",
+         "fields": ["positives", "malicious", "suspicious", "stats_malicious", "stats_suspicious"],
+         "threshold": 10, "risk": 30,
+         "description": "High total detection count across all VirusTotal metrics: {value}"},
+    ]
+
+    # RULES plus every weight table / pattern the rules read
+    TABLES = ("RULES", "ENGINE_WEIGHTS", "ASSET_WEIGHTS", "CONF_WEIGHTS", "LOLBINS", "EVIL_PATH_REGEX",
+              "SUSP_ARGS_RE", "VT_KEY_MAP", "VT_COUNT_FIELDS", "VT_HASH_FIELD")
+
+    _compiled_rules: Optional[CompiledRuleSet] = None
+    _compiled_tables: Optional[tuple] = None
+    _compiled_fingerprint: Optional[str] = None
+
+    @classmethod
+    def _weight_tables(cls) -> tuple:
+        return tuple(getattr(cls, name) for name in cls.TABLES)
+
+    @classmethod
+    def weights_fingerprint(cls) -> str:
+        """Digest of the rule/weight tables the current compiled rule set was built from"""
+        cls.refresh_rules()
+        return cls._compiled_fingerprint
+
+    @classmethod
+    def compile_rules(cls) -> CompiledRuleSet:
+        """
+        Compile RULES (and the weight tables they reference) into a single-pass evaluator.
+        The tables are made read-only first, so they can only change by being reassigned.
+        """
+        for name in cls.TABLES:
+            setattr(cls, name, _read_only(getattr(cls, name)))
+        tables = cls._weight_tables()
+        rules = [RULE_KINDS[spec["kind"]](spec, cls) for spec in cls.RULES]
+        cls._compiled_rules = CompiledRuleSet(rules, dict(cls.VT_KEY_MAP), list(cls.VT_COUNT_FIELDS),
+                                              cls.VT_HASH_FIELD, TRIAGE_VT_CACHE_SIZE, TRIAGE_VT_CACHE_TTL)
+        cls._compiled_tables = tables
+        material = repr([(t.pattern, t.flags) if isinstance(t, re.Pattern) else sorted(t) if isinstance(t, frozenset) else t
+                         for t in tables])
+        cls._compiled_fingerprint = hashlib.sha256(material.encode("utf-8")).hexdigest()[:16]
+        return cls._compiled_rules
+
+    @classmethod
+    def refresh_rules(cls) -> CompiledRuleSet:
+        """
+        Recompile when a table was reassigned since the last compile. In-place edits raise (the tables
+        are read-only), so an identity check per table is enough and cheap to run on every request.
+        """
+        compiled = cls._compiled_tables
+        if compiled is None or any(current is not old for current, old in zip(cls._weight_tables(), compiled)):
+            return cls.compile_rules()
+        return cls._compiled_rules
+
+    @classmethod
+    def rules(cls) -> CompiledRuleSet:
+        if cls._compiled_rules is None:
+            return cls.compile_rules()
+        return cls._compiled_rules
+
     @classmethod
     def weight_engine(cls, name: str) -> int:
         if not name:
@@ -99,398 +1288,49 @@ class ScoringTool:
         return 0
 
     @classmethod
-    def flatten_alert(cls, raw: Any, parent_key: str = "") -> Dict[str, Any]:
+    def flatten_alert(cls, raw: Any, parent_key: str = "", paths=None, trace: Optional[TriageTrace] = None) -> Dict[str, Any]:
         """
-        Recursively flattens dicts/lists into dotted keys and list indices:
+        Flattens dicts/lists into dotted keys and list indices:
         e.g. {"enrichments":[{"data":{"positives":5}}]}
              => {"enrichments[0].data.positives": 5}
+        Pass `paths` (see flatten_projected) to extract only what the caller reads.
         """
-        flat: Dict[str, Any] = {}
         # Root type guard
         if parent_key == "" and not isinstance(raw, (dict, list)):
-            print(f"WARNING: Alert data is not a dict/list, type: {type(raw)}")
-            return flat
-
-        if isinstance(raw, dict):
-            if parent_key == "":
-                print(f"DEBUG: flatten_alert - received {len(raw)} top-level keys")
-            for k, v in raw.items():
-                nk = f"{parent_key}.{k}" if parent_key else k
-                flat.update(cls.flatten_alert(v, nk))
-        elif isinstance(raw, list):
-            for i, v in enumerate(raw):
-                nk = f"{parent_key}[{i}]"
-                flat.update(cls.flatten_alert(v, nk))
-        else:
-            flat[parent_key] = raw
+            if trace is not None:
+                trace.record("flatten_rejected", type=type(raw).__name__)
+            return {}
 
+        flat = flatten_projected(raw, parent_key, paths)
+        if trace is not None and parent_key == "":
+            trace.record("flatten", top_level_keys=len(raw), fields=len(flat), projected=paths is not None)
         return flat
+
+    @classmethod
+    def score(cls, flat: Dict[str, Any], trace: Optional[TriageTrace] = None) -> Tuple[Dict[str, dict], Dict[str, dict]]:
+        """Agent1 and Agent2 scoring in a single pass over the flattened alert"""
+        return cls.rules().evaluate(flat, trace)
+
     @classmethod
     def score_agent1(cls, flat: Dict[str, Any]) -> Dict[str, dict]:
         """Agent1: Heuristic-based scoring"""
-        scores = {}
-        
-        print("=== AGENT1 SCORING START ===")
-        print(f"Available keys: {list(flat.keys())}")
-
-        # 1. Severity scoring
-        sev = int(flat.get("severity_id", 0))
-        scores["severity"] = {
-            "value": sev,
-            "risk_score": sev * 10,
-            "description": f"Severity level {sev}"
-        }
-        print(f"Severity: {sev} -> score: {sev * 10}")
-
-        # 2. File signing verification
-        fv = (flat.get("file.verification.type") or "").lower()
-        vc = bool(flat.get("file.signature.certificate.status", False))
-        
-        if fv == "notsigned":
-            scores["file_signing"] = {
-                "value": fv,
-                "risk_score": 25,
-                "description": "File is not signed"
-            }
-            print(f"File signing: {fv} -> score: 25")
-        elif fv == "signed" and not vc:
-            scores["file_signing"] = {
-                "value": "signed/invalid",
-                "risk_score": 15,
-                "description": "File signed but certificate is invalid"
-            }
-            print(f"File signing: signed/invalid -> score: 15")
-        elif fv == "signed" and vc:
-            scores["file_signing"] = {
-                "value": "signed/valid",
-                "risk_score": -10,
-                "description": "File properly signed with valid certificate"
-            }
-            print(f"File signing: signed/valid -> score: -10")
-
-        # 3. Suspicious file path
-        fp = flat.get("file.path", "")
-        if cls.EVIL_PATH_REGEX.search(fp):
-            scores["file_path"] = {
-                "value": fp,
-                "risk_score": 15,
-                "description": "File located in suspicious directory"
-            }
-            print(f"Suspicious file path: {fp} -> score: 15")
-
-        # 4. Parent process (LOLBins)
-        parent = (flat.get("process.name") or "").lower()
-        if any(bin_name in parent for bin_name in cls.LOLBINS):
-            scores["parent_process"] = {
-                "value": parent,
-                "risk_score": 20,
-                "description": "Parent process is a known LOLBin"
-            }
-            print(f"LOLBin parent process: {parent} -> score: 20")
-
-        # 5. Command line patterns
-        cli = flat.get("process.cmd.args") 
-        if cls.SUSP_ARGS_RE.search(cli):
-            scores["command_line"] = {
-                "value": cli,
-                "risk_score": 15,
-                "description": "Contains suspicious command line patterns"
-            }
-            print(f"Suspicious command line -> score: 15")
-
-        # 6. Threat confidence
-        conf = (flat.get("threat.confidence") or "").lower()
-        risk_score = cls.CONF_WEIGHTS.get(conf, -20)
-        scores["confidence_level"] = {
-            "value": conf,
-            "risk_score": risk_score,
-            "description": f"Vendor confidence: {conf}"
-        }
-        print(f"Threat confidence: {conf} -> score: {risk_score}")
-
-        # 7. Detection engine
-        engs = flat.get("metadata.product.feature.name") or []
-        e_name = "unknown"
-        if engs and isinstance(engs, list) and len(engs) > 0:
-            if isinstance(engs[0], dict) and "title" in engs[0]:
-                e_name = engs[0]["title"]
-        
-        engine_score = cls.weight_engine(e_name)
-        scores["detection_engine"] = {
-            "value": e_name,
-            "risk_score": engine_score,
-            "description": f"Detected by: {e_name}"
-        }
-        print(f"Detection engine: {e_name} -> score: {engine_score}")
-
-        # 8. Asset type
-        asset = (flat.get("device.type") or "").lower()
-        asset_score = cls.ASSET_WEIGHTS.get(asset, 0)
-        scores["asset_type"] = {
-            "value": asset,
-            "risk_score": asset_score,
-            "description": f"Asset type: {asset}"
-        }
-        print(f"Asset type: {asset} -> score: {asset_score}")
-
-        # 9. Process user privileges
-        process_user = flat.get("actor.process.user.name", "")
-        if process_user.lower() in ["system", "administrator", "root"]:
-            scores["process_user"] = {
-                "value": process_user,
-                "risk_score": 10,
-                "description": "Process running with elevated privileges"
-            }
-            print(f"Elevated process user: {process_user} -> score: 10")
-        elif process_user:
-            scores["process_user"] = {
-                "value": process_user,
-                "risk_score": 0,
-                "description": "Process running with normal user privileges"
-            }
-            print(f"Normal process user: {process_user} -> score: 0")
-
-        agent1_total = sum(score_data.get("risk_score", 0) for score_data in scores.values())
-        print(f"=== AGENT1 TOTAL SCORE: {agent1_total} ===")
-        return scores
+        return cls.score(flat)[0]
 
     @classmethod
     def score_agent2(cls, flat: Dict[str, Any]) -> Dict[str, dict]:
         """Agent2: VirusTotal-based scoring using enrichment data structure"""
-        scores = {}
-        
-        print("=== AGENT2 SCORING START ===")
-        print(f"Checking VirusTotal enrichment data...")
-        
-        # Debug: Print all enrichment-related keys
-
-        # Debug: Print all enrichment-related keys
-        enrichment_keys = [k for k in flat.keys() if 'enrichments' in k or 'data.' in k]
-        print(f"Found enrichment keys: {enrichment_keys}")
-
-        # Dynamically locate VirusTotal enrichment without hard-coding an index
-        import re
-        buckets: Dict[int, Dict[str, Any]] = {}
-        pat = re.compile(r'^enrichments\[(\d+)\]\.data\.(.+)$')
-        for k, v in flat.items():
-            m = pat.match(k)
-            if not m:
-                continue
-            idx = int(m.group(1))
-            subkey = m.group(2)  # e.g., "positives", "stats.malicious"
-            buckets.setdefault(idx, {})[subkey] = v
-
-        vt_values: Dict[str, Any] = {}
-        if buckets:
-            def _to_int(x):
-                try:
-                    return int(x)
-                except Exception:
-                    return 0
-
-            def _vt_signal(d: Dict[str, Any]) -> int:
-                return (
-                    _to_int(d.get("positives", 0)) +
-                    _to_int(d.get("malicious", 0)) +
-                    _to_int(d.get("suspicious", 0)) +
-                    _to_int(d.get("stats.malicious", 0)) +
-                    _to_int(d.get("stats.suspicious", 0))
-                )
-
-            chosen = max(buckets.values(), key=_vt_signal)
-            print(f"Chosen VT enrichment bucket keys: {list(chosen.keys())}")
-
-            # Normalize chosen bucket keys into vt_values expected by downstream scoring
-            key_map = {
-                "positives": "positives",
-                "total": "total",
-                "malicious": "malicious",
-                "suspicious": "suspicious",
-                "stats.malicious": "stats_malicious",
-                "stats.suspicious": "stats_suspicious",
-                "stats.undetected": "stats_undetected",
-                "stats.harmless": "stats_harmless",
-                "stats.unsupported": "stats_unsupported",
-                "stats.timeout": "stats_timeout",
-                "stats.confirmed-timeout": "stats_confirmed_timeout",
-                "stats.failure": "stats_failure",
-                "scan_time": "scan_time",
-            }
-            for key, alias in key_map.items():
-                raw_value = chosen.get(key)
-                if raw_value is None:
-                    continue
-                if alias == "scan_time":
-                    vt_values[alias] = str(raw_value)
-                else:
-                    try:
-                        vt_values[alias] = int(raw_value)
-                    except (ValueError, TypeError):
-                        vt_values[alias] = 0
-        else:
-            # Initialize defaults if no enrichments present
-            for alias in [
-                "positives","total","malicious","suspicious",
-                "stats_malicious","stats_suspicious","stats_undetected",
-                "stats_harmless","stats_unsupported","stats_timeout",
-                "stats_confirmed_timeout","stats_failure"
-            ]:
-                vt_values[alias] = 0
-            vt_values["scan_time"] = None
+        return cls.score(flat)[1]
 
-        print(f"Extracted VT values: {vt_values}")
-
-
-        # 1. VirusTotal positive detections
-        positives = vt_values.get("positives", 0)
-        if positives > 0:
-            risk_score = min(10 * math.log2(positives + 1), 40)
-            scores["vt_positives"] = {
-                "value": positives,
-                "risk_score": risk_score,
-                "description": f"VirusTotal positive detections: {positives}"
-            }
-            print(f"VT Positives: {positives} -> score: {risk_score}")
-
-        # 2. Total engines analyzed
-        total = vt_values.get("total", 0)
-        if total > 0 and positives > 0:
-            detection_ratio = positives / total
-            risk_score = min(50 * detection_ratio, 50)
-            scores["vt_detection_ratio"] = {
-                "value": f"{positives}/{total}",
-                "risk_score": risk_score,
-                "description": f"VirusTotal detection ratio: {positives}/{total} ({detection_ratio:.2%})"
-            }
-            print(f"VT Detection Ratio: {positives}/{total} -> score: {risk_score}")
-
-        # 3. Malicious verdict count
-        malicious = vt_values.get("malicious", 0)
-        if malicious > 0:
-            risk_score = min(15 * math.log2(malicious + 1), 45)
-            scores["vt_malicious"] = {
-                "value": malicious,
-                "risk_score": risk_score,
-                "description": f"VirusTotal malicious verdicts: {malicious}"
-            }
-            print(f"VT Malicious: {malicious} -> score: {risk_score}")
-
-        # 4. Suspicious verdict count
-        suspicious = vt_values.get("suspicious", 0)
-        if suspicious > 0:
-            risk_score = min(8 * math.log2(suspicious + 1), 25)
-            scores["vt_suspicious"] = {
-                "value": suspicious,
-                "risk_score": risk_score,
-                "description": f"VirusTotal suspicious verdicts: {suspicious}"
-            }
-            print(f"VT Suspicious: {suspicious} -> score: {risk_score}")
-
-        # 5. Analysis stats - malicious
-        stats_malicious = vt_values.get("stats_malicious", 0)
-        if stats_malicious > 0:
-            risk_score = min(12 * math.log2(stats_malicious + 1), 35)
-            scores["vt_stats_malicious"] = {
-                "value": stats_malicious,
-                "risk_score": risk_score,
-                "description": f"VirusTotal analysis stats - malicious: {stats_malicious}"
-            }
-            print(f"VT Stats Malicious: {stats_malicious} -> score: {risk_score}")
-
-        # 6. Analysis stats - suspicious
-        stats_suspicious = vt_values.get("stats_suspicious", 0)
-        if stats_suspicious > 0:
-            risk_score = min(6 * math.log2(stats_suspicious + 1), 20)
-            scores["vt_stats_suspicious"] = {
-                "value": stats_suspicious,
-                "risk_score": risk_score,
-                "description": f"VirusTotal analysis stats - suspicious: {stats_suspicious}"
-            }
-            print(f"VT Stats Suspicious: {stats_suspicious} -> score: {risk_score}")
-
-        # 7. Analysis stats - harmless (reduces risk)
-        stats_harmless = vt_values.get("stats_harmless", 0)
-        if stats_harmless > 0:
-            risk_score = -min(2 * math.log2(stats_harmless + 1), 10)
-            scores["vt_stats_harmless"] = {
-                "value": stats_harmless,
-                "risk_score": risk_score,
-                "description": f"VirusTotal analysis stats - harmless: {stats_harmless}"
-            }
-            print(f"VT Stats Harmless: {stats_harmless} -> score: {risk_score}")
-
-        # 8. Analysis stats - timeout (indicates potential evasion)
-        stats_timeout = vt_values.get("stats_timeout", 0)
-        if stats_timeout > 0:
-            risk_score = min(5 * math.log2(stats_timeout + 1), 15)
-            scores["vt_stats_timeout"] = {
-                "value": stats_timeout,
-                "risk_score": risk_score,
-                "description": f"VirusTotal analysis stats - timeout: {stats_timeout}"
-            }
-            print(f"VT Stats Timeout: {stats_timeout} -> score: {risk_score}")
-
-        # 9. Analysis stats - confirmed timeout
-        stats_confirmed_timeout = vt_values.get("stats_confirmed_timeout", 0)
-        if stats_confirmed_timeout > 0:
-            risk_score = min(8 * math.log2(stats_confirmed_timeout + 1), 20)
-            scores["vt_stats_confirmed_timeout"] = {
-                "value": stats_confirmed_timeout,
-                "risk_score": risk_score,
-                "description": f"VirusTotal analysis stats - confirmed timeout: {stats_confirmed_timeout}"
-            }
-            print(f"VT Stats Confirmed Timeout: {stats_confirmed_timeout} -> score: {risk_score}")
-
-        # 10. Analysis stats - failure
-        stats_failure = vt_values.get("stats_failure", 0)
-        if stats_failure > 0:
-            risk_score = min(4 * math.log2(stats_failure + 1), 12)
-            scores["vt_stats_failure"] = {
-                "value": stats_failure,
-                "risk_score": risk_score,
-                "description": f"VirusTotal analysis stats - failure: {stats_failure}"
-            }
-            print(f"VT Stats Failure: {stats_failure} -> score: {risk_score}")
-
-        # 11. Scan age analysis
-        scan_time = vt_values.get("scan_time")
-        if scan_time:
-            try:
-                if isinstance(scan_time, str):
-                    scan_timestamp = int(datetime.fromisoformat(scan_time.replace('Z', '+00:00')).timestamp())
-                else:
-                    scan_timestamp = int(scan_time)
-                
-                import time
-                current_timestamp = int(time.time())
-                days_old = (current_timestamp - scan_timestamp) / (24 * 3600)
-                
-                if days_old > 90:
-                    risk_score = min(days_old / 30, 10)
-                    scores["vt_scan_age"] = {
-                        "value": f"{days_old:.0f} days old",
-                        "risk_score": risk_score,
-                        "description": f"VirusTotal scan is {days_old:.0f} days old"
-                    }
-                    print(f"VT Scan Age: {days_old:.0f} days -> score: {risk_score}")
-            except (ValueError, TypeError) as e:
-                print(f"Error processing scan time: {e}")
-
-        # 12. High detection count bonus
-        total_detections = positives + malicious + suspicious + stats_malicious + stats_suspicious
-        if total_detections > 10:
-            scores["vt_high_detection_count"] = {
-                "value": total_detections,
-                "risk_score": 30,
-                "description": f"High total detection count across all VirusTotal metrics: {total_detections}"
-            }
-            print(f"VT High Detection Count: {total_detections} -> score: 30")
+    @classmethod
+    def score_batch(cls, flats: List[Dict[str, Any]]) -> Tuple[List[Dict[str, dict]], List[Dict[str, dict]], np.ndarray, np.ndarray]:
+        """
+        Column-wise Agent1/Agent2 scoring for a batch of flattened alerts.
+        Returns per-alert attribute dicts (same shape as score_agent1/score_agent2)
+        plus the raw agent totals as NumPy vectors.
+        """
+        return cls.rules().evaluate_batch(flats)
 
-        agent2_total = sum(score_data.get("risk_score", 0) for score_data in scores.values())
-        print(f"=== AGENT2 TOTAL SCORE: {agent2_total} ===")
-        print(f"=== AGENT2 SCORES CREATED: {list(scores.keys())} ===")
-        
-        return scores
+ScoringTool.compile_rules()
 
 class TriageAgent(BaseAgent):
     """Agent specialized in initial alert triage and risk scoring"""
@@ -501,72 +1341,149 @@ class TriageAgent(BaseAgent):
             tools=["ScoringTool"]
         )
         self.scoring_tool = ScoringTool()
+        self.result_cache = LRUTTLCache(TRIAGE_CACHE_SIZE, TRIAGE_CACHE_TTL)
 
-    def analyze_alert(self, alert_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Analyze alert using both Agent1 (heuristic) and Agent2 (VirusTotal) scoring"""
-        
-        print("=" * 60)
-        print("STARTING TRIAGE ANALYSIS")
-        print("=" * 60)
-        
-        # Flatten and validate data
-        flat_data = self.scoring_tool.flatten_alert(alert_data)
+    def _cache_key(self, fingerprint: str, flat_data: Dict[str, Any]) -> Optional[tuple]:
+        """
+        Content address of a projected alert: the rule-set fingerprint plus the canonical digest
+        of every field the rules read, so weight-table changes never hit stale entries.
+        """
+        if not self.result_cache.enabled:
+            return None
+        return fingerprint, canonical_digest(flat_data)
+
+    def _to_cache(self, cache_key: tuple, result: Dict[str, Any]):
+        # Stored pickled so callers mutating a response can't corrupt the cached entry
+        self.result_cache.put(cache_key, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+
+    @staticmethod
+    def _from_cache(cached: bytes) -> Dict[str, Any]:
+        # Fresh copy per hit; only the timestamp is per response
+        result = pickle.loads(cached)
+        result["timestamp"] = datetime.utcnow().isoformat()
+        return result
+
+    def analyze_alert(self, alert_data: Dict[str, Any], trace: Optional[TriageTrace] = None) -> Dict[str, Any]:
+        """
+        Analyze alert using both Agent1 (heuristic) and Agent2 (VirusTotal) scoring.
+        Repeat alerts are served from the result cache; traced requests always recompute.
+        Pass a TriageTrace (see triage_tracer) to record flatten/rule/verdict events.
+        """
+        # Recompiles the rules first if a weight table was replaced
+        fingerprint = self.scoring_tool.weights_fingerprint()
+
+        # Flatten and validate data (only the paths the rule set reads)
+        flat_data = self.scoring_tool.flatten_alert(alert_data, paths=self.scoring_tool.rules().paths, trace=trace)
         
-        if not flat_data:
-            print("ERROR: No valid alert data received")
+        if not flat_data and not alert_has_fields(alert_data):
+            if trace is not None:
+                trace.record("error", error="No valid alert data provided")
             return {
                 "error": "No valid alert data provided",
                 "timestamp": datetime.utcnow().isoformat()
             }
+
+        cache_key = self._cache_key(fingerprint, flat_data)
+        if cache_key is not None:
+            if trace is None:
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    return self._from_cache(cached)
+            else:
+                trace.record("cache", status="bypass", key=cache_key[1])
         
-        print(f"Processing alert with {len(flat_data)} fields")
-        
-        # Run both scoring agents
-        print("\n" + "="*40 + " AGENT1 " + "="*40)
-        agent1_scores = self.scoring_tool.score_agent1(flat_data)
-        
-        print("\n" + "="*40 + " AGENT2 " + "="*40)
-        agent2_scores = self.scoring_tool.score_agent2(flat_data)
+        # Run both scoring agents (one pass over the compiled rule set)
+        agent1_scores, agent2_scores = self.scoring_tool.score(flat_data, trace)
         
         # Calculate totals
         agent1_total = sum(attr_data.get("risk_score", 0) for attr_data in agent1_scores.values())
         agent2_total = sum(attr_data.get("risk_score", 0) for attr_data in agent2_scores.values())
         
-        print(f"\n" + "="*40 + " FINAL CALCULATION " + "="*40)
-        print(f"Agent1 Raw Total: {agent1_total}")
-        print(f"Agent2 Raw Total: {agent2_total}")
-        
         # Apply weightings: 40% Agent1, 60% Agent2
-        weighted_agent1 = agent1_total * 0.4
-        weighted_agent2 = agent2_total * 0.6
-        total_weighted_score = weighted_agent1 + weighted_agent2
-        
-        print(f"Agent1 Weighted (40%): {weighted_agent1}")
-        print(f"Agent2 Weighted (60%): {weighted_agent2}")
-        print(f"Total Weighted Score: {total_weighted_score}")
+        total_weighted_score = agent1_total * 0.4 + agent2_total * 0.6
         
         # Normalize score to 0-100
         normalized_score = max(0, min(total_weighted_score, 100))
-        confidence = normalized_score / 100.0
         
-        # Determine verdict based on risk score thresholds
+        verdict = self._verdict(normalized_score)
+        if trace is not None:
+            trace.record("verdict", agent1_total=agent1_total, agent2_total=agent2_total,
+                         weighted=total_weighted_score, normalized=normalized_score, verdict=verdict)
+        
+        result = self._build_result(agent1_scores, agent2_scores, agent1_total, agent2_total, normalized_score, verdict)
+        if cache_key is not None:
+            self._to_cache(cache_key, result)
+        return result
+
+    def analyze_batch(self, alerts: List[Any]) -> List[Dict[str, Any]]:
+        """Analyze a batch of alerts with column-wise Agent1/Agent2 scoring (cache hits are skipped)"""
+        results: List[Optional[Dict[str, Any]]] = [None] * len(alerts)
+        flats = []
+        positions = []
+        cache_keys = []
+        fingerprint = self.scoring_tool.weights_fingerprint()
+        paths = self.scoring_tool.rules().paths
+        for i, alert_data in enumerate(alerts):
+            flat_data = self.scoring_tool.flatten_alert(alert_data, paths=paths)
+            if not flat_data and not alert_has_fields(alert_data):
+                results[i] = {
+                    "error": "No valid alert data provided",
+                    "timestamp": datetime.utcnow().isoformat()
+                }
+                continue
+            cache_key = self._cache_key(fingerprint, flat_data)
+            if cache_key is not None:
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    results[i] = self._from_cache(cached)
+                    continue
+            flats.append(flat_data)
+            positions.append(i)
+            cache_keys.append(cache_key)
+
+        if not flats:
+            return results
+
+        agent1_scores, agent2_scores, _, _ = self.scoring_tool.score_batch(flats)
+
+        for k, i in enumerate(positions):
+            # Totals as in analyze_alert (Python sums and clamp), so int scores stay int in the JSON
+            agent1_total = sum(attr_data.get("risk_score", 0) for attr_data in agent1_scores[k].values())
+            agent2_total = sum(attr_data.get("risk_score", 0) for attr_data in agent2_scores[k].values())
+            # Apply weightings: 40% Agent1, 60% Agent2
+            normalized_score = max(0, min(agent1_total * 0.4 + agent2_total * 0.6, 100))
+            results[i] = self._build_result(
+                agent1_scores[k], agent2_scores[k], agent1_total, agent2_total,
+                normalized_score, self._verdict(normalized_score)
+            )
+            if cache_keys[k] is not None:
+                self._to_cache(cache_keys[k], results[i])
+        return results
+
+    @staticmethod
+    def _verdict(normalized_score: float) -> str:
+        """Determine verdict based on risk score thresholds"""
         if normalized_score >= 80:
-            verdict = "True Positive"
+            return "True Positive"
         elif normalized_score >= 25:
-            verdict = "Escalate"
-        else:
-            verdict = "False Positive"
-        
-        print(f"Normalized Score: {normalized_score}")
-        print(f"Final Verdict: {verdict}")
-        print(f"Risk Score: {confidence * 100}")
-        
+            return "Escalate"
+        return "False Positive"
+
+    def _build_result(self, agent1_scores: Dict[str, dict], agent2_scores: Dict[str, dict],
+                      agent1_total: float, agent2_total: float,
+                      normalized_score: float, verdict: str) -> Dict[str, Any]:
+        """Assemble the triage response payload"""
+        weighted_agent1 = agent1_total * 0.4
+        weighted_agent2 = agent2_total * 0.6
+        total_weighted_score = weighted_agent1 + weighted_agent2
+        confidence = normalized_score / 100.0
+
         # Combine all attribute analyses
         all_attributes = {}
         all_attributes.update(agent1_scores)
         all_attributes.update(agent2_scores)
         
-        result = {
+        return {
             "prediction": {
                 "predicted_verdict": verdict,
                 "risk_score": confidence * 100
@@ -597,21 +1514,197 @@ class TriageAgent(BaseAgent):
             "timestamp": datetime.utcnow().isoformat(),
             "model_version": "1.0"
         }
-        
-        print("=" * 60)
-        print("TRIAGE ANALYSIS COMPLETE")
-        print("=" * 60)
-        
-        return result
     
 triage_agent = TriageAgent()
+
+def analyze_alerts_isolated(alerts: List[Any]) -> List[Dict[str, Any]]:
+    """analyze_batch, falling back to one alert at a time so a bad alert only fails its own result"""
+    try:
+        return triage_agent.analyze_batch(alerts)
+    except Exception:
+        results = []
+        for alert in alerts:
+            try:
+                results.extend(triage_agent.analyze_batch([alert]))
+            except Exception as e:
+                results.append({"error": str(e)})
+        return results
+
+def _triage_worker_init():
+    """Pool initializer: compile the rule set and warm the scoring path once per worker"""
+    ScoringTool.rules()
+    triage_agent.analyze_batch([{"severity_id": 0}])
+    triage_agent.result_cache.clear()
+
+def _triage_worker_alert(alert_data: Any) -> Dict[str, Any]:
+    return triage_agent.analyze_alert(alert_data)
+
+class TriageExecutor:
+    """
+    Runs triage scoring on the "triage" lane threads or on a process pool (TRIAGE_EXECUTOR=inline|process).
+    In process mode each worker keeps its own compiled rules and caches; batches are
+    split into TRIAGE_POOL_CHUNK-sized tasks so all workers score in parallel.
+    Traced requests are always scored inline so the trace stays in this process.
+    """
+
+    def __init__(self, mode: str = "inline", workers: int = 1, chunk: int = 32, start_method: str = "spawn"):
+        if mode not in ("inline", "process"):
+            print(f"WARNING: Unknown TRIAGE_EXECUTOR '{mode}', using inline")
+            mode = "inline"
+        if start_method not in ("spawn", "forkserver"):
+            print(f"WARNING: Unsupported TRIAGE_POOL_START '{start_method}', using spawn")
+            start_method = "spawn"
+        self.mode = mode
+        self.start_method = start_method
+        self.workers = max(1, workers)
+        self.chunk = max(1, chunk)
+        self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=_triage_worker_init,
+                    mp_context=multiprocessing.get_context(self.start_method))
+            return self._pool
+
+    async def _run(self, fn, *args):
+        pool = self._get_pool()
+        try:
+            return await EXECUTION_LANES["triage"].run(fn, *args, executor=pool)
+        except concurrent.futures.process.BrokenProcessPool:
+            # A worker died; start a fresh pool for the next request
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = None
+            raise
+
+    def start(self):
+        """Spawn and warm every worker up front instead of on the first request"""
+        if self.mode != "process":
+            return
+        pool = self._get_pool()
+        concurrent.futures.wait([pool.submit(os.getpid) for _ in range(self.workers)])
+        print(f"Triage process pool ready with {self.workers} workers")
+
+    async def analyze_alert(self, alert_data: Any, trace: Optional[TriageTrace] = None) -> Dict[str, Any]:
+        if self.mode == "inline" or trace is not None:
+            return await offload("triage", triage_agent.analyze_alert, alert_data, trace)
+        return await self._run(_triage_worker_alert, alert_data)
+
+    async def analyze_batch(self, alerts: List[Any]) -> List[Dict[str, Any]]:
+        if self.mode == "inline":
+            return await offload("triage", analyze_alerts_isolated, alerts)
+        parts = await asyncio.gather(*(
+            self._run(analyze_alerts_isolated, alerts[i:i + self.chunk])
+            for i in range(0, len(alerts), self.chunk)
+        ))
+        return [result for part in parts for result in part]
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": self.mode, "workers": self.workers if self.mode == "process" else 0,
+                "start_method": self.start_method, "pool_running": self._pool is not None}
+
+triage_executor = TriageExecutor(TRIAGE_EXECUTOR, TRIAGE_WORKERS, TRIAGE_POOL_CHUNK, TRIAGE_POOL_START)
+
+@app.on_event("startup")
+def start_triage_executor():
+    triage_executor.start()
+
+@app.on_event("startup")
+def warm_models():
+    """MODEL_WARMUP=1: load the classifier and run one prediction before serving"""
+    if not MODEL_WARMUP:
+        return
+    try:
+        model_registry.classifier().warmup()
+    except Exception as e:
+        print(f"⚠️ Classifier warmup failed: {e}")
+
+RESPONSE_PROFILES = ("minimal", "standard", "full")
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+def response_profile(profile: Optional[str]) -> str:
+    """The requested response profile (RESPONSE_PROFILE when omitted); 400 for unknown names"""
+    profile = (profile or RESPONSE_PROFILE).strip().lower()
+    if profile not in RESPONSE_PROFILES:
+        raise HTTPException(status_code=400, detail=f"profile must be one of {', '.join(RESPONSE_PROFILES)}")
+    return profile
+
+def triage_profile(result: Dict[str, Any], profile: str) -> Dict[str, Any]:
+    """
+    Shape a triage result for the response profile without touching the (cached) result:
+      standard - attribute breakdown only once, in combined_attribute_analysis
+      minimal  - prediction only
+    Error results are returned unchanged.
+    """
+    if profile == "full" or "prediction" not in result:
+        return result
+    if profile == "minimal":
+        return {"prediction": result["prediction"]}
+    metadata = dict(result["metadata"])
+    for agent in ("agent1_score", "agent2_score"):
+        metadata[agent] = {k: v for k, v in metadata[agent].items() if k != "attributes"}
+    return {**result, "metadata": metadata}
+
+def predict_profile(result: Dict[str, Any], profile: str) -> Dict[str, Any]:
+    """
+    Shape a classifier result for the response profile:
+      standard - without the legacy all_features block (three floats per feature)
+      minimal  - predicted_verdict and confidence only
+    """
+    if profile == "full" or not isinstance(result, dict) or "prediction" not in result:
+        return result
+    prediction = result["prediction"]
+    if profile == "minimal":
+        return {"prediction": {"predicted_verdict": prediction["predicted_verdict"], "confidence": prediction["confidence"]}}
+    return {"prediction": prediction, "metadata": {k: v for k, v in result["metadata"].items() if k != "all_features"}}
+
+def wants_msgpack(accept: Optional[str]) -> bool:
+    """True when the Accept header asks for msgpack; 406 if the optional msgpack package is missing"""
+    if not any(media in (accept or "").lower() for media in MSGPACK_MEDIA_TYPES):
+        return False
+    try:
+        import msgpack  # noqa: F401
+    except ImportError:
+        raise HTTPException(status_code=406, detail="msgpack responses need the optional msgpack package.")
+    return True
+
+def encode_record(content: Any, msgpack_encoding: bool) -> bytes:
+    """One streamed record: a msgpack object, or a JSON line"""
+    if msgpack_encoding:
+        import msgpack
+        return msgpack.packb(content, default=str)
+    return (json.dumps(content, default=str) + "\n").encode("utf-8")
+
+def encoded_response(content: Any, msgpack_encoding: bool, headers: Optional[Dict[str, str]] = None) -> Response:
+    """JSONResponse, or a msgpack body when the client asked for it (see wants_msgpack)"""
+    if msgpack_encoding:
+        return Response(content=encode_record(content, True), media_type=MSGPACK_MEDIA_TYPES[0], headers=headers)
+    return JSONResponse(content=content, headers=headers)
+
+def stream_media_type(msgpack_encoding: bool) -> str:
+    """Media type of a streamed batch: concatenated msgpack objects or NDJSON"""
+    return MSGPACK_MEDIA_TYPES[0] if msgpack_encoding else "application/x-ndjson"
+
 @app.post("/triage")
-async def triage_alert(file: UploadFile = File(...)):
+async def triage_alert(file: UploadFile = File(...), x_triage_trace: Optional[str] = Header(None),
+                       profile: Optional[str] = None, accept: Optional[str] = Header(None)):
     """
     Upload a JSON alert file and get triage analysis with risk scoring.
+    profile: full (default) | standard | minimal; send Accept: application/msgpack for a msgpack body.
     """
     global triage_agent
     try:
+        profile = response_profile(profile)
+        msgpack_encoding = wants_msgpack(accept)
         if not file.filename.endswith(".json"):
             raise HTTPException(status_code=400, detail="Only JSON files are supported.")
 
@@ -622,148 +1715,921 @@ async def triage_alert(file: UploadFile = File(...)):
         except json.JSONDecodeError:
             raise HTTPException(status_code=400, detail="Invalid JSON format.")
 
-        # TEST: Verify new code is loaded
-        print("=== CODE VERSION CHECK ===")
-        print("New scoring code loaded successfully!")
-        
-        # Run triage analysis using the agent
-        results = triage_agent.analyze_alert(alert_data)
+        # Run triage analysis using the agent (traced when sampled or requested)
+        trace = triage_tracer.start(force=(x_triage_trace or "0").lower() not in ("0", "false", "no"))
+        results = await triage_executor.analyze_alert(alert_data, trace)
+        triage_tracer.finish(trace)
 
-        return JSONResponse(content=results)
+        headers = {"X-Triage-Trace-Id": trace.trace_id} if trace is not None else None
+        return encoded_response(triage_profile(results, profile), msgpack_encoding, headers)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+def _parse_alert_batch(text: str) -> List[Tuple[Optional[Any], Optional[str]]]:
+    """Parse a JSON array or NDJSON payload into (alert, error) pairs, one per alert"""
+    text = text.strip()
+    if not text:
+        return []
+    if text.startswith("["):
+        try:
+            return [(alert, None) for alert in json.loads(text)]
+        except json.JSONDecodeError:
+            return [(None, "Invalid JSON format.")]
+    parsed = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            parsed.append((json.loads(line), None))
+        except json.JSONDecodeError:
+            parsed.append((None, "Invalid JSON format."))
+    return parsed
+
+@app.post("/triage/batch")
+async def triage_alert_batch(request: Request, file: UploadFile = File(None),
+                             profile: Optional[str] = None, accept: Optional[str] = Header(None)):
+    """
+    Triage many alerts in one request.
+    Accepts NDJSON (one alert per line) or a JSON array, either as an uploaded file or the raw body,
+    and streams back one NDJSON result line per alert in input order (msgpack objects instead with
+    Accept: application/msgpack). profile as for /triage.
+    """
+    profile = response_profile(profile)
+    msgpack_encoding = wants_msgpack(accept)
+    content = await file.read() if file is not None else await request.body()
+    try:
+        entries = _parse_alert_batch(content.decode("utf-8"))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Batch payload must be UTF-8 encoded.")
+
+    async def score(alerts: List[Any]) -> List[Dict[str, Any]]:
+        try:
+            return await retry_overloaded(triage_executor.analyze_batch, alerts)
+        except ExecutorOverloaded as e:
+            # Still full after EXEC_RETRY_ATTEMPTS: fail this chunk's alerts and go on with the next chunk
+            return [{"error": e.detail, "timestamp": datetime.utcnow().isoformat()}] * len(alerts)
+
+    async def generate():
+        for start in range(0, len(entries), TRIAGE_BATCH_CHUNK):
+            chunk = entries[start:start + TRIAGE_BATCH_CHUNK]
+            scored = iter(await score([alert for alert, error in chunk if error is None]))
+            for offset, (alert, error) in enumerate(chunk):
+                line = triage_profile(next(scored), profile) if error is None else {"error": error}
+                yield encode_record({"index": start + offset, **line}, msgpack_encoding)
+
+    return StreamingResponse(generate(), media_type=stream_media_type(msgpack_encoding))
+
+@app.get("/debug/triage-traces")
+async def triage_traces(limit: int = 50):
+    """
+    Recent sampled triage traces (newest first).
+    Enable sampling with TRIAGE_TRACE_SAMPLE=N or send `X-Triage-Trace: 1` with a /triage request.
+    """
+    return JSONResponse(content=json.loads(json.dumps(
+        {"tracer": triage_tracer.stats(), "traces": triage_tracer.recent(limit)}, default=str)))
+
+@app.get("/debug/triage-cache")
+async def triage_cache_stats():
+    """Triage result cache counters and the active rule-set fingerprint"""
+    return {"fingerprint": ScoringTool.weights_fingerprint(), **triage_agent.result_cache.stats(),
+            "vt_score_cache": ScoringTool.rules().vt_cache.stats()}
                                
+class ModelUnavailable(HTTPException):
+    """503 while the classifier artifacts are missing or failed to load"""
+
+    def __init__(self, detail: str):
+        super().__init__(status_code=503, detail=detail,
+                         headers={"Retry-After": str(max(1, int(CLASSIFIER_RETRY_SECONDS)))})
+
 class AlertClassifier:
+    # Native artifacts written by export_models.py; the training pickles are the fallback
+    BOOSTER_FILE = "xgb_alert_classifier.ubj"
+    META_FILE = "classifier_meta.npz"
+
     def __init__(self, model_folder="./models-50"):
         self.model_folder = model_folder
-        self.model = None
-        self.label_encoders = {}
-        self.scaler = None
+        self.booster: Optional[xgb.Booster] = None
         self.feature_names = []
+        self.feature_importances: Optional[np.ndarray] = None
+        self.target_classes: Optional[np.ndarray] = None
+        # Label-encoder classes per feature (code = position)
+        self.encoder_classes: Dict[str, np.ndarray] = {}
+        self.scaler_mean: Optional[np.ndarray] = None
+        self.scaler_scale: Optional[np.ndarray] = None
+        # Per feature: (class -> code table, fallback code) for label-encoded features, else None
+        self._encoder_tables: List[Optional[Tuple[Dict[str, int], int]]] = []
+        # Booster with the scaler folded into its thresholds (takes raw encoded rows); None = scaler path
+        self.raw_booster: Optional[xgb.Booster] = None
+        # Compiled predictor (CLASSIFIER_BACKEND) for the same input as the booster in use; None = XGBoost
+        self.backend = None
+        # Encoded row bytes -> class probabilities; one per instance, i.e. per model version
+        self.prediction_cache = LRUTTLCache(CLASSIFIER_CACHE_SIZE, CLASSIFIER_CACHE_TTL)
+        self.artifact_format: Optional[str] = None
+        self.loaded = False
+        self.load_error: Optional[str] = None
+        self._load_failed_at = 0.0
+        self._load_lock = threading.Lock()
+
+    def _compile_encoders(self):
+        """Turn the encoder classes into dict lookups aligned with feature_names (codes = le.transform)"""
+        tables = []
+        for feature in self.feature_names:
+            classes = self.encoder_classes.get(feature) if feature != 'target' else None
+            if classes is None:
+                tables.append(None)
+                continue
+            lookup = {c: i for i, c in enumerate(classes) if isinstance(c, str)}
+            # Unseen values map to 'unknown' when the encoder knows it, else to classes_[0]
+            tables.append((lookup, lookup.get('unknown', 0)))
+        self._encoder_tables = tables
+
+    def ensure_loaded(self):
+        """Load the artifacts on first use; raises ModelUnavailable (503) while they cannot be loaded"""
+        if self.loaded:
+            return
+        with self._load_lock:
+            if self.loaded:
+                return
+            if self.load_error and time.monotonic() - self._load_failed_at < CLASSIFIER_RETRY_SECONDS:
+                raise ModelUnavailable(f"Classifier model unavailable: {self.load_error}")
+            if not self.load_model():
+                self._load_failed_at = time.monotonic()
+                raise ModelUnavailable(f"Classifier model unavailable: {self.load_error}")
 
     def load_model(self):
-        """Load model and preprocessing artifacts"""
+        """Load model and preprocessing artifacts (native booster + .npz metadata, else the pickles)"""
         try:
-            model_path = os.path.join(self.model_folder, 'xgb_alert_classifier.pkl')
-            with open(model_path, 'rb') as f:
-                self.model = pickle.load(f)
-
-            encoders_path = os.path.join(self.model_folder, 'label_encoders.pkl')
-            with open(encoders_path, 'rb') as f:
-                self.label_encoders = pickle.load(f)
-
-            scaler_path = os.path.join(self.model_folder, 'scaler.pkl')
-            with open(scaler_path, 'rb') as f:
-                self.scaler = pickle.load(f)
-
-            features_path = os.path.join(self.model_folder, 'feature_names.pkl')
-            with open(features_path, 'rb') as f:
-                self.feature_names = pickle.load(f)
-
-            print("✅ Model and preprocessing components loaded successfully")
+            if all(os.path.exists(os.path.join(self.model_folder, name)) for name in (self.BOOSTER_FILE, self.META_FILE)):
+                self._load_native()
+            else:
+                self._load_pickles()
+
+            self._compile_encoders()
+            probes = self._probe_rows(CLASSIFIER_FOLD_PROBES)
+            self.raw_booster = self._fold_scaler(probes) if CLASSIFIER_FOLD_SCALER else None
+            self.backend = self._compile_backend(probes)
+            self.prediction_cache.clear()
+            self.loaded, self.load_error = True, None
+            print(f"✅ Model and preprocessing components loaded successfully ({self.artifact_format})")
             return True
         except Exception as e:
+            self.load_error = f"{type(e).__name__}: {e}"
             print(f"❌ Error loading model: {e}")
             return False
 
-    def predict(self, input_data):
-        """Make predictions on new alert JSON data with metadata included"""
-        if self.model is None:
-            raise RuntimeError("Model not loaded!")
+    def _load_native(self):
+        """xgb_alert_classifier.ubj (XGBoost UBJSON booster) + classifier_meta.npz (plain arrays, no pickle)"""
+        booster = xgb.Booster(model_file=os.path.join(self.model_folder, self.BOOSTER_FILE))
+        with np.load(os.path.join(self.model_folder, self.META_FILE), allow_pickle=False) as meta:
+            self.feature_names = [str(f) for f in meta["feature_names"]]
+            self.feature_importances = meta["feature_importances"]
+            self.target_classes = meta["target_classes"].astype(object)
+            self.scaler_mean = meta["scaler_mean"]
+            self.scaler_scale = meta["scaler_scale"]
+            self.encoder_classes = {
+                key[len("classes:"):]: meta[key].astype(object) for key in meta.files if key.startswith("classes:")
+            }
+        self.booster = booster
+        self.artifact_format = "native"
+
+    def _load_pickles(self):
+        """The training pickles (sklearn XGBClassifier, LabelEncoders, StandardScaler)"""
+        model_path = os.path.join(self.model_folder, 'xgb_alert_classifier.pkl')
+        with open(model_path, 'rb') as f:
+            model = pickle.load(f)
+
+        encoders_path = os.path.join(self.model_folder, 'label_encoders.pkl')
+        with open(encoders_path, 'rb') as f:
+            label_encoders = pickle.load(f)
+
+        scaler_path = os.path.join(self.model_folder, 'scaler.pkl')
+        with open(scaler_path, 'rb') as f:
+            scaler = pickle.load(f)
+
+        features_path = os.path.join(self.model_folder, 'feature_names.pkl')
+        with open(features_path, 'rb') as f:
+            self.feature_names = list(pickle.load(f))
+
+        n = len(self.feature_names)
+        self.feature_importances = model.feature_importances_
+        self.target_classes = label_encoders['target'].classes_
+        self.encoder_classes = {k: le.classes_ for k, le in label_encoders.items() if k != 'target'}
+        self.scaler_mean = scaler.mean_ if scaler.with_mean else np.zeros(n)
+        self.scaler_scale = scaler.scale_ if scaler.with_std else np.ones(n)
+        self.booster = model.get_booster()
+        self.artifact_format = "pickle"
+
+    def export_native(self, folder: Optional[str] = None) -> List[str]:
+        """Write the loaded model as xgb_alert_classifier.ubj + classifier_meta.npz; returns the paths"""
+        folder = folder or self.model_folder
+        os.makedirs(folder, exist_ok=True)
+        booster_path = os.path.join(folder, self.BOOSTER_FILE)
+        meta_path = os.path.join(folder, self.META_FILE)
+        self.booster.save_model(booster_path)
+        arrays = {
+            "feature_names": np.array(self.feature_names, dtype=str),
+            "feature_importances": np.asarray(self.feature_importances, dtype=np.float32),
+            "target_classes": np.array(list(self.target_classes), dtype=str),
+            "scaler_mean": np.asarray(self.scaler_mean, dtype=np.float64),
+            "scaler_scale": np.asarray(self.scaler_scale, dtype=np.float64),
+        }
+        for feature, classes in self.encoder_classes.items():
+            arrays[f"classes:{feature}"] = np.array(list(classes), dtype=str)
+        np.savez(meta_path, **arrays)
+        return [booster_path, meta_path]
+
+    def warmup(self):
+        """Load now and run one prediction so the first request pays no load or first-call cost"""
+        self.ensure_loaded()
+        self.predict_each([{feature: 0 for feature in self.feature_names}], ["none"])
+
+    def stats(self) -> Dict[str, Any]:
+        return {"loaded": self.loaded, "format": self.artifact_format, "scaler_folded": self.raw_booster is not None,
+                "backend": CLASSIFIER_BACKEND if self.backend is not None else "xgboost", "error": self.load_error,
+                "prediction_cache": self.prediction_cache.stats()}
+
+    def _probe_rows(self, n_rows: int) -> np.ndarray:
+        """
+        Raw-space verification rows: integers around every split threshold (label codes, counts),
+        every label code and NaN, plus uniform values over each feature's range.
+        """
+        mean, scale = self.scaler_mean, self.scaler_scale
+        model = json.loads(self.booster.save_raw(raw_format="json"))
+        probes = [{0.0, 1.0} for _ in self.feature_names]
+        for tree in model["learner"]["gradient_booster"]["model"]["trees"]:
+            for left, f, t in zip(tree["left_children"], tree["split_indices"], tree["split_conditions"]):
+                if left != -1:
+                    raw = np.floor(float(np.float32(t)) * scale[f] + mean[f])
+                    probes[f].update(float(k) for k in raw + np.arange(-1, 3))
+        for f, feature in enumerate(self.feature_names):
+            classes = self.encoder_classes.get(feature)
+            probes[f].update(range(len(classes) + 1) if classes is not None else ())
+        values = [np.array(sorted(p)) for p in probes]
+        rng = np.random.default_rng(0)
+        n = max(1, n_rows // 2)
+        return np.vstack([
+            np.stack([rng.choice(np.append(v, np.nan), size=n) for v in values], axis=1),
+            np.stack([rng.uniform(v[0] - 1, v[-1] + 1, size=n) for v in values], axis=1),
+        ])
+
+    def _fold_scaler(self, probes: np.ndarray) -> Optional[xgb.Booster]:
+        """
+        Rewrite the booster's split thresholds into raw feature space (x_s < t  <=>  x < t * scale + mean),
+        so requests skip the scaler. Thresholds are snapped so the integers around each split (label codes,
+        counts) go the same way as float32((x - mean) / scale) < t did. Returns None, keeping the scaler
+        path, unless the folded booster reproduces predict_proba exactly on the probe rows.
+        """
+        try:
+            mean, scale = self.scaler_mean, self.scaler_scale
+            model = json.loads(self.booster.save_raw(raw_format="json"))
+            for tree in model["learner"]["gradient_booster"]["model"]["trees"]:
+                if any(tree["split_type"]):
+                    raise ValueError("categorical splits cannot be folded")
+                conditions = tree["split_conditions"]
+                for node, (left, f) in enumerate(zip(tree["left_children"], tree["split_indices"])):
+                    if left == -1:
+                        continue
+                    t = np.float32(conditions[node])
+                    raw = np.float32(float(t) * scale[f] + mean[f])
+                    for k in np.floor(raw) + np.arange(-1, 3):
+                        went_left = np.float32((k - mean[f]) / scale[f]) < t
+                        if went_left != (np.float32(k) < raw):
+                            raw = np.nextafter(np.float32(k), np.float32(np.inf)) if went_left else np.float32(k)
+                    conditions[node] = float(raw)
+            booster = xgb.Booster(model_file=bytearray(json.dumps(model).encode()))
+
+            if not np.array_equal(booster.inplace_predict(probes), self.booster.inplace_predict(self._scale(probes))):
+                print("⚠️ Folded classifier disagrees with the scaler path on probe rows; keeping the scaler")
+                return None
+            print(f"✅ Scaler folded into classifier thresholds (verified on {len(probes)} probe rows)")
+            return booster
+        except Exception as e:
+            print(f"⚠️ Could not fold scaler into classifier ({e}); keeping the scaler")
+            return None
+
+    def _compile_backend(self, probes: np.ndarray):
+        """
+        CLASSIFIER_BACKEND=treelite|onnx: compile the booster used for inference (the folded one when
+        available) into a native predictor returning class probabilities. Returns None, keeping XGBoost,
+        when the backend package is missing, compilation fails, or the compiled predictor's verdicts differ
+        from XGBoost on the probe rows (or its probabilities by more than CLASSIFIER_BACKEND_TOLERANCE).
+        """
+        if CLASSIFIER_BACKEND in ("", "xgboost"):
+            return None
+        booster = self.raw_booster if self.raw_booster is not None else self.booster
+        X = probes if self.raw_booster is not None else self._scale(probes)
+        try:
+            if CLASSIFIER_BACKEND == "treelite":
+                predict = self._compile_treelite(booster)
+            elif CLASSIFIER_BACKEND == "onnx":
+                predict = self._compile_onnx(booster)
+            else:
+                raise ValueError(f"unknown backend {CLASSIFIER_BACKEND!r} (xgboost, treelite or onnx)")
+            expected, got = booster.inplace_predict(X), predict(X)
+            if got.shape != expected.shape or not np.array_equal(got.argmax(axis=1), expected.argmax(axis=1)) \
+                    or np.abs(got - expected).max() > CLASSIFIER_BACKEND_TOLERANCE:
+                print(f"⚠️ {CLASSIFIER_BACKEND} classifier backend disagrees with XGBoost on probe rows; keeping XGBoost")
+                return None
+            print(f"✅ Classifier compiled with {CLASSIFIER_BACKEND} (verified on {len(X)} probe rows)")
+            return predict
+        except Exception as e:
+            print(f"⚠️ Could not use the {CLASSIFIER_BACKEND} classifier backend ({type(e).__name__}: {e}); keeping XGBoost")
+            return None
+
+    @staticmethod
+    def _compile_treelite(booster: xgb.Booster):
+        """Shared library generated by treelite/tl2cgen, cached per model under CLASSIFIER_BACKEND_CACHE"""
+        import treelite
+        import tl2cgen
+
+        digest = hashlib.sha256(booster.save_raw(raw_format="ubj")).hexdigest()[:16]
+        os.makedirs(CLASSIFIER_BACKEND_CACHE, exist_ok=True)
+        libpath = os.path.join(CLASSIFIER_BACKEND_CACHE, f"alert_classifier_{digest}.so")
+        if not os.path.exists(libpath):
+            model = treelite.frontend.from_xgboost(booster)
+            tmp = f"{libpath}.{os.getpid()}.tmp.so"
+            tl2cgen.export_lib(model, toolchain="gcc", libpath=tmp, params={"parallel_comp": 8})
+            os.replace(tmp, libpath)
+        predictor = tl2cgen.Predictor(libpath, nthread=1)
+
+        def predict(X: np.ndarray) -> np.ndarray:
+            out = predictor.predict(tl2cgen.DMatrix(X, dtype="float32"))
+            return np.asarray(out).reshape(len(X), -1)
+        return predict
+
+    @staticmethod
+    def _compile_onnx(booster: xgb.Booster):
+        """ONNX Runtime session (single-threaded: requests already run on the cpu lane's threads)"""
+        import onnxruntime as ort
+        from onnxmltools import convert_xgboost
+        from onnxmltools.convert.common.data_types import FloatTensorType
+
+        onx = convert_xgboost(booster, initial_types=[("input", FloatTensorType([None, booster.num_features()]))])
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = 1
+        options.inter_op_num_threads = 1
+        session = ort.InferenceSession(onx.SerializeToString(), options, providers=["CPUExecutionProvider"])
+        outputs = [o.name for o in session.get_outputs()]
+        output = next((name for name in outputs if "prob" in name.lower()), outputs[-1])
+
+        def predict(X: np.ndarray) -> np.ndarray:
+            return np.asarray(session.run([output], {"input": X.astype(np.float32)})[0])
+        return predict
+
+    @staticmethod
+    def _column_kind(values: List[Any]) -> str:
+        """
+        How the previous per-request DataFrame treated a column: 'bool' (cast to 0/1),
+        'numeric' (used as-is), 'float_str' (numbers with gaps: str(float), gaps 'unknown')
+        or 'str' (str(value), gaps 'unknown').
+        """
+        kinds = set()
+        missing = False
+        for v in values:
+            if v is None or (isinstance(v, float) and v != v):
+                missing = True
+            elif isinstance(v, bool):
+                kinds.add(bool)
+            elif isinstance(v, (int, float)):
+                kinds.add(float)
+            else:
+                kinds.add(str)
+        if kinds == {float}:
+            return "float_str" if missing else "numeric"
+        if kinds == {bool} and not missing:
+            return "bool"
+        return "str"
+
+    def encode(self, rows: List[Dict[str, Any]]) -> np.ndarray:
+        """
+        Encode flat feature dicts into the raw (unscaled) feature matrix, one column per
+        feature_names entry. Missing values become 'unknown'; label-encoded columns use
+        the compiled lookup tables, other columns must be numeric.
+        """
+        X = np.empty((len(rows), len(self.feature_names)), dtype=np.float64)
+        for j, (feature, table) in enumerate(zip(self.feature_names, self._encoder_tables)):
+            column = [row.get(feature) for row in rows]
+            kind = self._column_kind(column)
+            if kind == "numeric" or (table is None and kind == "bool"):
+                X[:, j] = column
+                continue
+            if table is None:
+                # Not label-encoded: numeric strings convert, anything else is an error
+                for i, v in enumerate(column):
+                    X[i, j] = float('unknown' if v is None or v != v else v)
+                continue
+            if kind == "bool":
+                X[:, j] = column
+                continue
+            lookup, fallback = table
+            if kind == "float_str":
+                column = ['unknown' if v is None or v != v else str(float(v)) for v in column]
+            else:
+                column = ['unknown' if v is None or (isinstance(v, float) and v != v) else str(v) for v in column]
+            X[:, j] = [lookup.get(v, fallback) for v in column]
+        return X
+
+    def predict(self, input_data, explain: str = "legacy", top_k: int = 5):
+        """Make predictions on new alert JSON data with metadata included (see _predict_encoded for explain)"""
+        self.ensure_loaded()
 
         if isinstance(input_data, dict):
-            df = pd.DataFrame([input_data])
-        elif isinstance(input_data, list):
-            df = pd.DataFrame(input_data)
+            rows = [input_data]
+        elif isinstance(input_data, list) and input_data and all(isinstance(row, dict) for row in input_data):
+            rows = input_data
         else:
             raise ValueError("Input must be dict or list of dicts")
 
-        df = df.fillna('unknown')
-        for feature in self.feature_names:
-            if feature not in df.columns:
-                df[feature] = 'unknown'
-        df_features = df[self.feature_names].copy() 
-        for col in df_features.columns:
-            if col in self.label_encoders and col != 'target':
-                le = self.label_encoders[col]
+        # Encode features (scaling happens in _predict_encoded)
+        results = self._predict_encoded(self.encode(rows), explain, top_k)
+        return results if len(results) > 1 else results[0]
 
-                if df_features[col].dtype == bool:
-                    df_features[col] = df_features[col].to_numpy(dtype="int64")
+    def predict_each(self, rows: List[Any], explains: Optional[List[str]] = None,
+                     top_ks: Optional[List[int]] = None) -> List[Any]:
+        """
+        Predict rows independently (each encoded exactly as if sent alone) with one model
+        call; returns one result dict or exception per row, for the /predict micro-batcher.
+        explains/top_ks give each row's explanation settings (default legacy / 5).
+        """
+        self.ensure_loaded()
+        out: List[Any] = [None] * len(rows)
+        encoded, positions = [], []
+        for i, row in enumerate(rows):
+            try:
+                if not isinstance(row, dict):
+                    raise ValueError("Input must be dict or list of dicts")
+                encoded.append(self.encode([row])[0])
+                positions.append(i)
+            except Exception as e:
+                out[i] = e
+        if encoded:
+            explain = [explains[i] for i in positions] if explains else "legacy"
+            top_k = [top_ks[i] for i in positions] if top_ks else 5
+            for i, result in zip(positions, self._predict_encoded(np.vstack(encoded), explain, top_k)):
+                out[i] = result
+        return out
 
-                elif pd.api.types.is_numeric_dtype(df_features[col]):
-                    continue
-                else:
-                    df_features.loc[:, col] = df_features[col].astype(str)
-                    mask = df_features[col].isin(le.classes_)
-                    df_features.loc[~mask, col] = 'unknown'
+    EXPLAIN_MODES = ("legacy", "none", "topk", "full")
 
-                    if 'unknown' not in le.classes_:
-                        df_features.loc[~mask, col] = le.classes_[0]
+    def _scale(self, X: np.ndarray) -> np.ndarray:
+        """StandardScaler.transform into a new matrix: (x - mean) / scale"""
+        return (X - self.scaler_mean) / self.scaler_scale
 
-                    df_features.loc[:, col] = le.transform(df_features[col])
+    def _predict_encoded(self, X: np.ndarray, explain: Any = "legacy", top_k: Any = 5) -> List[Dict[str, Any]]:
+        """
+        Predict raw encoded rows with a single probability pass (verdict = argmax); uses the
+        scaler-folded booster when available, otherwise scales first.
+        explain (one mode, or one per row) selects the metadata returned:
+          legacy - importance * |scaled value| blocks (top_contributing_features / all_features)
+          none   - prediction only
+          topk   - top_k features by |SHAP contribution| (XGBoost pred_contribs) for the verdict
+          full   - SHAP contributions of every feature for the verdict
+        """
+        n = X.shape[0]
+        explains = [explain] * n if isinstance(explain, str) else list(explain)
+        top_ks = [top_k] * n if isinstance(top_k, int) else list(top_k)
+        for mode in set(explains):
+            if mode not in self.EXPLAIN_MODES:
+                raise ValueError(f"explain must be one of {', '.join(self.EXPLAIN_MODES)}")
+
+        folded = self.raw_booster is not None
+        X_scaled = self._scale(X) if not folded or "legacy" in explains else None
+        booster, X_model = (self.raw_booster, X) if folded else (self.booster, X_scaled)
+        probabilities = self._probabilities(X, X_model, booster)
+        predictions = probabilities.argmax(axis=1)
+
+        target_classes = self.target_classes
+        predicted_labels = target_classes[predictions]
+
+        # Per-row SHAP values only for the rows that asked for them: (rows, classes, features + bias)
+        shap_rows = [i for i, mode in enumerate(explains) if mode in ("topk", "full")]
+        contribs = {}
+        if shap_rows:
+            values = booster.predict(xgb.DMatrix(X_model[shap_rows]), pred_contribs=True)
+            contribs = dict(zip(shap_rows, values))
+
+        legacy_scores = None
+        if "legacy" in explains:
+            legacy_scores = self.feature_importances * np.abs(X_scaled)
 
-        # Scale features
-        X_scaled = self.scaler.transform(df_features)
+        results = []
+        for i, (pred_label, probs) in enumerate(zip(predicted_labels, probabilities)):
+            mode = explains[i]
+            if mode == "legacy":
+                metadata = self._legacy_contributions(X_scaled[i], legacy_scores[i])
+            elif mode == "none":
+                metadata = {}
+            else:
+                row_contribs = contribs[i]
+                if row_contribs.ndim == 2:
+                    row_contribs = row_contribs[predictions[i]]
+                metadata = {"explanation": self._shap_explanation(X[i], row_contribs, pred_label, mode, top_ks[i])}
 
-        # Predict
-        predictions = self.model.predict(X_scaled)
-        probabilities = self.model.predict_proba(X_scaled)
+            results.append({
+                "prediction": {
+                    "predicted_verdict": pred_label,
+                    "confidence": float(probs[predictions[i]]),
+                    "probabilities": {
+                        target_classes[j]: float(probs[j]) for j in range(len(target_classes))
+                    }
+                },
+                "metadata": metadata
+            })
 
-        target_le = self.label_encoders['target']
-        predicted_labels = target_le.inverse_transform(predictions)
+        return results
 
-        results = []
-        for i, (pred_label, probs) in enumerate(zip(predicted_labels, probabilities)):
-            # feature importance * input values = contribution
-            feature_importance = self.model.feature_importances_
-            contributions = {
-                feat: {
-                    "value": float(X_scaled[i][idx]),
-                    "importance_weight": float(feature_importance[idx]),
-                    "contribution_score": float(feature_importance[idx] * abs(X_scaled[i][idx]))
-                }
-                for idx, feat in enumerate(self.feature_names)
+    def _probabilities(self, X: np.ndarray, X_model: np.ndarray, booster: xgb.Booster) -> np.ndarray:
+        """
+        Class probabilities per row. Rows whose encoded vector is in prediction_cache skip the
+        model; the rest are predicted together (compiled backend or booster) and cached.
+        """
+        def infer(rows: np.ndarray) -> np.ndarray:
+            return self.backend(rows) if self.backend is not None else booster.inplace_predict(rows)
+
+        cache = self.prediction_cache
+        if not cache.enabled:
+            return infer(X_model)
+        keys = [row.tobytes() for row in X]
+        cached = [cache.get(key) for key in keys]
+        misses = [i for i, probs in enumerate(cached) if probs is None]
+        if not misses:
+            return np.vstack(cached)
+        computed = infer(X_model[misses])
+        for i, probs in zip(misses, computed):
+            cached[i] = probs.copy()
+            cache.put(keys[i], cached[i])
+        return np.vstack(cached)
+
+    def _legacy_contributions(self, x_scaled: np.ndarray, scores: np.ndarray) -> Dict[str, Any]:
+        """Global feature importance * |scaled value| per feature, top 5 first (previous response shape)"""
+        feature_importance = self.feature_importances
+        contributions = {
+            feat: {
+                "value": float(x_scaled[idx]),
+                "importance_weight": float(feature_importance[idx]),
+                "contribution_score": float(scores[idx])
             }
+            for idx, feat in enumerate(self.feature_names)
+        }
+        # stable descending order, same tie-breaking as sorted(..., reverse=True)
+        order = np.argsort(-scores, kind="stable")[:5]
+        top_features = {self.feature_names[idx]: contributions[self.feature_names[idx]] for idx in order}
+        return {"top_contributing_features": top_features, "all_features": contributions}
+
+    def _shap_explanation(self, x: np.ndarray, row_contribs: np.ndarray, label: str, mode: str, top_k: int) -> Dict[str, Any]:
+        """Per-row SHAP contributions (log-odds) of the predicted class; the last column is the bias"""
+        feature_contribs = row_contribs[:-1]
+        k = max(0, min(top_k, len(feature_contribs)))
+        magnitude = np.abs(feature_contribs)
+        top = np.argpartition(-magnitude, k - 1)[:k] if k else np.empty(0, dtype=int)
+        top = top[np.argsort(-magnitude[top], kind="stable")]
+        explanation = {
+            "method": "xgboost_pred_contribs",
+            "class": label,
+            "bias": float(row_contribs[-1]),
+            "margin": float(row_contribs.sum()),
+            "top_features": [
+                {"feature": self.feature_names[idx], "value": float(x[idx]), "contribution": float(feature_contribs[idx])}
+                for idx in top
+            ]
+        }
+        if mode == "full":
+            explanation["contributions"] = {
+                feat: float(feature_contribs[idx]) for idx, feat in enumerate(self.feature_names)
+            }
+        return explanation
+
+
 
-            # sort contributions
-            sorted_features = sorted(
-                contributions.items(),
-                key=lambda x: x[1]["contribution_score"],
-                reverse=True
-            )
-            top_features = dict(sorted_features[:5])
 
-            results.append({
-                "prediction": {
-                    "predicted_verdict": pred_label,
-                    "confidence": float(max(probs)),
-                    "probabilities": {
-                        target_le.classes_[j]: float(probs[j]) for j in range(len(target_le.classes_))
-                    }
-                },
-                "metadata": {
-                    "top_contributing_features": top_features,
-                    "all_features": contributions
+
+@dataclass
+class ModelVersion:
+    kind: str
+    version: str
+    source: str
+    # AlertClassifier, or (model, cfg, rel_names) for the GNN; None = load `source` lazily
+    model: Any = None
+    loaded_at: Optional[str] = None
+
+    def info(self) -> Dict[str, Any]:
+        return {"version": self.version, "source": self.source, "loaded_at": self.loaded_at}
+
+class ModelRegistry:
+    """
+    Active version per model kind ("classifier", "gnn") plus an optional candidate. A new
+    version loads (and warms up) in a background thread, then goes live with one reference
+    swap: in-flight requests finish on the version they started with, nothing restarts.
+    A sampled percentage of traffic can be shadow-scored on the candidate; responses always
+    come from the active version, the candidate's latency and verdict agreement are recorded.
+    """
+    KINDS = ("classifier", "gnn")
+
+    def __init__(self, classifier_folder: str = "./models-50", gnn_ckpt: str = DEFAULT_GNN_CKPT,
+                 shadow_percent: float = 0.0):
+        self._lock = threading.Lock()
+        # Both initial versions load lazily (MODEL_WARMUP=1 loads the classifier at startup)
+        self._active = {
+            "classifier": ModelVersion("classifier", "initial", classifier_folder, AlertClassifier(classifier_folder)),
+            "gnn": ModelVersion("gnn", "initial", gnn_ckpt),
+        }
+        self._previous: Dict[str, ModelVersion] = {}
+        self._candidate: Dict[str, ModelVersion] = {}
+        self._loading: Dict[str, Dict[str, Any]] = {}
+        self.shadow_percent = {kind: shadow_percent for kind in self.KINDS}
+        self._shadow = {kind: self._shadow_stats(None) for kind in self.KINDS}
+
+    def active(self, kind: str) -> ModelVersion:
+        return self._active[kind]
+
+    def classifier(self) -> AlertClassifier:
+        return self._active["classifier"].model
+
+    def gnn(self):
+        """Active GNN as (model, cfg, rel_names); the initial checkpoint loads on first use"""
+        active = self._active["gnn"]
+        return active.model if active.model is not None else _load_gnn_model(active.source)
+
+    @staticmethod
+    def _build(kind: str, source: str):
+        if kind == "classifier":
+            model = AlertClassifier(source)
+            model.warmup()
+            return model
+        return _build_gnn_model(source)
+
+    def load(self, kind: str, source: str, version: Optional[str] = None, promote: bool = False) -> Dict[str, Any]:
+        """Start loading `source` in the background as the candidate (made active right away when promote)"""
+        with self._lock:
+            if self._loading.get(kind, {}).get("state") == "loading":
+                raise HTTPException(status_code=409, detail=f"A {kind} version is already loading")
+            version = version or f"{os.path.basename(os.path.normpath(source))}@{datetime.now():%Y%m%dT%H%M%S}"
+            status = {"state": "loading", "version": version, "source": source, "promote": promote,
+                      "started_at": datetime.now().isoformat()}
+            self._loading[kind] = status
+        threading.Thread(target=self._load, args=(kind, source, version, promote),
+                         name=f"model-load-{kind}", daemon=True).start()
+        return dict(status)
+
+    def _load(self, kind: str, source: str, version: str, promote: bool):
+        start = time.perf_counter()
+        try:
+            model = self._build(kind, source)
+        except Exception as e:
+            with self._lock:
+                self._loading[kind].update(state="failed", error=f"{type(e).__name__}: {e}",
+                                           elapsed_ms=round((time.perf_counter() - start) * 1000, 1))
+            print(f"❌ Failed to load {kind} {version} from {source}: {e}")
+            return
+        with self._lock:
+            self._candidate[kind] = ModelVersion(kind, version, source, model, datetime.now().isoformat())
+            self._shadow[kind] = self._shadow_stats(version)
+            self._loading[kind].update(state="loaded", elapsed_ms=round((time.perf_counter() - start) * 1000, 1))
+        print(f"✅ Loaded {kind} {version} from {source}")
+        if promote:
+            self.promote(kind)
+
+    def promote(self, kind: str) -> Dict[str, Any]:
+        """Make the candidate the active version; the replaced one is kept for rollback"""
+        with self._lock:
+            candidate = self._candidate.pop(kind, None)
+            if candidate is None:
+                raise HTTPException(status_code=404, detail=f"No {kind} candidate loaded")
+            self._previous[kind], self._active[kind] = self._active[kind], candidate
+        print(f"🔁 {kind} {candidate.version} is now active")
+        return candidate.info()
+
+    def rollback(self, kind: str) -> Dict[str, Any]:
+        """Swap the previous version back in"""
+        with self._lock:
+            previous = self._previous.pop(kind, None)
+            if previous is None:
+                raise HTTPException(status_code=404, detail=f"No previous {kind} version to roll back to")
+            self._previous[kind], self._active[kind] = self._active[kind], previous
+        print(f"🔁 {kind} rolled back to {previous.version}")
+        return previous.info()
+
+    def discard(self, kind: str) -> Dict[str, Any]:
+        with self._lock:
+            candidate = self._candidate.pop(kind, None)
+            if candidate is None:
+                raise HTTPException(status_code=404, detail=f"No {kind} candidate loaded")
+        return candidate.info()
+
+    @staticmethod
+    def _shadow_stats(version: Optional[str]) -> Dict[str, Any]:
+        return {"version": version, "sampled": 0, "compared": 0, "agreed": 0, "errors": 0, "skipped": 0,
+                "primary_ms_total": 0.0, "candidate_ms_total": 0.0, "candidate_ms_max": 0.0}
+
+    def shadow_candidate(self, kind: str) -> Optional[ModelVersion]:
+        """The candidate when this call is sampled for shadow scoring, else None"""
+        candidate = self._candidate.get(kind)
+        if candidate is None or random.random() * 100 >= self.shadow_percent[kind]:
+            return None
+        return candidate
+
+    def record_shadow(self, kind: str, version: str, primary: List[Optional[str]] = (),
+                      verdicts: List[Optional[str]] = (), primary_ms: float = 0.0, candidate_ms: float = 0.0,
+                      error: bool = False, skipped: bool = False):
+        with self._lock:
+            stats = self._shadow[kind]
+            if stats["version"] != version:
+                return
+            stats["sampled"] += 1
+            if skipped or error:
+                stats["skipped" if skipped else "errors"] += 1
+                return
+            pairs = [(p, v) for p, v in zip(primary, verdicts) if p is not None and v is not None]
+            stats["compared"] += len(pairs)
+            stats["agreed"] += sum(str(p) == str(v) for p, v in pairs)
+            stats["primary_ms_total"] += primary_ms
+            stats["candidate_ms_total"] += candidate_ms
+            stats["candidate_ms_max"] = max(stats["candidate_ms_max"], candidate_ms)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {}
+            for kind in self.KINDS:
+                shadow = dict(self._shadow[kind])
+                timed = shadow["sampled"] - shadow["errors"] - shadow["skipped"]
+                primary_ms, candidate_ms = shadow.pop("primary_ms_total"), shadow.pop("candidate_ms_total")
+                shadow.update(
+                    percent=self.shadow_percent[kind],
+                    agreement=shadow["agreed"] / shadow["compared"] if shadow["compared"] else None,
+                    primary_ms_mean=primary_ms / timed if timed else None,
+                    candidate_ms_mean=candidate_ms / timed if timed else None)
+                out[kind] = {
+                    "active": self._active[kind].info(),
+                    "candidate": self._candidate[kind].info() if kind in self._candidate else None,
+                    "previous": self._previous[kind].info() if kind in self._previous else None,
+                    "loading": dict(self._loading[kind]) if kind in self._loading else None,
+                    "shadow": shadow,
                 }
-            })
+            if self._active["classifier"].model is not None:
+                out["classifier"]["active"]["state"] = self.classifier().stats()
+            return out
 
-        return results if len(results) > 1 else results[0]
+model_registry = ModelRegistry(shadow_percent=MODEL_SHADOW_PERCENT)
 
+_shadow_tasks: set = set()
 
+def schedule_shadow(kind: str, score, primary: List[Optional[str]], primary_ms: float):
+    """
+    If this call is sampled, run score(candidate_model) -> verdicts on the "cpu" lane in the
+    background and record it against the active model's verdicts. Never delays the caller.
+    """
+    candidate = model_registry.shadow_candidate(kind)
+    if candidate is None:
+        return
+
+    async def run():
+        start = time.perf_counter()
+        try:
+            verdicts = await offload("cpu", score, candidate.model)
+        except ExecutorOverloaded:
+            model_registry.record_shadow(kind, candidate.version, skipped=True)
+            return
+        except Exception:
+            model_registry.record_shadow(kind, candidate.version, error=True)
+            return
+        model_registry.record_shadow(kind, candidate.version, primary, verdicts, primary_ms,
+                                     (time.perf_counter() - start) * 1000)
+
+    task = asyncio.get_running_loop().create_task(run())
+    _shadow_tasks.add(task)
+    task.add_done_callback(_shadow_tasks.discard)
 
+def classifier_verdicts(results) -> List[Optional[str]]:
+    """predicted_verdict per result (None where a row failed)"""
+    results = results if isinstance(results, list) else [results]
+    return [r["prediction"]["predicted_verdict"] if isinstance(r, dict) else None for r in results]
+
+class PredictBatcher:
+    """
+    Coalesces concurrent single-alert predictions into micro-batches: a batch is
+    dispatched once it holds max_batch rows or max_wait_ms after its first row, and
+    runs one model call on the "cpu" lane. Rows are encoded independently, so every
+    caller gets exactly the result an unbatched predict would give.
+    """
 
+    def __init__(self, max_batch: int = 64, max_wait_ms: float = 2.0):
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._loop = None
+        self._pending: List[Tuple[dict, str, int, asyncio.Future]] = []
+        self._timer = None
+        # In-flight batch tasks; the loop only keeps weak references to tasks
+        self._tasks: set = set()
+        self.batches = 0
+        self.rows = 0
+
+    async def predict(self, row: Dict[str, Any], explain: str = "legacy", top_k: int = 5) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._pending, self._timer = loop, [], None
+        future = loop.create_future()
+        self._pending.append((row, explain, top_k, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            self.batches += 1
+            self.rows += len(batch)
+            task = self._loop.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _run(batch: List[Tuple[dict, str, int, asyncio.Future]]):
+        rows, explains, top_ks, futures = zip(*batch)
+        start = time.perf_counter()
+        try:
+            try:
+                results = await offload("cpu", model_registry.classifier().predict_each, list(rows), list(explains), list(top_ks))
+            except Exception as e:
+                results = [e] * len(batch)
+            else:
+                schedule_shadow("classifier", lambda clf: classifier_verdicts(clf.predict_each(list(rows), ["none"] * len(rows))),
+                                classifier_verdicts(results), (time.perf_counter() - start) * 1000)
+            for future, result in zip(futures, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            # Cancelled on shutdown: don't leave the callers waiting
+            for future in futures:
+                if not future.done():
+                    future.cancel()
+
+    async def close(self, timeout: float = 10.0):
+        """Dispatch pending rows and wait for in-flight batches; batches still running after timeout are cancelled"""
+        if self._loop is asyncio.get_running_loop():
+            self._flush()
+        if self._tasks:
+            _, running = await asyncio.wait(list(self._tasks), timeout=timeout)
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": PREDICT_MICROBATCH, "max_batch": self.max_batch, "max_wait_ms": self.max_wait * 1000,
+                "batches": self.batches, "rows": self.rows,
+                "mean_batch_size": self.rows / self.batches if self.batches else 0.0}
+
+predict_batcher = PredictBatcher(PREDICT_BATCH_MAX, PREDICT_BATCH_WAIT_MS)
 
-classifier = AlertClassifier()
-if not classifier.load_model():
-    raise RuntimeError("Failed to load model. Train the model first and save artifacts.")
+@app.on_event("shutdown")
+async def drain_predict_batcher():
+    # Registered before shutdown_event, so the cpu lane is still up
+    await predict_batcher.close()
+
+async def predict_one(row: Dict[str, Any], explain: str = "legacy", top_k: int = 5) -> Dict[str, Any]:
+    """classifier.predict for a single alert, micro-batched with concurrent callers when enabled"""
+    if PREDICT_MICROBATCH:
+        return await predict_batcher.predict(row, explain, top_k)
+    return await predict_many(row, explain, top_k)
+
+async def predict_many(data, explain: str = "legacy", top_k: int = 5):
+    """classifier.predict on the "cpu" lane with the active model (shadow-scored when sampled)"""
+    start = time.perf_counter()
+    results = await offload("cpu", model_registry.classifier().predict, data, explain, top_k)
+    schedule_shadow("classifier", lambda clf: classifier_verdicts(clf.predict(data, "none")),
+                    classifier_verdicts(results), (time.perf_counter() - start) * 1000)
+    return results
 
 @app.post("/predict")
-async def predict_alert(file: UploadFile = File(...)):
+async def predict_alert(file: UploadFile = File(...), explain: str = "legacy", top_k: int = 5,
+                        profile: Optional[str] = None, accept: Optional[str] = Header(None)):
     """
     Upload a JSON alert file and get prediction results.
+    explain: legacy (importance-based metadata, default) | none | topk | full (per-row SHAP).
+    profile: full (default) | standard | minimal; send Accept: application/msgpack for a msgpack body.
     """
     try:
+        if explain not in AlertClassifier.EXPLAIN_MODES:
+            raise HTTPException(status_code=400, detail=f"explain must be one of {', '.join(AlertClassifier.EXPLAIN_MODES)}")
+        profile = response_profile(profile)
+        msgpack_encoding = wants_msgpack(accept)
+        if profile == "minimal":
+            # the metadata is dropped anyway
+            explain = "none"
         if not file.filename.endswith(".json"):
             raise HTTPException(status_code=400, detail="Only JSON files are supported.")
 
@@ -774,14 +2640,231 @@ async def predict_alert(file: UploadFile = File(...)):
         except json.JSONDecodeError:
             raise HTTPException(status_code=400, detail="Invalid JSON format.")
 
-        # Run prediction
-        results = classifier.predict(data)
+        # Run prediction (single alerts are micro-batched with concurrent requests)
+        if isinstance(data, dict):
+            results = await predict_one(data, explain, top_k)
+        else:
+            results = await predict_many(data, explain, top_k)
 
-        return JSONResponse(content=results)
+        if isinstance(results, list):
+            results = [predict_profile(result, profile) for result in results]
+        else:
+            results = predict_profile(results, profile)
+        return encoded_response(results, msgpack_encoding)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class BodyStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse for generators that are still reading the request body. The stock response
+    listens for http.disconnect on `receive` while streaming, which would swallow the request chunks;
+    here a disconnect surfaces from request.stream() (ClientDisconnect) instead.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+async def _upload_chunks(upload, size: int = 1 << 16):
+    """An uploaded (spooled) file as byte chunks"""
+    try:
+        while True:
+            chunk = await upload.read(size)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        await upload.close()
+
+def _parse_ndjson_line(line: bytes) -> Tuple[Optional[Any], Optional[str]]:
+    try:
+        return json.loads(line), None
+    except ValueError:
+        return None, "Invalid JSON format."
+
+async def _ndjson_records(chunks, max_line: int):
+    """(record, error) per non-blank NDJSON line, split incrementally from an async iterator of byte chunks"""
+    pending: List[bytes] = []
+    pending_size = 0
+    oversized = False
+    too_long = (None, f"Line longer than {max_line} bytes.")
+    async for chunk in chunks:
+        start = 0
+        while True:
+            end = chunk.find(b"\n", start)
+            if end < 0:
+                if not oversized:
+                    pending.append(chunk[start:])
+                    pending_size += len(chunk) - start
+                    if pending_size > max_line:
+                        # Report once, then drop the rest of this line
+                        yield too_long
+                        oversized, pending, pending_size = True, [], 0
+                break
+            if oversized:
+                oversized = False
+            else:
+                line = b"".join(pending) + chunk[start:end] if pending else chunk[start:end]
+                pending, pending_size = [], 0
+                if len(line) > max_line:
+                    yield too_long
+                elif line.strip():
+                    yield _parse_ndjson_line(line)
+            start = end + 1
+    if pending and not oversized:
+        line = b"".join(pending)
+        if line.strip():
+            yield _parse_ndjson_line(line)
+
+@app.post("/predict/batch")
+async def predict_alert_stream(request: Request, explain: str = "none", top_k: int = 5,
+                               profile: Optional[str] = None, accept: Optional[str] = Header(None)):
+    """
+    Score an NDJSON upload (one flat alert per line, as a multipart `file` field or the raw body) and
+    stream one NDJSON result line per alert, in input order, as each chunk of PREDICT_STREAM_CHUNK rows
+    finishes. The upload is read incrementally and at most two chunks are held at a time, so memory
+    stays flat for any upload size. explain defaults to none here; explain and profile as for /predict
+    (Accept: application/msgpack streams msgpack objects instead of lines).
+    """
+    if explain not in AlertClassifier.EXPLAIN_MODES:
+        raise HTTPException(status_code=400, detail=f"explain must be one of {', '.join(AlertClassifier.EXPLAIN_MODES)}")
+    profile = response_profile(profile)
+    msgpack_encoding = wants_msgpack(accept)
+    if profile == "minimal":
+        explain = "none"
+    # One model version for the whole stream; fail with 503 before streaming if it cannot load
+    clf = model_registry.classifier()
+    if not clf.loaded:
+        await offload("io", clf.ensure_loaded)
+
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        upload = (await request.form()).get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Multipart payload needs a 'file' field.")
+        chunks = _upload_chunks(upload)
+    else:
+        chunks = request.stream()
+
+    async def predict(rows: List[Any]) -> Tuple[List[Any], float]:
+        start = time.perf_counter()
+        results = await offload("cpu", clf.predict_each, rows, [explain] * len(rows), [top_k] * len(rows))
+        return results, time.perf_counter() - start
+
+    async def score(rows: List[Any]) -> List[Any]:
+        try:
+            # Backpressure: the upload is not read further while the cpu lane has no room
+            results, elapsed = await retry_overloaded(predict, rows)
+        except ExecutorOverloaded as e:
+            # Still full after EXEC_RETRY_ATTEMPTS: render reports this chunk's rows as failed
+            return [e] * len(rows)
+        schedule_shadow("classifier", lambda c: classifier_verdicts(c.predict_each(rows, ["none"] * len(rows))),
+                        classifier_verdicts(results), elapsed * 1000)
+        return results
+
+    def launch(records):
+        return asyncio.ensure_future(score([record for record, error in records if error is None]))
+
+    async def render(first: int, records, task) -> bytes:
+        scored = iter(await task)
+        lines = []
+        for offset, (record, error) in enumerate(records):
+            result = next(scored) if error is None else None
+            if isinstance(result, HTTPException):
+                error = result.detail
+            elif isinstance(result, Exception):
+                error = str(result)
+            line = {"index": first + offset, "error": error} if error is not None else {"index": first + offset, **predict_profile(result, profile)}
+            lines.append(encode_record(line, msgpack_encoding))
+        return b"".join(lines)
+
+    async def generate():
+        index, records, inflight = 0, [], None
+        try:
+            async for record in _ndjson_records(chunks, PREDICT_STREAM_MAX_LINE):
+                records.append(record)
+                if len(records) < PREDICT_STREAM_CHUNK:
+                    continue
+                # Score this chunk while the next one is read
+                if inflight is not None:
+                    yield await render(*inflight)
+                inflight = (index, records, launch(records))
+                index, records = index + len(records), []
+            if inflight is not None:
+                yield await render(*inflight)
+                inflight = None
+            if records:
+                yield await render(index, records, launch(records))
+        finally:
+            if inflight is not None:
+                inflight[2].cancel()
+
+    return BodyStreamingResponse(generate(), media_type=stream_media_type(msgpack_encoding))
+
+def _registry_kind(kind: str) -> str:
+    if kind not in ModelRegistry.KINDS:
+        raise HTTPException(status_code=404, detail=f"Unknown model kind: {kind}")
+    return kind
+
+def _registry_admin(kind: str) -> str:
+    """_registry_kind for the endpoints that change what is loaded or served (opt-in via MODEL_REGISTRY_ADMIN)"""
+    if not MODEL_REGISTRY_ADMIN:
+        raise HTTPException(status_code=403, detail="Model registry changes are disabled (set MODEL_REGISTRY_ADMIN=1).")
+    return _registry_kind(kind)
+
+def _registry_source(source: str) -> str:
+    """Resolved source path, which must lie inside one of the MODEL_REGISTRY_ROOT folders"""
+    path = os.path.realpath(source)
+    for root in filter(None, MODEL_REGISTRY_ROOT.split(os.pathsep)):
+        root = os.path.realpath(root)
+        if os.path.commonpath([root, path]) == root:
+            return path
+    raise HTTPException(status_code=400, detail="source must be inside MODEL_REGISTRY_ROOT")
+
+@app.get("/models")
+async def model_registry_status():
+    """Active / candidate / previous version per model kind, background loads and shadow-scoring stats"""
+    return JSONResponse(content=json.loads(json.dumps(model_registry.status(), default=str)))
+
+@app.post("/models/{kind}/load")
+async def load_model_version(kind: str, source: str, version: Optional[str] = None, promote: bool = False,
+                             shadow_percent: Optional[float] = None):
+    """
+    Load a model version in the background: a models folder for the classifier, a checkpoint for the GNN.
+    It becomes the candidate (shadow-scored on shadow_percent % of traffic), or goes live once loaded when promote.
+    """
+    _registry_admin(kind)
+    path = _registry_source(source)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"Model source not found: {source}")
+    if shadow_percent is not None:
+        model_registry.shadow_percent[kind] = min(100.0, max(0.0, shadow_percent))
+    return JSONResponse(status_code=202, content=model_registry.load(kind, path, version, promote))
+
+@app.post("/models/{kind}/promote")
+async def promote_model_version(kind: str):
+    """Switch traffic to the loaded candidate"""
+    return {"active": model_registry.promote(_registry_admin(kind))}
+
+@app.post("/models/{kind}/rollback")
+async def rollback_model_version(kind: str):
+    """Switch traffic back to the version active before the last promote"""
+    return {"active": model_registry.rollback(_registry_admin(kind))}
+
+@app.post("/models/{kind}/shadow")
+async def set_model_shadow(kind: str, percent: float):
+    """Percentage of traffic also scored on the candidate (0 disables)"""
+    model_registry.shadow_percent[_registry_admin(kind)] = min(100.0, max(0.0, percent))
+    return {"kind": kind, "percent": model_registry.shadow_percent[kind]}
+
+@app.delete("/models/{kind}/candidate")
+async def discard_model_candidate(kind: str):
+    """Drop the loaded candidate"""
+    return {"discarded": model_registry.discard(_registry_admin(kind))}
+
 
 
 # Configuration from .env
@@ -803,15 +2886,98 @@ except Exception as e:
     print(f"Failed to connect to Neo4j: {e}")
     neo4j_driver = None
 
+class AsyncGraphDAL:
+    """
+    AsyncGraphDatabase driver with its own tuned pool for the hot graph paths (UNWIND ingest writes
+    and GNN k-hop reads), so those queries are awaited on the event loop and overlap with other
+    requests instead of each holding an io-lane thread. Opened at startup; `ready` is False when
+    disabled or unreachable, and callers then use the synchronous driver.
+    """
+
+    def __init__(self, database: str):
+        self.database = database
+        self.driver = None
+
+    @property
+    def ready(self) -> bool:
+        return self.driver is not None
+
+    async def open(self):
+        if not (NEO4J_ASYNC and all([NEO4J_URI, NEO4J_USERNAME, NEO4J_PASSWORD])):
+            return
+        driver = AsyncGraphDatabase.driver(
+            NEO4J_URI,
+            auth=(NEO4J_USERNAME, NEO4J_PASSWORD),
+            max_connection_pool_size=NEO4J_POOL_SIZE,
+            connection_acquisition_timeout=NEO4J_POOL_ACQUIRE_TIMEOUT,
+            max_connection_lifetime=NEO4J_CONNECTION_LIFETIME,
+        )
+        try:
+            await driver.verify_connectivity()
+        except Exception as e:
+            await driver.close()
+            print(f"⚠️ Async Neo4j driver unavailable, using the synchronous driver: {e}")
+            return
+        self.driver = driver
+        print(f"✅ Async Neo4j driver ready (pool size {NEO4J_POOL_SIZE})")
+
+    async def close(self):
+        driver, self.driver = self.driver, None
+        if driver is not None:
+            await driver.close()
+
+    async def write_alert_rows(self, rows: List[Dict[str, Any]]):
+        """Neo4jGraphManager.UNWIND_INGEST_QUERY in one write transaction"""
+        async def work(tx):
+            result = await tx.run(Neo4jGraphManager.UNWIND_INGEST_QUERY, alerts=rows)
+            await result.consume()
+
+        async with self.driver.session(database=self.database) as session:
+            await session.execute_write(work)
+
+    async def khop_record(self, alert_id: str, max_hops: int) -> Optional[Dict[str, Any]]:
+        """KHOP_SUBGRAPH_QUERY result (nodes, rels) for the alert, None when it is not in the graph"""
+        async def work(tx):
+            result = await tx.run(KHOP_SUBGRAPH_QUERY, id=alert_id, K=max_hops)
+            record = await result.single()
+            return record.data() if record is not None else None
+
+        async with self.driver.session(database=self.database) as session:
+            return await session.execute_read(work)
+
+graph_dal = AsyncGraphDAL(NEO4J_DATABASE or "neo4j")
+
+@app.on_event("startup")
+async def open_graph_dal():
+    await graph_dal.open()
+
+@app.on_event("shutdown")
+async def close_graph_dal():
+    await graph_dal.close()
+
 class Neo4jGraphManager:
     """Manages Neo4j graph operations for alert data following OCSF mapping"""
     
     def __init__(self, driver):
         self.driver = driver
         self.database = NEO4J_DATABASE
-        
+        self.schema_version = None
+        self.schema_error = None
+        self._schema_attempted_at: Optional[float] = None
+        self.entity_cache = LRUTTLCache(GRAPH_ENTITY_CACHE_SIZE, GRAPH_ENTITY_CACHE_TTL)
+        # Shared entity key -> [write transactions in flight, claim generation] (see _claim_shared_entities)
+        self._entity_claims: Dict[Tuple, List[int]] = {}
+        self._entity_lock = threading.Lock()
+
     def create_alert_graph(self, alert_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create comprehensive alert graph following EXACT 18 nodes + 20 relationships specification"""
+        self.retry_schema()
+        if GRAPH_INGEST_MODE == "statements":
+            return self._create_alert_graph_statements(alert_data)
+        return self.create_alert_graphs([alert_data])[0]
+
+    def _create_alert_graph_statements(self, alert_data: Dict[str, Any]) -> Dict[str, Any]:
+        """create_alert_graph with one auto-commit statement per node and relationship"""
         
         print("Creating alert knowledge graph in Neo4j following strict schema...")
         
@@ -824,10 +2990,6 @@ class Neo4jGraphManager:
                 self.nodes_created = {}
                 self.relationships_created = []
                 
-                # Create constraints and indexes first
-                print("🔧 Creating constraints and indexes...")
-                self.create_constraints_and_indexes()
-                
                 # CREATE NODES (18 total as per specification)
                 self._create_node_1_alert(session, alert_data)
                 self._create_node_19_scores(session, alert_data)
@@ -887,6 +3049,450 @@ class Neo4jGraphManager:
             except Exception as e:
                 print(f"Error creating graph: {e}")
                 raise e
+
+    # ==================== SINGLE-STATEMENT INGESTION (UNWIND) ====================
+
+    # Same nodes, keys, properties and relationships as the per-statement methods below, for a
+    # list of alert rows built by _alert_graph_row. Optional parts are 0/1-element lists so FOREACH
+    # creates them only when the alert has them. refresh_* lists are empty when that shared entity
+    # was recently written with the same properties (see _mark_shared_entities): its SET (and for
+    # the host, its host-scoped nodes and relationships) is skipped and it is only looked up.
+    UNWIND_INGEST_QUERY = """
+    UNWIND $alerts AS row
+    MERGE (a:Alert {threat_id: row.threat_id})
+    SET a += row.alert
+    MERGE (sc:Scores {alert_id: row.alert_id})
+    SET sc += row.scores
+    MERGE (f:File {uid: row.file_uid})
+    SET f += row.file
+    MERGE (p:Process {threat_id: row.threat_id, name: row.process_name})
+    SET p += row.process
+    MERGE (h:Host {uuid: row.host_uuid})
+    FOREACH (x IN row.refresh_host |
+        SET h += row.host
+        MERGE (n:NetworkInterface {device_uuid: row.host_uuid, mac: row.interface_mac})
+        SET n += row.interface
+        MERGE (h)-[:HOST_HAS_INTERFACE]->(n)
+        MERGE (ip:ExternalIP {ip: row.external_ip})
+        MERGE (h)-[r10:HOST_CONNECTS_TO]->(ip)
+        SET r10.vantage = 'egress')
+    MERGE (m:MitigationAction {uid: row.mitigation_uid})
+    SET m += row.mitigation
+    MERGE (e:Engine {uid: row.engine_uid})
+    FOREACH (x IN row.refresh_engine | SET e += row.engine)
+    MERGE (s:Site {uid: row.site_uid})
+    FOREACH (x IN row.refresh_site | SET s.desc = row.site_desc)
+    MERGE (i:Incident {incident_id: row.incident_id})
+    SET i += row.incident
+    MERGE (w:WhiteningRule {rule: row.whitening_rule})
+    FOREACH (os IN row.os |
+        MERGE (o:OsVersion {name: os.name, build: os.build})
+        FOREACH (x IN row.refresh_os | SET o.type = os.type)
+        FOREACH (x IN row.refresh_host | MERGE (h)-[:HOST_HAS_OS]->(o)))
+    FOREACH (value IN row.sha256 |
+        MERGE (hh:Hash {algorithm: 'sha256', value: value})
+        MERGE (f)-[:FILE_HAS_HASH]->(hh))
+    FOREACH (value IN row.sha1 |
+        MERGE (hh:Hash {algorithm: 'sha1', value: value})
+        MERGE (f)-[:FILE_HAS_HASH]->(hh))
+    FOREACH (actor IN row.user |
+        MERGE (u:User {name: actor.name})
+        FOREACH (x IN row.refresh_user | SET u.domain = actor.domain)
+        MERGE (p)-[:PROCESS_EXECUTED_BY]->(u))
+    FOREACH (host_group IN row.group |
+        MERGE (g:Group {uid: host_group.uid})
+        FOREACH (x IN row.refresh_group | SET g.name = host_group.name)
+        FOREACH (x IN row.refresh_host | MERGE (h)-[:HOST_IN_GROUP]->(g)))
+    FOREACH (ti IN row.ti_checkpoint |
+        MERGE (t:ThreatIntel {resource: ti.resource, provider: 'Check Point'})
+        SET t += ti.props
+        FOREACH (value IN row.sha256 |
+            MERGE (hh:Hash {algorithm: 'sha256', value: value})
+            MERGE (hh)-[:HASH_ENRICHED_BY_TI]->(t)))
+    FOREACH (ti IN row.ti_virustotal |
+        MERGE (t:ThreatIntel {composite_key: ti.composite_key, provider: 'VirusTotal'})
+        SET t += ti.props
+        FOREACH (value IN row.sha256 |
+            MERGE (hh:Hash {algorithm: 'sha256', value: value})
+            MERGE (hh)-[:HASH_ENRICHED_BY_TI]->(t)))
+    MERGE (a)-[r1:ALERT_REFERS_TO_FILE]->(f)
+    SET r1.created_at = row.time
+    MERGE (a)-[r4:ALERT_TRIGGERED_BY]->(p)
+    SET r4.detection_type = row.detection_type,
+        r4.initiated_by = 'agent_policy'
+    MERGE (p)-[:PROCESS_ON_HOST]->(h)
+    MERGE (f)-[:FILE_RESIDES_ON]->(h)
+    MERGE (a)-[:ALERT_MITIGATED_VIA]->(m)
+    MERGE (m)-[:ACTION_APPLIED_ON]->(h)
+    MERGE (a)-[:ALERT_DETECTED_BY]->(e)
+    MERGE (a)-[:ALERT_BELONGS_TO_SITE]->(s)
+    MERGE (a)-[:ALERT_IN_INCIDENT]->(i)
+    MERGE (a)-[:ALERT_WHITELISTED_BY]->(w)
+    MERGE (a)-[:ALERT_HAS_SCORE]->(sc)
+    """
+
+    def create_alert_graphs(self, alerts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Create the graphs of several alerts with one UNWIND statement in one write transaction
+        (one round trip instead of one per node and relationship). All alerts are written or none;
+        an alert missing a required field fails the call before anything is sent.
+        Returns one create_alert_graph-style result per alert, in order.
+        """
+        self.retry_schema()
+        rows, breakdowns = self._alert_graph_rows(alerts)
+        if not rows:
+            return []
+        self._write_alert_graphs(rows)
+        return self._alert_graph_results(breakdowns)
+
+    async def create_alert_graph_async(self, alert_data: Dict[str, Any]) -> Dict[str, Any]:
+        """create_alert_graph for async handlers: awaited on graph_dal, else on the "io" lane"""
+        if GRAPH_INGEST_MODE == "statements" or not graph_dal.ready:
+            return await offload("io", self.create_alert_graph, alert_data)
+        rows, breakdowns = await offload("cpu", self._alert_graph_rows, [alert_data])
+        await self._write_alert_graphs_async(rows)
+        return self._alert_graph_results(breakdowns)[0]
+
+    def _alert_graph_rows(self, alerts: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Tuple]]:
+        rows, breakdowns = [], []
+        for alert_data in alerts:
+            row, nodes, relationships = self._alert_graph_row(alert_data)
+            rows.append(row)
+            breakdowns.append((row["alert_id"], nodes, relationships))
+        return rows, breakdowns
+
+    @staticmethod
+    def _alert_graph_results(breakdowns: List[Tuple]) -> List[Dict[str, Any]]:
+        timestamp = datetime.now().isoformat()
+        results = []
+        for alert_id, nodes, relationships in breakdowns:
+            results.append({
+                "success": True,
+                "graph_created": True,
+                "alert_id": alert_id,
+                "nodes_created": sum(nodes.values()),
+                "relationships_created": len(relationships),
+                "node_breakdown": nodes,
+                "timestamp": timestamp
+            })
+        print(f"Graph created successfully for {len(results)} alert(s) in one transaction")
+        return results
+
+    def ingest_alert_chunk(self, alerts: List[Any]) -> List[Optional[str]]:
+        """
+        Bulk variant of create_alert_graphs: alerts that cannot be mapped are skipped and the rest are
+        written in one transaction. Returns one error message (None = written) per alert; if the
+        transaction fails every mapped alert carries its error.
+        """
+        self.retry_schema()
+        rows, written, errors = self._map_alert_chunk(alerts)
+        if rows:
+            try:
+                self._write_alert_graphs(rows)
+            except Exception as e:
+                for position in written:
+                    errors[position] = f"Transaction failed: {e}"
+        return errors
+
+    async def ingest_alert_chunk_async(self, alerts: List[Any]) -> List[Optional[str]]:
+        """ingest_alert_chunk for async handlers: awaited on graph_dal, else on the "io" lane"""
+        if not graph_dal.ready:
+            return await offload("io", self.ingest_alert_chunk, alerts)
+        if self.schema_version is None:
+            await offload("io", self.retry_schema)
+        rows, written, errors = await offload("cpu", self._map_alert_chunk, alerts)
+        if rows:
+            try:
+                await self._write_alert_graphs_async(rows)
+            except ExecutorOverloaded:
+                # Nothing was written; let the caller back off and resend the chunk
+                raise
+            except Exception as e:
+                for position in written:
+                    errors[position] = f"Transaction failed: {e}"
+        return errors
+
+    def _map_alert_chunk(self, alerts: List[Any]) -> Tuple[List[Dict[str, Any]], List[int], List[Optional[str]]]:
+        """(rows of the mappable alerts, their positions, per-alert mapping errors)"""
+        rows, written, errors = [], [], [None] * len(alerts)
+        for position, alert_data in enumerate(alerts):
+            try:
+                if not isinstance(alert_data, dict):
+                    raise ValueError("Alert must be a JSON object")
+                rows.append(self._alert_graph_row(alert_data)[0])
+                written.append(position)
+            except KeyError as e:
+                errors[position] = f"Missing field: {e}"
+            except Exception as e:
+                errors[position] = str(e)
+        return rows, written, errors
+
+    def _write_alert_graphs(self, rows: List[Dict[str, Any]]):
+        """
+        Write alert parameter maps with UNWIND_INGEST_QUERY in one write transaction. Shared entities
+        are only recorded in entity_cache once the transaction has committed.
+        """
+        rows, claims = self._mark_shared_entities(rows)
+        committed = False
+        try:
+            with self.driver.session(database=self.database) as session:
+                try:
+                    session.execute_write(self._write_alert_rows, rows)
+                except Exception as e:
+                    print(f"Error creating graph: {e}")
+                    raise e
+            committed = True
+        finally:
+            self._release_shared_entities(claims, committed)
+
+    async def _write_alert_graphs_async(self, rows: List[Dict[str, Any]]):
+        """_write_alert_graphs through graph_dal"""
+        rows, claims = await offload("cpu", self._mark_shared_entities, rows)
+        committed = False
+        try:
+            try:
+                await graph_dal.write_alert_rows(rows)
+            except Exception as e:
+                print(f"Error creating graph: {e}")
+                raise e
+            committed = True
+        finally:
+            self._release_shared_entities(claims, committed)
+
+    # Entities many alerts point at; the host entry also covers its interface, external IP and
+    # HOST_* relationships, so an unchanged host skips all of them
+    SHARED_ENTITIES = ("host", "user", "site", "group", "engine", "os")
+
+    @staticmethod
+    def _shared_entity_states(row: Dict[str, Any]) -> Dict[str, Tuple[Tuple, Any]]:
+        """(cache key, state written for it) per shared entity present in the row"""
+        os_info = row["os"][0]
+        states = {
+            "host": (("Host", row["host_uuid"]), {
+                "host": row["host"], "interface_mac": row["interface_mac"], "interface": row["interface"],
+                "external_ip": row["external_ip"], "groups": [group["uid"] for group in row["group"]],
+                "os": [os_info["name"], os_info["build"]],
+            }),
+            "site": (("Site", row["site_uid"]), row["site_desc"]),
+            "engine": (("Engine", row["engine_uid"]), row["engine"]),
+            "os": (("OsVersion", os_info["name"], os_info["build"]), os_info["type"]),
+        }
+        if row["user"]:
+            states["user"] = (("User", row["user"][0]["name"]), row["user"][0]["domain"])
+        if row["group"]:
+            states["group"] = (("Group", row["group"][0]["uid"]), row["group"][0]["name"])
+        return states
+
+    def _mark_shared_entities(self, rows: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[Tuple, Tuple[str, int, bool]]]:
+        """
+        Copies of rows with refresh_<entity> cleared for shared entities already written with the same
+        state, by a committed ingest (entity_cache) or an earlier row of the same statement. An entity
+        another transaction is still writing is always refreshed. Also returns this write's claims
+        (key -> (state digest, claim generation, shared with an earlier write)), to be released with
+        _release_shared_entities.
+        """
+        marked, written = [], {}
+        with self._entity_lock:
+            for row in rows:
+                row = dict(row)
+                for entity, (key, state) in self._shared_entity_states(row).items():
+                    digest = canonical_digest(state)
+                    if written.get(key) == digest or (key not in written and key not in self._entity_claims
+                                                      and self.entity_cache.get(key) == digest):
+                        row[f"refresh_{entity}"] = []
+                    else:
+                        written[key] = digest
+                # Group / OS nodes are only needed to set their properties or link a refreshed host
+                if not row["refresh_host"]:
+                    if not row["refresh_group"]:
+                        row["group"] = []
+                    if not row["refresh_os"]:
+                        row["os"] = []
+                marked.append(row)
+            claims = {}
+            for key, digest in written.items():
+                claim = self._entity_claims.setdefault(key, [0, 0])
+                claim[0] += 1
+                claim[1] += 1
+                claims[key] = (digest, claim[1], claim[0] > 1)
+        return marked, claims
+
+    def _release_shared_entities(self, claims: Dict[Tuple, Tuple[str, int, bool]], committed: bool):
+        """
+        After a write transaction: record the states it committed in entity_cache, unless another
+        transaction wrote the same entity meanwhile (commit order unknown, so the entry is dropped).
+        """
+        with self._entity_lock:
+            for key, (digest, generation, shared) in claims.items():
+                claim = self._entity_claims[key]
+                claim[0] -= 1
+                overlapped = shared or claim[0] > 0 or claim[1] != generation
+                if claim[0] == 0:
+                    del self._entity_claims[key]
+                if committed and not overlapped:
+                    self.entity_cache.put(key, digest)
+                elif committed:
+                    self.entity_cache.discard(key)
+
+    @classmethod
+    def _write_alert_rows(cls, tx, rows: List[Dict[str, Any]]):
+        tx.run(cls.UNWIND_INGEST_QUERY, alerts=rows).consume()
+
+    @staticmethod
+    def _alert_graph_row(data: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, int], List[str]]:
+        """
+        Parameter map of one alert for UNWIND_INGEST_QUERY, plus the node breakdown and relationship
+        list the per-statement path reports for it (same fields, same conditions).
+        """
+        threat, device, remediation = data['threat'], data['device'], data['remediation']
+        hashes = data['file']['hashes']
+        sha256 = [hashes['sha256']] if hashes.get('sha256') else []
+        sha1 = [hashes['sha1']] if hashes.get('sha1') else []
+        user = data['actor']['process']['user']
+        users = [{"name": user['name'], "domain": user['domain']}] if user['name'] else []
+        groups = [{"uid": device['groups'][0]['uid'], "name": device['groups'][0]['name']}] if device['groups'] else []
+        interface = device['interface']
+        product = data['metadata']['product']
+        engine_names = [product['feature']['name']] + product['name']
+        enrichments = data['enrichments'] if 'enrichments' in data else []
+
+        ti_checkpoint = []
+        if len(enrichments) > 0 and 'resource' in enrichments[0]['data']:
+            cp_data = enrichments[0]['data']
+            ti_checkpoint = [{"resource": cp_data['resource'], "props": {
+                key: cp_data.get(key) for key in ("classification", "confidence", "severity", "risk_score", "name",
+                                                  "type", "size", "first_seen_time", "positives", "total")
+            }}]
+        ti_virustotal = []
+        if len(enrichments) > 1:
+            vt_data = enrichments[1]['data']
+            stats = vt_data.get('stats', {})
+            props = {key: vt_data.get(key) for key in ("positives", "total", "malicious", "suspicious", "scan_time")}
+            for key in ("malicious", "suspicious", "undetected", "harmless", "unsupported", "timeout", "failure"):
+                props[f"stats_{key}"] = stats.get(key)
+            props["stats_confirmed_timeout"] = stats.get('confirmed-timeout')
+            ti_virustotal = [{"composite_key": f"VirusTotal_{vt_data.get('total', 0)}_{vt_data.get('positives', 0)}",
+                              "props": props}]
+
+        row = {
+            "threat_id": threat['id'],
+            "alert_id": data['alert']['id'],
+            "time": data['time'],
+            "detection_type": threat['detection']['type'],
+            "alert": {
+                "time": data['time'],
+                "detected_time": threat['detected_time'],
+                "alert_id": data['alert']['id'],
+                "name": threat['name'],
+                "classification": threat['classification'],
+                "confidence": threat['confidence'],
+                "verdict": threat['verdict'],
+                "incident_status": data['incident']['status'],
+                "remediation_status": remediation['status'],
+            },
+            "scores": {
+                "ml_score_fp": data['ml_score'].get('False Positive'),
+                "gnn_score_fp": data['gnn_score'].get('False Positive'),
+                "rule_score_fp": data['rule_base_score'].get('False Positive'),
+            },
+            "file_uid": data['file']['uid'],
+            "file": {
+                "path": data['file']['path'],
+                "extension": data['file']['extension'],
+                "size": data['file']['size'],
+                "verification_type": data['file']['verification']['type'],
+                "certificate_status": data['file']['signature']['certificate']['status'],
+                "certificate_issuer": data['file']['signature']['certificate']['issuer'],
+                "reputation_score": data['file']['reputation']['score'],
+            },
+            "sha256": sha256,
+            "sha1": sha1,
+            "process_name": data['process']['name'],
+            "process": {
+                "cmd_args": data['process']['cmd']['args'],
+                "isFileless": data['process']['isFileless'],
+                "detection_type": threat['detection']['type'],
+            },
+            "user": users,
+            "host_uuid": device['uuid'],
+            "host": {
+                "hostname": device['hostname'],
+                "domain": device['domain'],
+                "ipv4_addresses": device['ipv4_addresses'],
+                "network_status": device['network']['status'],
+                "is_active": device['is_active'],
+            },
+            "interface_mac": interface['mac'],
+            "interface": {"name": interface['name'], "ip": interface['ip']},
+            "external_ip": interface['ip'],
+            "ti_checkpoint": ti_checkpoint,
+            "ti_virustotal": ti_virustotal,
+            "mitigation_uid": remediation['uid'],
+            "mitigation": {
+                "status": remediation['status'],
+                "desc": remediation['desc'],
+                "start_time": remediation['start_time'],
+                "end_time": remediation['end_time'],
+                "result": remediation['result'],
+            },
+            "engine_uid": '|'.join(engine_names),
+            "engine": {
+                "name": product['feature']['name'],
+                "version": product['feature']['version'],
+                "names": engine_names,
+                "detection_type": threat['detection']['type'],
+            },
+            "site_uid": device['location']['uid'],
+            "site_desc": device['location']['desc'],
+            "group": groups,
+            "incident_id": f"INC-{threat['id']}",
+            "incident": {"status": data['incident']['status'], "desc": data['incident']['desc']},
+            "os": [{"name": device['os']['name'], "build": device['os']['build'], "type": device['os']['type']}],
+            "whitening_rule": remediation['result'],
+        }
+        # Write every shared entity unless _mark_shared_entities finds it unchanged
+        for entity in Neo4jGraphManager.SHARED_ENTITIES:
+            row[f"refresh_{entity}"] = [1]
+
+        # Same breakdown (and order) as the per-statement methods
+        nodes = {"Alert": 1, "Scores": 1, "File": 1}
+        if sha256:
+            nodes["Hash(SHA256)"] = 1
+        if sha1:
+            nodes["Hash(SHA1)"] = 1
+        nodes["Process"] = 1
+        if users:
+            nodes["User"] = 1
+        nodes.update({"Host": 1, "NetworkInterface": 1, "ExternalIP": 1})
+        if ti_checkpoint:
+            nodes["ThreatIntel(CheckPoint)"] = 1
+        if ti_virustotal:
+            nodes["ThreatIntel(VirusTotal)"] = 1
+        nodes.update({"MitigationAction": 1, "Engine": 1, "Site": 1})
+        if groups:
+            nodes["Group"] = 1
+        nodes.update({"Incident": 1, "OsVersion": 1, "WhiteningRule": 1})
+
+        relationships = ["ALERT_REFERS_TO_FILE"]
+        if sha256:
+            relationships.append("FILE_HAS_HASH(SHA256)")
+        if sha1:
+            relationships.append("FILE_HAS_HASH(SHA1)")
+        relationships.append("ALERT_TRIGGERED_BY")
+        if users:
+            relationships.append("PROCESS_EXECUTED_BY")
+        relationships += ["PROCESS_ON_HOST", "FILE_RESIDES_ON"]
+        if sha256 and ti_checkpoint:
+            relationships.append("HASH_ENRICHED_BY_TI(CheckPoint)")
+        if sha256 and ti_virustotal:
+            relationships.append("HASH_ENRICHED_BY_TI(VirusTotal)")
+        relationships += ["HOST_CONNECTS_TO", "ALERT_MITIGATED_VIA", "ACTION_APPLIED_ON", "ALERT_DETECTED_BY",
+                          "ALERT_BELONGS_TO_SITE"]
+        if groups:
+            relationships.append("HOST_IN_GROUP")
+        relationships += ["HOST_HAS_INTERFACE", "ALERT_IN_INCIDENT", "HOST_HAS_OS", "ALERT_WHITELISTED_BY",
+                          "ALERT_HAS_SCORE"]
+        return row, nodes, relationships
     
     
     # ==================== NODE CREATION METHODS (18 nodes) ====================
@@ -1501,37 +4107,106 @@ class Neo4jGraphManager:
         )
         self.relationships_created.append('ALERT_HAS_SCORE')
     
+    # Bump GRAPH_SCHEMA_VERSION whenever SCHEMA_STATEMENTS change so running deployments apply them once
+    GRAPH_SCHEMA_VERSION = 1
+    SCHEMA_STATEMENTS = [
+        # Node constraints based on exact keys from specification (also the MERGE lookups of the ingest)
+        "CREATE CONSTRAINT alert_threat_id IF NOT EXISTS FOR (a:Alert) REQUIRE a.threat_id IS UNIQUE",
+        "CREATE CONSTRAINT file_uid IF NOT EXISTS FOR (f:File) REQUIRE f.uid IS UNIQUE",
+        "CREATE CONSTRAINT hash_sha256 IF NOT EXISTS FOR (h:Hash) REQUIRE (h.algorithm, h.value) IS UNIQUE",
+        "CREATE CONSTRAINT user_name IF NOT EXISTS FOR (u:User) REQUIRE u.name IS UNIQUE",
+        "CREATE CONSTRAINT host_uuid IF NOT EXISTS FOR (h:Host) REQUIRE h.uuid IS UNIQUE",
+        "CREATE CONSTRAINT process_composite IF NOT EXISTS FOR (p:Process) REQUIRE (p.threat_id, p.name) IS UNIQUE",
+        "CREATE CONSTRAINT network_interface IF NOT EXISTS FOR (n:NetworkInterface) REQUIRE (n.device_uuid, n.mac) IS UNIQUE",
+        "CREATE CONSTRAINT external_ip IF NOT EXISTS FOR (e:ExternalIP) REQUIRE e.ip IS UNIQUE",
+        "CREATE CONSTRAINT threat_intel_cp IF NOT EXISTS FOR (t:ThreatIntel) REQUIRE (t.resource, t.provider) IS UNIQUE",
+        "CREATE CONSTRAINT threat_intel_vt IF NOT EXISTS FOR (t:ThreatIntel) REQUIRE (t.composite_key, t.provider) IS UNIQUE",
+        "CREATE CONSTRAINT mitigation_uid IF NOT EXISTS FOR (m:MitigationAction) REQUIRE m.uid IS UNIQUE",
+        "CREATE CONSTRAINT engine_uid IF NOT EXISTS FOR (e:Engine) REQUIRE e.uid IS UNIQUE",
+        "CREATE CONSTRAINT site_uid IF NOT EXISTS FOR (s:Site) REQUIRE s.uid IS UNIQUE",
+        "CREATE CONSTRAINT group_uid IF NOT EXISTS FOR (g:Group) REQUIRE g.uid IS UNIQUE",
+        "CREATE CONSTRAINT incident_id IF NOT EXISTS FOR (i:Incident) REQUIRE i.incident_id IS UNIQUE",
+        "CREATE CONSTRAINT os_version IF NOT EXISTS FOR (o:OsVersion) REQUIRE (o.name, o.build) IS UNIQUE",
+        "CREATE CONSTRAINT whitening_rule IF NOT EXISTS FOR (w:WhiteningRule) REQUIRE w.rule IS UNIQUE",
+        "CREATE CONSTRAINT scores_alert IF NOT EXISTS FOR (s:Scores) REQUIRE s.alert_id IS UNIQUE",
+        "CREATE CONSTRAINT schema_version_name IF NOT EXISTS FOR (v:SchemaVersion) REQUIRE v.name IS UNIQUE",
+        # Lookup indexes for the read paths: GNN k-hop fetch and the analyzers start from Alert {alert_id}
+        "CREATE INDEX alert_alert_id IF NOT EXISTS FOR (a:Alert) ON (a.alert_id)",
+    ]
+
     def create_constraints_and_indexes(self):
-        """Create constraints exactly as per schema specification"""
-        constraints_queries = [
-            # Node constraints based on exact keys from specification
-            "CREATE CONSTRAINT alert_threat_id IF NOT EXISTS FOR (a:Alert) REQUIRE a.threat_id IS UNIQUE",
-            "CREATE CONSTRAINT file_uid IF NOT EXISTS FOR (f:File) REQUIRE f.uid IS UNIQUE", 
-            "CREATE CONSTRAINT hash_sha256 IF NOT EXISTS FOR (h:Hash) REQUIRE (h.algorithm, h.value) IS UNIQUE",
-            "CREATE CONSTRAINT user_name IF NOT EXISTS FOR (u:User) REQUIRE u.name IS UNIQUE",
-            "CREATE CONSTRAINT host_uuid IF NOT EXISTS FOR (h:Host) REQUIRE h.uuid IS UNIQUE",
-            "CREATE CONSTRAINT process_composite IF NOT EXISTS FOR (p:Process) REQUIRE (p.threat_id, p.name) IS UNIQUE",
-            "CREATE CONSTRAINT network_interface IF NOT EXISTS FOR (n:NetworkInterface) REQUIRE (n.device_uuid, n.mac) IS UNIQUE",
-            "CREATE CONSTRAINT external_ip IF NOT EXISTS FOR (e:ExternalIP) REQUIRE e.ip IS UNIQUE",
-            "CREATE CONSTRAINT threat_intel_cp IF NOT EXISTS FOR (t:ThreatIntel) REQUIRE (t.resource, t.provider) IS UNIQUE",
-            "CREATE CONSTRAINT threat_intel_vt IF NOT EXISTS FOR (t:ThreatIntel) REQUIRE (t.composite_key, t.provider) IS UNIQUE",
-            "CREATE CONSTRAINT mitigation_uid IF NOT EXISTS FOR (m:MitigationAction) REQUIRE m.uid IS UNIQUE",
-            "CREATE CONSTRAINT engine_uid IF NOT EXISTS FOR (e:Engine) REQUIRE e.uid IS UNIQUE",
-            "CREATE CONSTRAINT site_uid IF NOT EXISTS FOR (s:Site) REQUIRE s.uid IS UNIQUE",
-            "CREATE CONSTRAINT group_uid IF NOT EXISTS FOR (g:Group) REQUIRE g.uid IS UNIQUE",
-            "CREATE CONSTRAINT incident_id IF NOT EXISTS FOR (i:Incident) REQUIRE i.incident_id IS UNIQUE",
-            "CREATE CONSTRAINT os_version IF NOT EXISTS FOR (o:OsVersion) REQUIRE (o.name, o.build) IS UNIQUE",
-            "CREATE CONSTRAINT whitening_rule IF NOT EXISTS FOR (w:WhiteningRule) REQUIRE w.rule IS UNIQUE",
-            "CREATE CONSTRAINT scores_alert IF NOT EXISTS FOR (s:Scores) REQUIRE s.alert_id IS UNIQUE"
-        ]
-        
+        """
+        Apply SCHEMA_STATEMENTS (idempotent) and wait for the indexes to come online. Every statement
+        is attempted; if any of them (or the wait) failed, raises so the version is not recorded.
+        """
+        failures = []
         with self.driver.session(database=self.database) as session:
-            for query in constraints_queries:
+            for query in self.SCHEMA_STATEMENTS:
+                try:
+                    session.run(query).consume()
+                except Exception as e:
+                    print(f"⚠️ Schema statement failed ({query.split(' IF NOT EXISTS')[0]}): {e}")
+                    failures.append(query.split(" IF NOT EXISTS")[0])
+            if not failures:
                 try:
-                    session.run(query)
-                    print(f"✅ Created constraint: {query.split('FOR')[1].split('REQUIRE')[0].strip()}")
+                    session.run("CALL db.awaitIndexes(300)").consume()
                 except Exception as e:
-                    print(f"⚠️ Constraint already exists or failed: {e}")
+                    print(f"⚠️ Waiting for indexes failed: {e}")
+                    failures.append("CALL db.awaitIndexes")
+        if failures:
+            raise RuntimeError(f"{len(failures)} schema step(s) failed: {'; '.join(failures)}")
+
+    def ensure_schema(self) -> int:
+        """
+        Versioned schema bootstrap, run once at startup: applies SCHEMA_STATEMENTS unless the
+        (:SchemaVersion {name: 'alert_graph'}) node already records GRAPH_SCHEMA_VERSION or newer.
+        Returns the version in place.
+        """
+        with self.driver.session(database=self.database) as session:
+            record = session.run(
+                "MATCH (v:SchemaVersion {name: 'alert_graph'}) RETURN v.version AS version"
+            ).single()
+        current = record["version"] if record is not None else None
+        if current is not None and current >= self.GRAPH_SCHEMA_VERSION:
+            self.schema_version = current
+            print(f"✅ Graph schema up to date (version {current})")
+            return current
+
+        print(f"🔧 Applying graph schema version {self.GRAPH_SCHEMA_VERSION} (was {current})...")
+        self.create_constraints_and_indexes()
+        with self.driver.session(database=self.database) as session:
+            session.run(
+                "MERGE (v:SchemaVersion {name: 'alert_graph'}) SET v.version = $version, v.applied_at = datetime()",
+                version=self.GRAPH_SCHEMA_VERSION,
+            ).consume()
+        self.schema_version = self.GRAPH_SCHEMA_VERSION
+        print(f"✅ Graph schema version {self.GRAPH_SCHEMA_VERSION} applied")
+        return self.schema_version
+
+    def bootstrap_schema(self) -> bool:
+        """ensure_schema that records a failure in schema_error (reported by /health) instead of raising"""
+        self._schema_attempted_at = time.monotonic()
+        try:
+            self.ensure_schema()
+            self.schema_error = None
+            return True
+        except Exception as e:
+            self.schema_error = f"{type(e).__name__}: {e}"
+            print(f"⚠️ Graph schema bootstrap failed: {e}")
+            return False
+
+    def retry_schema(self):
+        """
+        Run before each ingest: while no schema version is recorded (e.g. Neo4j was down at startup),
+        retry the bootstrap at most once per GRAPH_SCHEMA_RETRY_SECONDS. Never raises; the ingest
+        itself reports a Neo4j outage.
+        """
+        if self.schema_version is not None or not GRAPH_SCHEMA_BOOTSTRAP:
+            return
+        if self._schema_attempted_at is not None \
+                and time.monotonic() - self._schema_attempted_at < GRAPH_SCHEMA_RETRY_SECONDS:
+            return
+        self.bootstrap_schema()
     
     def verify_ingestion(self):
         """Verify the ingestion by counting nodes and relationships"""
@@ -1786,6 +4461,14 @@ Example: TRUE_POSITIVE|85|Multiple AV detections with unsigned executable
 # Initialize graph manager
 graph_manager = Neo4jGraphManager(neo4j_driver) if neo4j_driver else None
 
+@app.on_event("startup")
+def bootstrap_graph_schema():
+    """Constraints and lookup indexes once per deployment instead of on every ingest"""
+    if graph_manager is None or not GRAPH_SCHEMA_BOOTSTRAP:
+        return
+    # On failure the first ingest after GRAPH_SCHEMA_RETRY_SECONDS tries again (see retry_schema)
+    graph_manager.bootstrap_schema()
+
 # Initialize threat analyzer only if we have the required components
 threat_analyzer = None
 if neo4j_driver and OPENAI_API_KEY:
@@ -1815,14 +4498,107 @@ async def create_alert_graph(file: UploadFile = File(...)):
             raise HTTPException(status_code=400, detail="Invalid JSON format.")
 
         # Create graph
-        result = graph_manager.create_alert_graph(alert_data)
+        result = await graph_manager.create_alert_graph_async(alert_data)
 
         return JSONResponse(content=result)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/create-graph/batch")
+async def create_alert_graph_batch(request: Request):
+    """
+    Bulk graph ingestion: NDJSON alerts (one per line, as a multipart `file` field or the raw body) are
+    written GRAPH_BATCH_CHUNK alerts per transaction while the upload is still being read. Streams one
+    NDJSON progress line per chunk (written / failed counts, throughput, per-alert errors) and a final
+    summary line. A failed chunk does not stop the following ones.
+    """
+    if not graph_manager:
+        raise HTTPException(status_code=500, detail="Neo4j connection not available.")
+
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        upload = (await request.form()).get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Multipart payload needs a 'file' field.")
+        chunks = _upload_chunks(upload)
+    else:
+        chunks = request.stream()
+
+    totals = {"alerts": 0, "written": 0, "failed": 0, "chunks": 0}
+    started = time.perf_counter()
+
+    async def write(alerts: List[Any]) -> Tuple[List[Optional[str]], float]:
+        start = time.perf_counter()
+        errors = await graph_manager.ingest_alert_chunk_async(alerts)
+        return errors, time.perf_counter() - start
+
+    def launch(records):
+        # Backpressure: the upload is not read further while the lanes have no room; after
+        # EXEC_RETRY_ATTEMPTS attempts render reports the chunk as failed
+        return asyncio.ensure_future(retry_overloaded(write, [record for record, error in records if error is None]))
+
+    async def render(number: int, first: int, records, task) -> str:
+        try:
+            chunk_errors, elapsed = await task
+        except HTTPException as e:
+            chunk_errors, elapsed = [e.detail] * len(records), 0.0
+        except Exception as e:
+            chunk_errors, elapsed = [str(e)] * len(records), 0.0
+        errors = iter(chunk_errors)
+        failures = []
+        for offset, (record, error) in enumerate(records):
+            if error is None:
+                error = next(errors)
+            if error is not None:
+                failures.append({"index": first + offset, "error": error})
+        written = len(records) - len(failures)
+        totals["chunks"] += 1
+        totals["alerts"] += len(records)
+        totals["written"] += written
+        totals["failed"] += len(failures)
+        line = {
+            "chunk": number,
+            "first_index": first,
+            "alerts": len(records),
+            "written": written,
+            "failed": len(failures),
+            "elapsed_ms": round(elapsed * 1000, 3),
+            "alerts_per_sec": round(written / elapsed, 1) if elapsed > 0 else None,
+            "errors": failures,
+        }
+        return json.dumps(line, default=str) + "\n"
+
+    async def generate():
+        number, index, records, inflight = 0, 0, [], None
+        try:
+            async for record in _ndjson_records(chunks, PREDICT_STREAM_MAX_LINE):
+                records.append(record)
+                if len(records) < GRAPH_BATCH_CHUNK:
+                    continue
+                # Write this chunk while the next one is read
+                if inflight is not None:
+                    yield await render(*inflight)
+                inflight = (number, index, records, launch(records))
+                number, index, records = number + 1, index + len(records), []
+            if inflight is not None:
+                yield await render(*inflight)
+                inflight = None
+            if records:
+                yield await render(number, index, records, launch(records))
+        finally:
+            if inflight is not None:
+                inflight[3].cancel()
+        elapsed = time.perf_counter() - started
+        summary = dict(totals, elapsed_ms=round(elapsed * 1000, 3),
+                       alerts_per_sec=round(totals["written"] / elapsed, 1) if elapsed > 0 else None)
+        yield json.dumps({"summary": summary}) + "\n"
+
+    return BodyStreamingResponse(generate(), media_type="application/x-ndjson")
+
+
 @app.post("/analyze-from-graph/{alert_id}")
 async def analyze_alert_from_graph(alert_id: str):
     """
@@ -1836,10 +4612,12 @@ async def analyze_alert_from_graph(alert_id: str):
             )
         
         # Run dynamic analysis
-        result = threat_analyzer.analyze_alert_from_graph(alert_id)
+        result = await offload("io", threat_analyzer.analyze_alert_from_graph, alert_id)
         
         return JSONResponse(content=result)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -2618,19 +5396,24 @@ async def investigate_alert_agentic(alert_id: str):
                 detail="OpenAI API key not configured"
             )
         
-        # Create simplified investigator instance
-        investigator = AgenticGraphRAG(
-            neo4j_url=NEO4J_URI,
-            neo4j_username=NEO4J_USERNAME,
-            neo4j_password=NEO4J_PASSWORD,
-            openai_api_key=OPENAI_API_KEY
-        )
+        def investigate():
+            # Create simplified investigator instance
+            investigator = AgenticGraphRAG(
+                neo4j_url=NEO4J_URI,
+                neo4j_username=NEO4J_USERNAME,
+                neo4j_password=NEO4J_PASSWORD,
+                openai_api_key=OPENAI_API_KEY
+            )
+            
+            # Run autonomous investigation
+            return investigator.investigate_alert(alert_id)
         
-        # Run autonomous investigation
-        result = investigator.investigate_alert(alert_id)
+        result = await offload("io", investigate)
         
         return JSONResponse(content=result)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -2640,14 +5423,16 @@ async def investigate_alert_interactive(alert_id: str, question: str):
     Interactive investigation - ask specific questions about an alert
     """
     try:
-        investigator = AgenticGraphRAG(
-            neo4j_url=NEO4J_URI,
-            neo4j_username=NEO4J_USERNAME,
-            neo4j_password=NEO4J_PASSWORD,
-            openai_api_key=OPENAI_API_KEY
-        )
+        def ask():
+            investigator = AgenticGraphRAG(
+                neo4j_url=NEO4J_URI,
+                neo4j_username=NEO4J_USERNAME,
+                neo4j_password=NEO4J_PASSWORD,
+                openai_api_key=OPENAI_API_KEY
+            )
+            return investigator.interactive_investigation(alert_id, question)
         
-        response = investigator.interactive_investigation(alert_id, question)
+        response = await offload("io", ask)
         
         return JSONResponse(content={
             "alert_id": alert_id,
@@ -2656,6 +5441,8 @@ async def investigate_alert_interactive(alert_id: str, question: str):
             "timestamp": datetime.now().isoformat()
         })
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -2697,6 +5484,22 @@ class Subgraph:
     edges_by_rel: Dict[str, Tuple[torch.Tensor, torch.Tensor]]
     target_idx: int
 
+KHOP_SUBGRAPH_QUERY = """
+MATCH (a:Alert {alert_id:$id})
+OPTIONAL MATCH p=(a)-[*..$K]-(n)
+WITH a, collect(p) AS paths
+WITH a,
+     reduce(ns=[], p IN paths | ns + nodes(p)) AS ns,
+     reduce(rs=[], p IN paths | rs + relationships(p)) AS rs
+UNWIND ns AS n
+WITH collect(DISTINCT {id: elementId(n), labels: labels(n), props: properties(n)}) AS nodes, rs
+UNWIND rs AS r
+WITH nodes, collect(DISTINCT {
+  type: type(r), start: elementId(startNode(r)), end: elementId(endNode(r))
+}) AS rels
+RETURN nodes, rels
+"""
+
 def fetch_khop_alert_subgraph(alert_id: str, max_hops: int = 5, dim: int = 512) -> Optional[Subgraph]:
     """
     Build ego graph up to `max_hops` around (Alert {alert_id: ...}) using your existing neo4j_driver.
@@ -2706,27 +5509,13 @@ def fetch_khop_alert_subgraph(alert_id: str, max_hops: int = 5, dim: int = 512)
         return None
     try:
         with neo4j_driver.session(database=NEO4J_DATABASE or "neo4j") as s:
-            rec = s.run(
-                """
-                MATCH (a:Alert {alert_id:$id})
-                OPTIONAL MATCH p=(a)-[*..$K]-(n)
-                WITH a, collect(p) AS paths
-                WITH a,
-                     reduce(ns=[], p IN paths | ns + nodes(p)) AS ns,
-                     reduce(rs=[], p IN paths | rs + relationships(p)) AS rs
-                UNWIND ns AS n
-                WITH collect(DISTINCT {id: elementId(n), labels: labels(n), props: properties(n)}) AS nodes, rs
-                UNWIND rs AS r
-                WITH nodes, collect(DISTINCT {
-                  type: type(r), start: elementId(startNode(r)), end: elementId(endNode(r))
-                }) AS rels
-                RETURN nodes, rels
-                """,
-                id=alert_id, K=max_hops
-            ).single()
+            rec = s.run(KHOP_SUBGRAPH_QUERY, id=alert_id, K=max_hops).single()
     except Exception:
         return None
+    return khop_subgraph(rec, alert_id)
 
+def khop_subgraph(rec, alert_id: str) -> Optional[Subgraph]:
+    """Subgraph tensors from a KHOP_SUBGRAPH_QUERY record (None when the alert was not found)"""
     if not rec:
         return None
     nodes = rec.get("nodes") or []
@@ -2810,37 +5599,96 @@ class RGCN_NoDGL(nn.Module):
         h = self.l2(h, edges_by_rel)
         return self.head(h)
 
-def _load_gnn_model(ckpt_path: str):
+def _build_gnn_model(ckpt_path: str):
     """
-    Load and cache the R-GCN model checkpoint.
+    Load an R-GCN model checkpoint (uncached; the model registry loads new versions with this).
     Expects a torch checkpoint with keys: 'config' (dict) and 'state_dict'.
     config must contain: in_dim, hidden, out_dim, rel_names, (optional) dropout/hops.
     """
-    if ckpt_path in _GNN_CACHE:
-        return _GNN_CACHE[ckpt_path]
     ckpt = torch.load(ckpt_path, map_location="cpu")
     cfg = ckpt["config"]
     rel_names = cfg["rel_names"]
     model = RGCN_NoDGL(cfg["in_dim"], cfg["hidden"], cfg["out_dim"], rel_names, cfg.get("dropout", 0.1))
     model.load_state_dict(ckpt["state_dict"])
     model.eval()
-    _GNN_CACHE[ckpt_path] = (model, cfg, rel_names)
     return model, cfg, rel_names
+
+def _load_gnn_model(ckpt_path: str):
+    """Load and cache the R-GCN model checkpoint"""
+    if ckpt_path in _GNN_CACHE:
+        return _GNN_CACHE[ckpt_path]
+    _GNN_CACHE[ckpt_path] = _build_gnn_model(ckpt_path)
+    return _GNN_CACHE[ckpt_path]
+def gnn_fetch_subgraph(alert_id: str, cfg: dict) -> Optional[Subgraph]:
+    """k-hop ego graph of the alert from Neo4j (blocking I/O); None when unavailable"""
+    try:
+        return fetch_khop_alert_subgraph(alert_id, max_hops=cfg.get('hops', DEFAULT_GNN_HOPS), dim=cfg['in_dim'])
+    except Exception:
+        return None
+
+async def gnn_fetch_subgraph_async(alert_id: str, cfg: dict) -> Optional[Subgraph]:
+    """gnn_fetch_subgraph awaited on graph_dal (tensors built on the "cpu" lane), else on the "io" lane"""
+    if not graph_dal.ready:
+        return await offload("io", gnn_fetch_subgraph, alert_id, cfg)
+    try:
+        rec = await graph_dal.khop_record(alert_id, cfg.get('hops', DEFAULT_GNN_HOPS))
+    except Exception:
+        return None
+    try:
+        return await offload("cpu", khop_subgraph, rec, alert_id)
+    except ExecutorOverloaded:
+        raise
+    except Exception:
+        return None
+
+def gnn_infer(model, cfg: dict, rel_names: List[str], sg: Optional[Subgraph], payload: dict) -> Tuple[np.ndarray, str]:
+    """
+    Score one alert with a loaded R-GCN: its ego graph `sg` (see gnn_fetch_subgraph) when
+    that has relations, otherwise the alert alone ("selfie" on the provided JSON).
+    Returns (probabilities over LABELS, mode).
+    """
+    def no_edges():
+        return (torch.empty(0, dtype=torch.long), torch.empty(0, dtype=torch.long))
+
+    has_edge = sg is not None and any(sg.edges_by_rel.get(r, no_edges())[0].numel() > 0 for r in rel_names)
+    if has_edge:
+        mode = "ego"
+        edges_aligned = {r: sg.edges_by_rel.get(r, no_edges()) for r in rel_names}
+        with torch.no_grad():
+            logits = model(sg.features, edges_aligned)[sg.target_idx].detach().cpu().numpy()
+    else:
+        mode = "selfie"
+        enc = GenericFeatureEncoder(dim=cfg['in_dim'])
+        x = torch.tensor([enc.encode(["Alert"], _flatten_json(payload))], dtype=torch.float32)
+        with torch.no_grad():
+            logits = model(x, {r: no_edges() for r in rel_names})[0].detach().cpu().numpy()
+
+    prob = np.exp(logits - logits.max())
+    return prob / prob.sum(), mode
+
+async def gnn_score(loaded, alert_id: str, payload: dict) -> Tuple[np.ndarray, str]:
+    """
+    Score one alert with a loaded (model, cfg, rel_names): ego graph on the "io" lane, inference
+    on the "cpu" lane. Shadow-scores the registry's GNN candidate when sampled.
+    """
+    model, cfg, rel_names = loaded
+    sg = await gnn_fetch_subgraph_async(alert_id, cfg)
+    start = time.perf_counter()
+    prob, mode = await offload("cpu", gnn_infer, model, cfg, rel_names, sg, payload)
+
+    def shadow(candidate):
+        cand_model, cand_cfg, cand_rels = candidate
+        graph = sg
+        if (cand_cfg["in_dim"], cand_cfg.get("hops")) != (cfg["in_dim"], cfg.get("hops")):
+            graph = gnn_fetch_subgraph(alert_id, cand_cfg)
+        return [LABELS[int(gnn_infer(cand_model, cand_cfg, cand_rels, graph, payload)[0].argmax())]]
+
+    schedule_shadow("gnn", shadow, [LABELS[int(prob.argmax())]], (time.perf_counter() - start) * 1000)
+    return prob, mode
 # ==== /GNN core ===============================================================
 
 def _flatten_json(obj, parent_key=""):
-    flat = {}
-    if isinstance(obj, dict):
-        for k, v in obj.items():
-            nk = f"{parent_key}.{k}" if parent_key else k
-            flat.update(_flatten_json(v, nk))
-    elif isinstance(obj, list):
-        for i, v in enumerate(obj[:50]):
-            nk = f"{parent_key}[{i}]"
-            flat.update(_flatten_json(v, nk))
-    else:
-        flat[parent_key] = obj
-    return flat
+    return flatten_projected(obj, parent_key, max_list=50)
 
 def _extract_uid_from_json(payload: dict) -> str:
     candidates = ["uid", "alert_id", "alertId", "threatId", "threat_id", "id"]
@@ -2878,53 +5726,17 @@ async def gnn_predict_json(
 
     # 2) Load model (defaults)
     try:
-        model, cfg, rel_names = _load_gnn_model(DEFAULT_GNN_CKPT)
+        loaded = await offload("cpu", model_registry.gnn)
+    except HTTPException:
+        raise
     except FileNotFoundError:
-        raise HTTPException(status_code=404, detail=f"Checkpoint not found: {DEFAULT_GNN_CKPT}")
+        raise HTTPException(status_code=404, detail=f"Checkpoint not found: {model_registry.active('gnn').source}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to load checkpoint: {e}")
 
     # 3) Try ego; fallback to selfie if no edges
-    try:
-        sg = fetch_khop_alert_subgraph(alert_id, max_hops=cfg.get('hops', DEFAULT_GNN_HOPS), dim=cfg['in_dim'])
-    except Exception:
-        sg = None
-
-    def empty_edges(names):
-        return {r: (torch.empty(0, dtype=torch.long), torch.empty(0, dtype=torch.long)) for r in names}
-
-    mode = "ego"
-    if sg is None:
-        # selfie mode
-        mode = "selfie"
-        enc = GenericFeatureEncoder(dim=cfg['in_dim'])
-        x = torch.tensor([enc.encode(["Alert"], _flatten_json(payload))], dtype=torch.float32)
-        with torch.no_grad():
-            logits = model(x, empty_edges(rel_names))[0].detach().cpu().numpy()
-    else:
-        # check for any relations in ego graph
-        has_edge = any(
-            sg.edges_by_rel.get(r, (torch.empty(0, dtype=torch.long), torch.empty(0, dtype=torch.long)))[0].numel() > 0
-            for r in rel_names
-        )
-        if not has_edge:
-            # selfie fallback
-            mode = "selfie"
-            enc = GenericFeatureEncoder(dim=cfg['in_dim'])
-            x = torch.tensor([enc.encode(["Alert"], _flatten_json(payload))], dtype=torch.float32)
-            with torch.no_grad():
-                logits = model(x, empty_edges(rel_names))[0].detach().cpu().numpy()
-        else:
-            # ego graph inference
-            edges_aligned = {
-                r: sg.edges_by_rel.get(r, (torch.empty(0, dtype=torch.long), torch.empty(0, dtype=torch.long)))
-                for r in rel_names
-            }
-            with torch.no_grad():
-                logits = model(sg.features, edges_aligned)[sg.target_idx].detach().cpu().numpy()
-
-    prob = np.exp(logits - logits.max()); prob = prob / prob.sum()
-    labels = ["False Positive", "Escalate", "True Positive"]
+    prob, mode = await gnn_score(loaded, alert_id, payload)
+    labels = LABELS
     top = int(prob.argmax())
     return {
         "alert_id": alert_id,
@@ -2934,6 +5746,134 @@ async def gnn_predict_json(
         "mode": mode
     }
 
+# ----------------- Scoring cascade -----------------
+CLASSIFIER_VERDICTS = {
+    'true_positive': 'True Positive',
+    'false_positive': 'False Positive',
+    'undefined': 'Escalate',
+    'escalate': 'Escalate'
+}
+
+class CascadeAgent:
+    """
+    Early-exit scoring: the rule-based triage score runs first, the XGBoost classifier
+    only when that score is inside the uncertainty band, and the Neo4j-backed GNN only
+    when the classifier is not confident enough. A stage that fails leaves the previous
+    stage's verdict in place.
+    """
+
+    def __init__(self, band_low: float = 0, band_high: float = 100, xgb_confidence: float = 0.8):
+        self.band_low = band_low
+        self.band_high = band_high
+        self.xgb_confidence = xgb_confidence
+
+    def needs_classifier(self, triage_score: float) -> bool:
+        return self.band_low < triage_score < self.band_high
+
+    @staticmethod
+    def classifier_features(alert_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Only the classifier's feature paths, from a nested or already-flat alert"""
+        return flatten_projected(alert_data, paths=model_registry.classifier().feature_names)
+
+    async def run_classifier(self, alert_data: Dict[str, Any]) -> Dict[str, Any]:
+        if not model_registry.classifier().loaded:
+            await offload("io", model_registry.classifier().ensure_loaded)
+        prediction = (await predict_one(self.classifier_features(alert_data), "none"))["prediction"]
+        label = prediction["predicted_verdict"]
+        return {
+            "verdict": CLASSIFIER_VERDICTS.get(str(label).lower(), label),
+            "confidence": prediction["confidence"],
+            "probabilities": prediction["probabilities"],
+        }
+
+    @staticmethod
+    async def run_gnn(alert_data: Dict[str, Any]) -> Dict[str, Any]:
+        alert_id = _extract_uid_from_json(alert_data)
+        if not alert_id:
+            raise ValueError("Could not find alert id in JSON.")
+        loaded = await offload("cpu", model_registry.gnn)
+        prob, mode = await gnn_score(loaded, alert_id, alert_data)
+        top = int(prob.argmax())
+        return {
+            "verdict": LABELS[top],
+            "confidence": float(prob[top]),
+            "probabilities": {LABELS[i]: float(prob[i]) for i in range(len(LABELS))},
+            "mode": mode,
+        }
+
+    @staticmethod
+    async def _stage(fn, alert_data) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            result = await fn(alert_data)
+        except HTTPException as e:
+            # e.g. ExecutorOverloaded: degrade to the previous stage's verdict
+            result = {"error": e.detail}
+        except Exception as e:
+            result = {"error": str(e)}
+        result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return result
+
+    async def run(self, alert_data: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        triage = await triage_executor.analyze_alert(alert_data)
+        if "error" in triage:
+            raise ValueError(triage["error"])
+        triage_score = triage["prediction"]["risk_score"]
+        stages = {"triage": {
+            "verdict": triage["prediction"]["predicted_verdict"],
+            "risk_score": triage_score,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+        }}
+        decided_by = "triage"
+
+        if self.needs_classifier(triage_score):
+            stages["classifier"] = await self._stage(self.run_classifier, alert_data)
+            confident = False
+            if "error" not in stages["classifier"]:
+                decided_by = "classifier"
+                confident = stages["classifier"]["confidence"] >= self.xgb_confidence
+            if not confident:
+                stages["gnn"] = await self._stage(self.run_gnn, alert_data)
+                if "error" not in stages["gnn"]:
+                    decided_by = "gnn"
+
+        return {
+            "alert_id": _extract_uid_from_json(alert_data) or None,
+            "verdict": stages[decided_by]["verdict"],
+            "decided_by": decided_by,
+            "stages_run": list(stages),
+            "stages": stages,
+            "cascade": {"band": [self.band_low, self.band_high], "xgb_confidence": self.xgb_confidence},
+            "timestamp": datetime.utcnow().isoformat()
+        }
+
+cascade_agent = CascadeAgent(CASCADE_BAND_LOW, CASCADE_BAND_HIGH, CASCADE_XGB_CONFIDENCE)
+
+@app.post("/triage/cascade")
+async def triage_cascade(request: Request, file: UploadFile = File(None)):
+    """
+    Score an alert through the triage -> XGBoost -> GNN cascade, stopping at the first
+    decisive stage. Accepts a JSON file or raw JSON body; `decided_by` names the stage
+    whose verdict is returned and `stages` holds every stage that ran.
+    """
+    content = await file.read() if file is not None else await request.body()
+    try:
+        payload = json.loads(content.decode("utf-8"))
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid JSON format.")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Provide a JSON alert object as a file or JSON body.")
+    try:
+        return JSONResponse(content=await cascade_agent.run(payload))
+    except HTTPException:
+        # ExecutorOverloaded keeps its 503 + Retry-After
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Add this to your existing FastAPI app
 
 import asyncio
@@ -2969,7 +5909,7 @@ class SupervisorAgent:
         """Run EDR agent using the classifier directly (no HTTP request)"""
         try:
             # Use the classifier directly instead of HTTP request
-            result = classifier.predict(edr_data)
+            result = await predict_one(edr_data) if isinstance(edr_data, dict) else await predict_many(edr_data)
             
             # Extract confidence score and convert to 0-100 scale
             confidence = result.get('prediction', {}).get('confidence', 0) * 100
@@ -3016,55 +5956,15 @@ class SupervisorAgent:
             
             # Load GNN model (use existing cached version if available)
             try:
-                model, cfg, rel_names = _load_gnn_model(DEFAULT_GNN_CKPT)
+                loaded = await offload("cpu", model_registry.gnn)
             except FileNotFoundError:
-                return self._error_response("GNN", f"GNN model not found: {DEFAULT_GNN_CKPT}")
+                return self._error_response("GNN", f"GNN model not found: {model_registry.active('gnn').source}")
             except Exception as e:
                 return self._error_response("GNN", f"Failed to load GNN model: {str(e)}")
             
             # Try ego graph first, fallback to selfie if needed
-            try:
-                sg = fetch_khop_alert_subgraph(alert_id, max_hops=cfg.get('hops', DEFAULT_GNN_HOPS), dim=cfg['in_dim'])
-            except Exception:
-                sg = None
-
-            def empty_edges(names):
-                return {r: (torch.empty(0, dtype=torch.long), torch.empty(0, dtype=torch.long)) for r in names}
-
-            mode = "ego"
-            if sg is None:
-                # selfie mode
-                mode = "selfie"
-                enc = GenericFeatureEncoder(dim=cfg['in_dim'])
-                x = torch.tensor([enc.encode(["Alert"], _flatten_json(gnn_data))], dtype=torch.float32)
-                with torch.no_grad():
-                    logits = model(x, empty_edges(rel_names))[0].detach().cpu().numpy()
-            else:
-                # check for any relations in ego graph
-                has_edge = any(
-                    sg.edges_by_rel.get(r, (torch.empty(0, dtype=torch.long), torch.empty(0, dtype=torch.long)))[0].numel() > 0
-                    for r in rel_names
-                )
-                if not has_edge:
-                    # selfie fallback
-                    mode = "selfie"
-                    enc = GenericFeatureEncoder(dim=cfg['in_dim'])
-                    x = torch.tensor([enc.encode(["Alert"], _flatten_json(gnn_data))], dtype=torch.float32)
-                    with torch.no_grad():
-                        logits = model(x, empty_edges(rel_names))[0].detach().cpu().numpy()
-                else:
-                    # ego graph inference
-                    edges_aligned = {
-                        r: sg.edges_by_rel.get(r, (torch.empty(0, dtype=torch.long), torch.empty(0, dtype=torch.long)))
-                        for r in rel_names
-                    }
-                    with torch.no_grad():
-                        logits = model(sg.features, edges_aligned)[sg.target_idx].detach().cpu().numpy()
-
-            import numpy as np
-            prob = np.exp(logits - logits.max())
-            prob = prob / prob.sum()
-            labels = ["False Positive", "Escalate", "True Positive"]
+            prob, mode = await gnn_score(loaded, alert_id, gnn_data)
+            labels = LABELS
             top = int(prob.argmax())
             score = float(prob[top] * 100.0)
             verdict = labels[top]
@@ -3366,6 +6266,8 @@ async def run_supervisor_agent(
         
         return JSONResponse(content=result)
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Supervisor Agent Error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Supervisor agent failed: {str(e)}")
@@ -3375,6 +6277,9 @@ def shutdown_event():
     """Cleanup on shutdown"""
     if neo4j_driver:
         neo4j_driver.close()
+    triage_executor.shutdown()
+    for lane in EXECUTION_LANES.values():
+        lane.shutdown()
 
 @app.get("/health")
 async def health_check():
@@ -3382,8 +6287,11 @@ async def health_check():
     neo4j_status = False
     if neo4j_driver:
         try:
-            neo4j_driver.verify_connectivity()
+            await offload("io", neo4j_driver.verify_connectivity)
             neo4j_status = True
+        except ExecutorOverloaded:
+            # Busy, not down: don't fail the health check under load
+            neo4j_status = None
         except Exception:
             neo4j_status = False
     
@@ -3392,7 +6300,15 @@ async def health_check():
         "neo4j_connected": neo4j_status,
         "openai_configured": OPENAI_API_KEY is not None,
         "graph_manager_ready": graph_manager is not None,
+        "neo4j_async": graph_dal.ready,
+        "graph_schema_version": graph_manager.schema_version if graph_manager is not None else None,
+        "graph_schema_error": graph_manager.schema_error if graph_manager is not None else None,
+        "graph_entity_cache": graph_manager.entity_cache.stats() if graph_manager is not None else None,
         "threat_analyzer_ready": threat_analyzer is not None,
+        "triage_executor": triage_executor.stats(),
+        "execution_lanes": {name: lane.stats() for name, lane in EXECUTION_LANES.items()},
+        "predict_batcher": predict_batcher.stats(),
+        "classifier": model_registry.classifier().stats(),
         "timestamp": datetime.now().isoformat()
     }
 
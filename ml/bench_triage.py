@@ -0,0 +1,298 @@
+"""
+Triage performance benchmarks.
+
+    python bench_triage.py flatten [--enrichments 50] [--iterations 200]
+    python bench_triage.py suite [--alerts 500] [--batch-size 64] [--output results.json]
+    python bench_triage.py compare baseline.json current.json [--threshold 0.10]
+
+flatten  compares the iterative/path-projected flattener in app_final against the
+         previous recursive implementation on large synthetic OCSF alerts.
+suite    generates alerts of varied size (0-50 enrichments, long command lines,
+         Unicode paths) and measures flatten, agent1, agent2 and end-to-end
+         triage (single and batch) as alerts/sec plus p50/p99 latency. Results are
+         written as JSON tagged with the git commit so runs can be compared.
+compare  diffs two suite results and exits non-zero when throughput dropped by
+         more than --threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+# app_final loads its artifacts relative to the ml/ folder
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.getcwd())
+
+import app_final  # noqa: E402
+
+PROCESS_NAMES = ["powershell.exe", "cmd.exe", "explorer.exe", "svchost.exe", "rundll32.exe",
+                 "chrome.exe", "python.exe", "OUTLOOK.EXE", "wmic.exe", "notepad.exe"]
+PATHS = [
+    "C:\\Users\\Public\\Downloads\\payload.exe",
+    "C:\\Windows\\System32\\svchost.exe",
+    "C:\\Program Files\\Vendor\\agent.exe",
+    "C:\\Users\\jürgen\\AppData\\Roaming\\更新\\update.exe",
+    "D:\\Проекты\\отчёт\\макрос.exe",
+    "C:\\$Recycle.Bin\\S-1-5-21\\x.scr",
+    "/usr/local/bin/サービス",
+]
+ARG_SNIPPETS = ["-enc ", "IEX (Invoke-Expression ", "FromBase64String(", "curl http://198.51.100.7/x ",
+                "/c start ", "--headless --disable-gpu ", "-NoProfile -WindowStyle Hidden "]
+USERS = ["SYSTEM", "Administrator", "root", "analyst", "josé.garcía", "svc_backup", ""]
+CONFIDENCES = ["malicious", "suspicious", "n/a", "MALICIOUS", ""]
+DEVICE_TYPES = ["server", "laptop", "desktop", "vm"]
+ENGINE_NAMES = ["SentinelOne Cloud", "On-Write Static AI", "User", "Behavioral", "Other"]
+
+
+def recursive_flatten(raw, parent_key=""):
+    """The recursive flattener app_final used before flatten_projected (reference baseline)"""
+    flat = {}
+    if isinstance(raw, dict):
+        for k, v in raw.items():
+            nk = f"{parent_key}.{k}" if parent_key else k
+            flat.update(recursive_flatten(v, nk))
+    elif isinstance(raw, list):
+        for i, v in enumerate(raw):
+            flat.update(recursive_flatten(v, f"{parent_key}[{i}]"))
+    else:
+        flat[parent_key] = raw
+    return flat
+
+
+def make_alert(rng: random.Random, enrichments: int) -> dict:
+    """Synthetic OCSF EDR alert; each enrichment carries a VirusTotal-style per-engine report"""
+    engines = [f"Engine{i:02d}" for i in range(70)]
+    return {
+        "alert": {"id": f"alert-{rng.randrange(10 ** 9)}"},
+        "severity_id": rng.randrange(0, 6),
+        "time": "2025-08-24T00:00:00Z",
+        "threat": {"id": f"th-{rng.randrange(10 ** 9)}", "confidence": rng.choice(["malicious", "suspicious", "n/a"]),
+                   "detection": {"type": "static"}},
+        "file": {"path": "C:\\Users\\Public\\Downloads\\payload.exe", "verification": {"type": "notsigned"},
+                 "signature": {"certificate": {"status": False}}, "hashes": {"sha256": f"{rng.getrandbits(256):064x}"}},
+        "process": {"name": "powershell.exe", "cmd": {"args": "-enc " + "A" * rng.randrange(100, 4000)}},
+        "device": {"type": "server", "uuid": "dev-1"},
+        "actor": {"process": {"user": {"name": "SYSTEM"}}},
+        "metadata": {"product": {"feature": {"name": "SentinelOne Cloud"}, "name": ["SentinelOne Cloud"]}},
+        "enrichments": [
+            {
+                "provider": "VirusTotal",
+                "data": {
+                    "positives": rng.randrange(0, 40), "total": 70,
+                    "malicious": rng.randrange(0, 30), "suspicious": rng.randrange(0, 5),
+                    "scan_time": "2025-08-01T00:00:00Z",
+                    "stats": {"malicious": rng.randrange(0, 30), "harmless": rng.randrange(0, 10)},
+                    "scans": {e: {"detected": rng.random() < 0.3, "version": "1.0", "result": None} for e in engines},
+                },
+            }
+            for _ in range(enrichments)
+        ],
+    }
+
+
+def make_varied_alert(rng: random.Random, max_enrichments: int = 50) -> dict:
+    """make_alert with randomised size and content: 0..max_enrichments enrichments, long/Unicode fields, gaps"""
+    alert = make_alert(rng, rng.randint(0, max_enrichments))
+    alert["severity_id"] = rng.choice([0, 1, 2, 3, 4, 5, "3"])
+    alert["threat"]["confidence"] = rng.choice(CONFIDENCES)
+    alert["file"]["path"] = rng.choice(PATHS)
+    alert["file"]["verification"]["type"] = rng.choice(["notsigned", "signed", "unknown"])
+    alert["file"]["signature"]["certificate"]["status"] = rng.choice([True, False])
+    # A small hash pool so some alerts share a file, as they do in production
+    alert["file"]["hashes"]["sha256"] = f"{rng.randrange(rng.choice([50, 10 ** 9])):064x}"
+    alert["process"]["name"] = rng.choice(PROCESS_NAMES)
+    filler = rng.choice(["A", "x", "é", "Ж"]) * rng.choice([0, 64, 1024, 16384])
+    alert["process"]["cmd"]["args"] = rng.choice(ARG_SNIPPETS) + filler
+    alert["device"]["type"] = rng.choice(DEVICE_TYPES)
+    alert["actor"]["process"]["user"]["name"] = rng.choice(USERS)
+    alert["metadata"]["product"]["feature"]["name"] = rng.choice(ENGINE_NAMES)
+    for enrichment in alert["enrichments"]:
+        data = enrichment["data"]
+        data["scan_time"] = rng.choice(["2025-08-01T00:00:00Z", "2024-01-15T12:00:00Z", "2026-09-30T08:30:00Z"])
+        if rng.random() < 0.3:
+            data["stats"].update(suspicious=rng.randrange(0, 5), undetected=rng.randrange(0, 60),
+                                 timeout=rng.randrange(0, 3), failure=rng.randrange(0, 3))
+    if rng.random() < 0.1:
+        del alert["file"]["verification"]
+    return alert
+
+
+def timed(fn, alerts, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(alerts[i % len(alerts)])
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def bench_flatten(args):
+    rng = random.Random(args.seed)
+    alerts = [make_alert(rng, args.enrichments) for _ in range(16)]
+    paths = app_final.ScoringTool.rules().paths
+    rows = [
+        ("recursive (previous)", lambda a: recursive_flatten(a)),
+        ("iterative full", lambda a: app_final.flatten_projected(a)),
+        ("iterative projected", lambda a: app_final.flatten_projected(a, paths=paths)),
+    ]
+    print(f"alerts with {args.enrichments} enrichments, {len(recursive_flatten(alerts[0]))} flattened keys")
+    for name, fn in rows:
+        print(f"  {name:<22} {timed(fn, alerts, args.iterations):10.1f} us/alert")
+
+
+def latency_stats(samples_s, alerts_per_sample=1):
+    """alerts/sec plus p50/p99/max latency (ms) for a list of per-call durations"""
+    samples = np.asarray(samples_s, dtype=np.float64)
+    total = samples.sum()
+    return {
+        "calls": int(samples.size),
+        "alerts_per_sec": round(samples.size * alerts_per_sample / total, 1) if total > 0 else None,
+        "p50_ms": round(float(np.percentile(samples, 50)) * 1000, 4),
+        "p99_ms": round(float(np.percentile(samples, 99)) * 1000, 4),
+        "max_ms": round(float(samples.max()) * 1000, 4),
+    }
+
+
+def measure(fn, inputs, rounds):
+    samples = []
+    for _ in range(rounds):
+        for item in inputs:
+            start = time.perf_counter()
+            fn(item)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def set_caches(enabled: bool):
+    """Enable/disable the triage result and VT score caches (sizes restored from app_final settings)"""
+    agent = app_final.triage_agent
+    agent.result_cache.clear()
+    agent.result_cache.maxsize = app_final.TRIAGE_CACHE_SIZE if enabled else 0
+    vt_cache = app_final.ScoringTool.rules().vt_cache
+    vt_cache.clear()
+    vt_cache.maxsize = app_final.TRIAGE_VT_CACHE_SIZE if enabled else 0
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_suite(args):
+    rng = random.Random(args.seed)
+    alerts = [make_varied_alert(rng, args.max_enrichments) for _ in range(args.alerts)]
+    tool = app_final.ScoringTool
+    agent = app_final.triage_agent
+    rules = tool.rules()
+    paths = rules.paths
+
+    flats = [tool.flatten_alert(a, paths=paths) for a in alerts]
+    extracted = [rules.extract(flat) for flat in flats]
+    vt_values = [rules.vt_values(buckets) for _, buckets in extracted]
+    enrichment_counts = [len(a["enrichments"]) for a in alerts]
+
+    results = {}
+    set_caches(False)
+    results["flatten"] = latency_stats(measure(lambda a: tool.flatten_alert(a, paths=paths), alerts, args.rounds))
+    results["agent1"] = latency_stats(measure(lambda fields: rules._apply(rules.agent1, fields), [f for f, _ in extracted], args.rounds))
+    results["agent2"] = latency_stats(measure(
+        lambda buckets: rules._apply(rules.agent2, rules.vt_values(buckets)), [b for _, b in extracted], args.rounds))
+    results["agent2_rules_only"] = latency_stats(measure(lambda v: rules._apply(rules.agent2, v), vt_values, args.rounds))
+    results["end_to_end_single"] = latency_stats(measure(agent.analyze_alert, alerts, args.rounds))
+
+    batches = [alerts[i:i + args.batch_size] for i in range(0, len(alerts), args.batch_size)]
+    batch_samples = measure(agent.analyze_batch, batches, args.rounds)
+    results["end_to_end_batch"] = latency_stats(batch_samples)
+    results["end_to_end_batch"]["alerts_per_sec"] = round(len(alerts) * args.rounds / sum(batch_samples), 1)
+    results["end_to_end_batch"]["batch_size"] = args.batch_size
+
+    # Warm caches: first pass fills them, the measured pass is served from them
+    set_caches(True)
+    for alert in alerts:
+        agent.analyze_alert(alert)
+    results["end_to_end_single_cached"] = latency_stats(measure(agent.analyze_alert, alerts, args.rounds))
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "alerts": args.alerts, "rounds": args.rounds, "batch_size": args.batch_size,
+            "max_enrichments": args.max_enrichments, "seed": args.seed,
+            "mean_enrichments": round(float(np.mean(enrichment_counts)), 2),
+            "mean_cmd_chars": round(float(np.mean([len(a["process"]["cmd"]["args"]) for a in alerts])), 1),
+        },
+        "results": results,
+    }
+
+    print(f"{'stage':<26}{'alerts/s':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, row in results.items():
+        print(f"{name:<26}{row['alerts_per_sec']:>12}{row['p50_ms']:>10.3f}{row['p99_ms']:>10.3f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"results written to {args.output}")
+    return report
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        base = json.load(f)
+    with open(args.current) as f:
+        cur = json.load(f)
+    print(f"baseline {base.get('commit')}  ->  current {cur.get('commit')}")
+    regressions = []
+    for name, row in cur["results"].items():
+        before = base["results"].get(name)
+        if not before or not before.get("alerts_per_sec") or not row.get("alerts_per_sec"):
+            continue
+        change = row["alerts_per_sec"] / before["alerts_per_sec"] - 1
+        flag = ""
+        if change < -args.threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"  {name:<26}{before['alerts_per_sec']:>12}{row['alerts_per_sec']:>12}{change:>+9.1%}"
+              f"   p99 {before['p99_ms']:.3f} -> {row['p99_ms']:.3f} ms{flag}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("flatten", help="flatten_alert: recursive vs iterative vs projected")
+    p.add_argument("--enrichments", type=int, default=50)
+    p.add_argument("--iterations", type=int, default=200)
+    p.add_argument("--seed", type=int, default=7)
+    p.set_defaults(func=bench_flatten)
+
+    p = sub.add_parser("suite", help="flatten/agent1/agent2/end-to-end throughput and latency")
+    p.add_argument("--alerts", type=int, default=500)
+    p.add_argument("--rounds", type=int, default=3)
+    p.add_argument("--batch-size", type=int, default=64)
+    p.add_argument("--max-enrichments", type=int, default=50)
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--output", help="write machine-readable results to this JSON file")
+    p.set_defaults(func=run_suite)
+
+    p = sub.add_parser("compare", help="compare two suite result files")
+    p.add_argument("baseline")
+    p.add_argument("current")
+    p.add_argument("--threshold", type=float, default=0.10, help="allowed alerts/sec drop (fraction)")
+    p.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    status = args.func(args)
+    if isinstance(status, int):
+        sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
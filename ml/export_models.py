@@ -0,0 +1,108 @@
+"""
+Export the alert classifier into the native artifact format.
+
+    python export_models.py [--models models-50] [--output models-50]
+
+Reads the training pickles (xgb_alert_classifier.pkl, label_encoders.pkl, scaler.pkl,
+feature_names.pkl) and writes next to them:
+
+xgb_alert_classifier.ubj  the booster in XGBoost's UBJSON format
+classifier_meta.npz       feature names, importances, target/encoder classes and scaler
+                          mean/scale as plain arrays (loaded with allow_pickle=False)
+
+app_final loads these in preference to the pickles. The export is checked by reloading
+it and comparing predictions with the pickled model on random rows. Each compiled backend
+(CLASSIFIER_BACKEND=treelite|onnx) whose package is installed is then built from the exported
+booster and must match XGBoost's inplace_predict within --backend-tolerance, else the export
+fails; backends whose package is missing are skipped.
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+# app_final loads its artifacts relative to the ml/ folder
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.getcwd())
+
+from app_final import (  # noqa: E402
+    AlertClassifier, CLASSIFIER_BACKEND_TOLERANCE, CLASSIFIER_FOLD_PROBES, CLASSIFIER_FOLD_SCALER,
+)
+
+BACKENDS = ("treelite", "onnx")
+
+
+def check_backends(clf: AlertClassifier, tolerance: float) -> bool:
+    """
+    Compile every installed backend from the booster app_final would use (scaler folded as in
+    load_model) and compare its probabilities with inplace_predict on the fold probe rows.
+    """
+    clf._compile_encoders()
+    probes = clf._probe_rows(CLASSIFIER_FOLD_PROBES)
+    clf.raw_booster = clf._fold_scaler(probes) if CLASSIFIER_FOLD_SCALER else None
+    booster = clf.raw_booster if clf.raw_booster is not None else clf.booster
+    X = probes if clf.raw_booster is not None else clf._scale(probes)
+    expected = booster.inplace_predict(X)
+    ok = True
+    for name in BACKENDS:
+        compile_backend = getattr(clf, f"_compile_{name}")
+        try:
+            predict = compile_backend(booster)
+        except ImportError as e:
+            print(f"skipped {name} backend check ({e})")
+            continue
+        got = predict(X)
+        if got.shape != expected.shape:
+            print(f"{name} backend returned shape {got.shape}, XGBoost {expected.shape}", file=sys.stderr)
+            ok = False
+            continue
+        diff = float(np.abs(got - expected).max())
+        flipped = int((got.argmax(axis=1) != expected.argmax(axis=1)).sum())
+        if diff > tolerance or flipped:
+            print(f"{name} backend disagrees with XGBoost: max |p diff| {diff:.3g} (tolerance {tolerance:g}), "
+                  f"{flipped} verdicts differ on {len(X)} rows", file=sys.stderr)
+            ok = False
+        else:
+            print(f"{name} backend matches XGBoost on {len(X)} rows (max |p diff| {diff:.3g})")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", default="models-50", help="folder with the training pickles")
+    parser.add_argument("--output", default=None, help="destination folder (default: --models)")
+    parser.add_argument("--check-rows", type=int, default=5000)
+    parser.add_argument("--backend-tolerance", type=float, default=CLASSIFIER_BACKEND_TOLERANCE,
+                        help="max probability difference allowed between a compiled backend and XGBoost")
+    args = parser.parse_args()
+
+    source = AlertClassifier(args.models)
+    source._load_pickles()
+    paths = source.export_native(args.output or args.models)
+
+    exported = AlertClassifier(args.output or args.models)
+    exported._load_native()
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(args.check_rows, len(source.feature_names))) * 3
+    same = (np.array_equal(source.booster.inplace_predict(X), exported.booster.inplace_predict(X))
+            and exported.feature_names == source.feature_names
+            and np.array_equal(exported.feature_importances, source.feature_importances)
+            and list(exported.target_classes) == list(source.target_classes)
+            and np.array_equal(exported.scaler_mean, source.scaler_mean)
+            and np.array_equal(exported.scaler_scale, source.scaler_scale)
+            and all(list(exported.encoder_classes[k]) == list(v) for k, v in source.encoder_classes.items())
+            and exported.encoder_classes.keys() == source.encoder_classes.keys())
+    for path in paths:
+        print(f"wrote {path} ({os.path.getsize(path)} bytes)")
+    if not same:
+        print("exported artifacts do not reproduce the pickled model", file=sys.stderr)
+        sys.exit(1)
+    print(f"verified on {args.check_rows} rows")
+    if not check_backends(exported, args.backend_tolerance):
+        print("compiled backends do not reproduce the exported booster", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
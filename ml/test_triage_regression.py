@@ -0,0 +1,140 @@
+"""
+Regression net for the compiled triage paths.
+
+    python -m pytest -q ml/test_triage_regression.py
+
+- triage parity: TriageAgent results (single and batch) match digests recorded from the
+  per-rule ScoringTool/TriageAgent of the baseline commit (a61cda6) with the clock frozen
+  at FROZEN_NOW, see test_triage_regression.json; alerts the baseline crashed on (null
+  digest, e.g. a missing field hitting re.search) only have to produce a verdict now
+- flatten parity: the iterative/projected flattener matches the recursive one
+- classifier parity: the scaler-folded booster gives bit-identical probabilities
+"""
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import time
+
+import numpy as np
+import pytest
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import bench_triage  # chdirs to ml/ and puts it on sys.path
+    import app_final
+
+ML_DIR = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_FILE = os.path.join(ML_DIR, "test_triage_regression.json")
+FROZEN_NOW = 1756000000
+
+
+def triage_alerts():
+    """Deterministic alert corpus: varied synthetic OCSF alerts plus shape edge cases"""
+    rng = random.Random(20250824)
+    alerts = [bench_triage.make_varied_alert(rng, max_enrichments=8) for _ in range(120)]
+    alerts += [
+        {}, [], {"a": None}, {"a": [[]]}, {"zzz": 1}, [{"severity_id": 5}],
+        {"severity_id": "3"}, {"severity_id": 4.0}, {"severity_id": True},
+        {"threat": {"confidence": "malicious"}, "enrichments": []},
+        {"enrichments": [{"data": {"positives": 12, "total": 70}}]},
+        {"enrichments": [{"data": {"positives": "12"}}, None]},
+    ]
+    return alerts
+
+
+def result_digest(result):
+    """sha256 of the result minus its wall-clock timestamp; json keeps 1 and 1.0 apart"""
+    body = {k: v for k, v in result.items() if k != "timestamp"}
+    return hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode()).hexdigest()
+
+
+@pytest.fixture
+def golden():
+    with open(GOLDEN_FILE) as f:
+        data = json.load(f)
+    assert data["frozen_now"] == FROZEN_NOW
+    return data["digests"]
+
+
+@pytest.fixture
+def frozen_agent(monkeypatch):
+    """Shared TriageAgent with a frozen clock and no result/VT caches in the way"""
+    monkeypatch.setattr(time, "time", lambda: FROZEN_NOW)
+    agent = app_final.triage_agent
+    agent.result_cache.clear()
+    app_final.ScoringTool.rules().vt_cache.clear()
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield agent
+    agent.result_cache.clear()
+    app_final.ScoringTool.rules().vt_cache.clear()
+
+
+def test_triage_matches_baseline(frozen_agent, golden):
+    alerts = triage_alerts()
+    assert len(golden) == len(alerts)
+
+    def analyze(alert):
+        app_final.ScoringTool.rules().vt_cache.clear()
+        frozen_agent.result_cache.clear()
+        return frozen_agent.analyze_alert(alert)
+
+    mismatched = []
+    for i, (alert, expected) in enumerate(zip(alerts, golden)):
+        result = analyze(alert)
+        if expected is None:
+            assert result["prediction"]["predicted_verdict"], f"alert {i} has no verdict"
+        elif result_digest(result) != expected:
+            mismatched.append(i)
+    assert not mismatched, f"alerts {mismatched} differ from baseline"
+
+
+def test_triage_batch_matches_single(frozen_agent):
+    alerts = triage_alerts()
+    single = []
+    for alert in alerts:
+        app_final.ScoringTool.rules().vt_cache.clear()
+        frozen_agent.result_cache.clear()
+        single.append(result_digest(frozen_agent.analyze_alert(alert)))
+    app_final.ScoringTool.rules().vt_cache.clear()
+    frozen_agent.result_cache.clear()
+    batch = [result_digest(r) for r in frozen_agent.analyze_batch(alerts)]
+    assert batch == single
+
+
+def test_flatten_matches_recursive():
+    with contextlib.redirect_stdout(io.StringIO()):
+        for alert in triage_alerts():
+            if not isinstance(alert, (dict, list)):
+                continue
+            flat = app_final.ScoringTool.flatten_alert(alert)
+            assert flat == bench_triage.recursive_flatten(alert)
+            assert list(flat) == list(bench_triage.recursive_flatten(alert))
+
+
+def test_projected_flatten_is_subset():
+    paths = app_final.ScoringTool.rules().paths
+    with contextlib.redirect_stdout(io.StringIO()):
+        for alert in triage_alerts():
+            full = app_final.ScoringTool.flatten_alert(alert)
+            projected = app_final.ScoringTool.flatten_alert(alert, paths=paths)
+            assert all(full[k] == v for k, v in projected.items())
+
+
+def test_folded_classifier_matches_scaler():
+    clf = app_final.AlertClassifier(os.path.join(ML_DIR, "models-50"))
+    try:
+        clf._load_native()
+    except Exception as e:
+        pytest.skip(f"native classifier artifacts unavailable: {e}")
+    clf._compile_encoders()
+    probes = clf._probe_rows(2000)
+    with contextlib.redirect_stdout(io.StringIO()):
+        folded = clf._fold_scaler(probes)
+    assert folded is not None, "scaler could not be folded into the booster"
+    # Fresh rows, not the ones _fold_scaler verified against
+    rng = np.random.default_rng(7)
+    rows = probes[rng.permutation(len(probes))] + rng.integers(-1, 2, size=probes.shape)
+    for X in (probes, rows):
+        assert np.array_equal(folded.inplace_predict(X), clf.booster.inplace_predict(clf._scale(X)))